@@ -1,4 +1,5 @@
 import time
+from typing import Callable
 from pyftdi_cable.spi_communication import SPICommunication
 
 class AMC7836:
@@ -73,9 +74,13 @@ class AMC7836:
         
         self.spi_communication.write_register(address, data)
 
-    def dac_register_update(self):
+    def dac_register_update(self, settle: Callable[[], object] = None):
         self.spi_communication.write_register(0X0F, 0X01)
-        time.sleep(10)
+        if settle is None:
+            time.sleep(10)
+        else:
+            settle()
+            # e.g. a SettlingDetector wait on the affected channel, returns once the output has settled
 
     def disable_dac(self):
         self.spi_communication.write_register(0xB2, 0x00)
@@ -0,0 +1,73 @@
+import json
+import os
+from datetime import datetime
+from typing import Union
+
+
+class BiasCache:
+    """
+    Converged gate DAC codes kept in a JSON file between runs, keyed by DUT id, stage, target drain current
+    and chamber temperature. The stage is the gate DAC data register name, e.g. DACA0_DATA_LO. A lookup
+    between two stored temperatures interpolates the code, and outside the stored temperatures the nearest
+    one is used.
+
+    File layout: {dut_id: {stage: {target: {temperature: {"code", "current", "time"}}}}}
+    """
+
+    def __init__(self, filename: str = 'bias_cache.json', target_resolution: float = 0.0001,
+                 temperature_resolution: float = 0.5):
+        self.filename = filename
+        self.target_resolution = target_resolution  # A, targets closer than this share an entry
+        self.temperature_resolution = temperature_resolution  # C
+        self.entries = {}
+        self.load()
+
+    def load(self) -> None:
+        if os.path.exists(self.filename):
+            with open(self.filename, mode='r') as file:
+                self.entries = json.load(file)
+
+    def save(self) -> None:
+        # Write a new file and swap it in so an interrupted save never leaves a truncated cache
+        temporary = self.filename + '.tmp'
+        with open(temporary, mode='w') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.filename)
+
+    def _target_key(self, target: float) -> str:
+        return f"{round(target / self.target_resolution) * self.target_resolution:.6f}"
+
+    def _temperature_key(self, temperature: float) -> str:
+        return f"{round(temperature / self.temperature_resolution) * self.temperature_resolution:.1f}"
+
+    def store(self, dut_id: str, stage: str, target: float, temperature: float, code: int,
+              current: Union[None, float] = None, save: bool = True) -> None:
+        points = self.entries.setdefault(dut_id, {}).setdefault(stage, {}).setdefault(self._target_key(target), {})
+        points[self._temperature_key(temperature)] = {
+            'code': int(code),
+            'current': current,
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+        if save:
+            self.save()
+
+    def lookup(self, dut_id: str, stage: str, target: float, temperature: float) -> Union[None, int]:
+        """
+        Return the expected code for the condition, None when nothing is stored for the DUT, stage and target.
+        """
+        points = self.entries.get(dut_id, {}).get(stage, {}).get(self._target_key(target), {})
+        if len(points) == 0:
+            return None
+
+        stored = sorted((float(key), point['code']) for key, point in points.items())
+        if temperature <= stored[0][0]:
+            return stored[0][1]
+        if temperature >= stored[-1][0]:
+            return stored[-1][1]
+
+        for (low_temperature, low_code), (high_temperature, high_code) in zip(stored, stored[1:]):
+            if low_temperature <= temperature <= high_temperature:
+                fraction = (temperature - low_temperature) / (high_temperature - low_temperature)
+                return int(round(low_code + fraction * (high_code - low_code)))
@@ -0,0 +1,347 @@
+import math
+import time
+from typing import Union, List, Callable
+
+import numpy
+
+
+class BiasSearchReport:
+
+    def __init__(self, engine: str, target: float, tolerance: float):
+        self.engine = engine
+        self.target = target  # A
+        self.tolerance = tolerance  # A
+        self.codes: List[int] = []
+        self.currents: List[float] = []
+        self.converged = False
+        self.limited = False  # The target needs a code at or above the DAC limit
+        self.elapsed = 0.0  # s
+
+    @property
+    def measurement_count(self) -> int:
+        return len(self.codes)
+
+    def _best_index(self) -> int:
+        errors = [abs(current - self.target) for current in self.currents]
+        return errors.index(min(errors))
+
+    @property
+    def code(self) -> Union[None, int]:
+        # Code of the measurement closest to the target
+        if len(self.codes) == 0:
+            return None
+        return self.codes[self._best_index()]
+
+    @property
+    def current(self) -> Union[None, float]:
+        if len(self.currents) == 0:
+            return None
+        return self.currents[self._best_index()]
+
+    def __str__(self) -> str:
+        if len(self.codes) == 0:
+            return f'{self.engine}: no measurements'
+        status = 'converged' if self.converged else ('limited' if self.limited else 'not converged')
+        return (f'{self.engine}: {status} at code {self.code} ({self.current * 1000:.3f} mA, target '
+                f'{self.target * 1000:.3f} mA) after {self.measurement_count} measurements in {self.elapsed:.2f} s')
+
+
+class BiasSearch:
+    """
+    Step based search for the gate DAC code that gives a target drain current.
+
+    The caller asks next_code() for the code to apply, measures the drain current and hands it to update(),
+    until next_code() returns None. Drain current must rise with the code. Codes that bracket the target are
+    kept, and any proposal outside the bracket is replaced by its midpoint, so every engine converges even
+    when its model is wrong. Subclasses only implement propose().
+    """
+    CODE_LIMIT = 3072  # Codes from here on put the gate above -2.5V
+
+    def __init__(self, tolerance: float = 0.0005, relative_tolerance: float = 0.02, max_measurements: int = 10,
+                 initial_step: int = 32, max_step: int = 256, min_code: int = 0, code_limit: int = CODE_LIMIT):
+        self.tolerance = tolerance  # A
+        self.relative_tolerance = relative_tolerance
+        self.max_measurements = max_measurements
+        self.initial_step = initial_step
+        self.max_step = max_step
+        self.min_code = min_code
+        self.code_limit = code_limit
+        self.report: Union[None, BiasSearchReport] = None
+        self.target = 0.0
+        self._next: Union[None, int] = None
+        self._low = None  # (code, current) of the highest code below the target
+        self._high = None  # (code, current) of the lowest code above the target
+
+    def tolerance_for(self, target: float) -> float:
+        return max(self.tolerance, self.relative_tolerance * abs(target))
+
+    def clamp(self, code: float) -> int:
+        return max(self.min_code, min(self.code_limit - 1, int(round(code))))
+
+    def reset(self, target: float, start_code: int) -> None:
+        self.target = target
+        self.report = BiasSearchReport(self.__class__.__name__, target, self.tolerance_for(target))
+        self._low = None
+        self._high = None
+        self._next = self.clamp(start_code)
+
+    def next_code(self) -> Union[None, int]:
+        return self._next
+
+    @property
+    def done(self) -> bool:
+        return self._next is None
+
+    def update(self, code: int, current: float) -> None:
+        report = self.report
+        report.codes.append(code)
+        report.currents.append(current)
+
+        error = current - self.target
+        if abs(error) <= report.tolerance:
+            report.converged = True
+            self._next = None
+            return
+
+        if error < 0 and (self._low is None or code > self._low[0]):
+            self._low = (code, current)
+        if error > 0 and (self._high is None or code < self._high[0]):
+            self._high = (code, current)
+
+        if report.measurement_count >= self.max_measurements:
+            self._next = None
+            return
+
+        next_code = self.safeguard(self.propose())
+        if next_code in report.codes:
+            # No untried code left between the bracket ends or the search is pinned at a limit
+            report.limited = next_code == self.code_limit - 1 and error < 0
+            self._next = None
+            return
+        self._next = next_code
+
+    def propose(self) -> Union[None, float]:
+        """
+        Return the next code to try, or None to take an expanding step towards the target.
+        """
+        raise NotImplementedError
+
+    def expanding_step(self) -> float:
+        code = self.report.codes[-1]
+        step = min(self.initial_step * 2 ** (self.report.measurement_count - 1), self.max_step)
+        return code + math.copysign(step, self.target - self.report.currents[-1])
+
+    def safeguard(self, proposal: Union[None, float]) -> int:
+        if proposal is None or not math.isfinite(proposal):
+            proposal = self.expanding_step()
+
+        last_code = self.report.codes[-1]
+        proposal = max(last_code - self.max_step, min(last_code + self.max_step, proposal))
+
+        if self._low is not None and self._high is not None:
+            if not self._low[0] < proposal < self._high[0]:
+                proposal = (self._low[0] + self._high[0]) / 2
+            return min(self._high[0] - 1, max(self._low[0] + 1, self.clamp(proposal)))
+        return self.clamp(proposal)
+
+
+class BisectionSearch(BiasSearch):
+    # Expands the step until the target is bracketed, then halves the bracket
+
+    def propose(self) -> Union[None, float]:
+        if self._low is not None and self._high is not None:
+            return (self._low[0] + self._high[0]) / 2
+        return None
+
+
+class SecantSearch(BiasSearch):
+    """
+    Newton steps with the slope taken from the last two measurements. With square_law the steps are taken on
+    sqrt(Id), which is linear in gate voltage above threshold, so a search usually lands in two or three
+    measurements. Before the second measurement the slope is initial_slope, in sqrt(A) or A per code, and
+    without one an expanding step is taken.
+    """
+    SQUARE_LAW_SLOPE = 0.0035  # sqrt(A) per code, beta of about 2 A/V^2 over the 10V/4095 code DAC range
+
+    def __init__(self, square_law: bool = True, initial_slope: Union[None, float] = SQUARE_LAW_SLOPE, **kwargs):
+        super().__init__(**kwargs)
+        self.square_law = square_law
+        self.initial_slope = initial_slope
+
+    def _linearize(self, current: float) -> float:
+        if self.square_law:
+            return math.sqrt(max(current, 0.0))
+        return current
+
+    def propose(self) -> Union[None, float]:
+        if self._low is not None and self._high is not None:
+            # Once bracketed, interpolate between the bracket ends (regula falsi)
+            points = [self._low, self._high]
+        else:
+            points = list(zip(self.report.codes, self.report.currents))[-2:]
+        codes = [point[0] for point in points]
+        values = [self._linearize(point[1]) for point in points]
+
+        if len(points) == 1:
+            slope = self.initial_slope
+        elif codes[-1] != codes[-2]:
+            slope = (values[-1] - values[-2]) / (codes[-1] - codes[-2])
+        else:
+            slope = None
+
+        if slope is None or slope <= 0:
+            return None
+        return codes[-1] + (self._linearize(self.target) - values[-1]) / slope
+
+
+class ExponentialFitSearch(BiasSearch):
+    """
+    Fits ln(Id) against code over the last fit_points measurements and solves the fit for the target.
+    Suits targets near threshold where the drain current rises exponentially with gate voltage.
+    """
+    CURRENT_FLOOR = 1E-6  # A, readings below this are noise and are left out of the fit
+
+    def __init__(self, fit_points: int = 3, codes_per_decade: Union[None, float] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.fit_points = fit_points
+        self.codes_per_decade = codes_per_decade  # Assumed slope until two points are measured
+
+    def propose(self) -> Union[None, float]:
+        points = [(code, current) for code, current in zip(self.report.codes, self.report.currents)
+                  if current > self.CURRENT_FLOOR][-self.fit_points:]
+        if self.target <= self.CURRENT_FLOOR or len(points) == 0:
+            return None
+
+        codes = numpy.array([point[0] for point in points], dtype=float)
+        log_currents = numpy.log([point[1] for point in points])
+
+        if numpy.unique(codes).size >= 2:
+            slope, intercept = numpy.polyfit(codes, log_currents, 1)
+        elif self.codes_per_decade is not None:
+            slope = math.log(10) / self.codes_per_decade
+            intercept = log_currents[-1] - slope * codes[-1]
+        else:
+            return None
+
+        if slope <= 0:
+            return None
+        return (math.log(self.target) - intercept) / slope
+
+
+def run_bias_search(engine: BiasSearch, target: float, start_code: int,
+                    set_code: Callable[[int], None], measure: Callable[[], float]) -> BiasSearchReport:
+    """
+    Drive one engine to the target with set_code applying a DAC code and measure returning the drain current.
+    The DAC is left at the best code found.
+    """
+    start = time.perf_counter()
+    engine.reset(target, start_code)
+
+    code = engine.next_code()
+    while code is not None:
+        set_code(code)
+        engine.update(code, measure())
+        code = engine.next_code()
+
+    report = engine.report
+    if report.codes[-1] != report.code:
+        set_code(report.code)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+class BiasStage:
+
+    def __init__(self, name: str, dac_address_key: str, daq_ch: int, target: float, start_code: int,
+                 engine: Union[None, BiasSearch] = None):
+        self.name = name
+        self.dac_address_key = dac_address_key  # Low byte DAC data register, e.g. DACA0_DATA_LO
+        self.daq_ch = daq_ch  # DAQ channel measuring the stage drain current
+        self.target = target  # A
+        self.start_code = start_code
+        self.engine = SecantSearch() if engine is None else engine
+
+
+class MultiStageBiasReport:
+
+    def __init__(self, stages: List[BiasStage]):
+        self.stages = stages
+        self.rounds: List[dict] = []  # One {stage name: BiasSearchReport} per round
+        self.codes = {stage.name: stage.start_code for stage in stages}
+        self.currents = {stage.name: None for stage in stages}
+        self.steps = 0  # Joint DAC burst and DAQ scan pairs
+        self.converged = False
+        self.elapsed = 0.0  # s
+
+    def __str__(self) -> str:
+        status = 'converged' if self.converged else 'not converged'
+        lines = [f'Multi-stage bias: {status} after {self.steps} steps and {len(self.rounds)} round(s) '
+                 f'in {self.elapsed:.2f} s']
+        for stage in self.stages:
+            current = self.currents[stage.name]
+            current_text = 'not measured' if current is None else f'{current * 1000:.3f} mA'
+            lines.append(f'  {stage.name}: code {self.codes[stage.name]}, {current_text} '
+                         f'(target {stage.target * 1000:.3f} mA)')
+        return '\n'.join(lines)
+
+
+class MultiStageBiasSearch:
+    """
+    Runs one engine per amplifier stage in lockstep. Every step writes the next code of all searching
+    stages in one DAC burst and measures every stage in one DAQ scan, so the time scales with the slowest
+    stage. A stage moving its gate shifts the current of the others, so once every engine has finished all
+    stages are checked together and the ones out of tolerance search again from where they are.
+    """
+
+    def __init__(self, stages: List[BiasStage], max_rounds: int = 3):
+        self.stages = stages
+        self.max_rounds = max_rounds
+
+    def run(self, set_codes: Callable[[dict], None], measure: Callable[[List[BiasStage]], List[float]]
+            ) -> MultiStageBiasReport:
+        """
+        set_codes applies a {stage name: code} dict of every stage at once and measure returns the drain
+        current of each stage in the order given.
+        """
+        start = time.perf_counter()
+        report = MultiStageBiasReport(self.stages)
+        codes = report.codes
+        pending = list(self.stages)
+
+        for _ in range(self.max_rounds):
+            for stage in pending:
+                stage.engine.reset(stage.target, codes[stage.name])
+            report.rounds.append({stage.name: stage.engine.report for stage in pending})
+
+            active = list(pending)
+            while len(active) > 0:
+                for stage in active:
+                    codes[stage.name] = stage.engine.next_code()
+                set_codes(dict(codes))
+                currents = measure(self.stages)
+                report.steps += 1
+
+                for stage, current in zip(self.stages, currents):
+                    report.currents[stage.name] = current
+                    if stage in active:
+                        stage.engine.update(codes[stage.name], current)
+                active = [stage for stage in active if not stage.engine.done]
+
+            # Check every stage together at the best code each engine found
+            best = {stage.name: stage.engine.report.code for stage in pending}
+            if any(codes[name] != code for name, code in best.items()):
+                codes.update(best)
+                set_codes(dict(codes))
+                currents = measure(self.stages)
+                report.steps += 1
+                for stage, current in zip(self.stages, currents):
+                    report.currents[stage.name] = current
+
+            pending = [stage for stage in self.stages
+                       if abs(report.currents[stage.name] - stage.target) > stage.engine.tolerance_for(stage.target)]
+            if len(pending) == 0:
+                report.converged = True
+                break
+
+        report.elapsed = time.perf_counter() - start
+        return report
@@ -0,0 +1,404 @@
+import json
+import os
+import shutil
+from typing import Union, List
+
+import numpy
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+TIMESTAMP_FILE = 'timestamp.i8'
+INDEX_FILE = 'index.i8'
+ACTIVE_FILE = 'ACTIVE'  # Present while a writer appends to the segment, locked by it
+SOURCES_FILE = 'SOURCES'  # Names of the segments a compacted segment replaces
+COMPACT_DIR = 'compact.tmp'  # Merged segment being written
+COMPACTED_DIR = 'compact.done'  # Merged segment complete, the sources may not be deleted yet
+
+
+def _to_ns(value) -> int:
+    return int(numpy.datetime64(value, 'ns').astype(numpy.int64))
+
+
+def _lock(file) -> bool:
+    # Exclusive lock held until the file is closed, False when another open file holds it
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _hold_marker(path: str):
+    file = open(path, mode='a')
+    _lock(file)
+    return file
+
+
+def _stale(marker: str) -> bool:
+    # The lock goes with the process that held it, a marker nobody holds was left by a crash
+    with open(marker, mode='a') as file:
+        return _lock(file)
+
+
+class Segment:
+    """
+    One append-only run of rows, a directory holding a fixed-width file per column and the sparse index.
+    The committed row count is that of the shortest column file, so a row torn by a crash is not seen.
+    """
+
+    def __init__(self, path: str, columns: List[str], dtype: numpy.dtype, index_stride: int):
+        self.path = path
+        self.columns = columns
+        self.dtype = dtype
+        self.index_stride = index_stride
+        self.rows = 0
+        self.timestamps = None  # int64 ns memmap
+        self.values = {}  # column -> memmap
+        self.index = numpy.zeros(0, dtype=numpy.int64)  # Timestamp of every index_stride-th row
+        self.refresh()
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def active(self) -> bool:
+        return os.path.exists(os.path.join(self.path, ACTIVE_FILE))
+
+    def _file(self, column: str) -> str:
+        return os.path.join(self.path, column + '.col')
+
+    def committed_rows(self) -> int:
+        rows = os.path.getsize(os.path.join(self.path, TIMESTAMP_FILE)) // 8
+        for column in self.columns:
+            rows = min(rows, os.path.getsize(self._file(column)) // self.dtype.itemsize)
+        return rows
+
+    def refresh(self) -> None:
+        # Map the rows written since the last refresh, already mapped views stay valid
+        rows = self.committed_rows()
+        if rows == self.rows and self.timestamps is not None:
+            return
+        self.rows = rows
+        if rows == 0:
+            self.timestamps = numpy.zeros(0, dtype=numpy.int64)
+            self.values = {column: numpy.zeros(0, dtype=self.dtype) for column in self.columns}
+        else:
+            self.timestamps = numpy.memmap(os.path.join(self.path, TIMESTAMP_FILE), dtype=numpy.int64,
+                                           mode='r', shape=(rows,))
+            self.values = {column: numpy.memmap(self._file(column), dtype=self.dtype, mode='r', shape=(rows,))
+                           for column in self.columns}
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(index_path):
+            self.index = numpy.fromfile(index_path, dtype=numpy.int64)
+
+    def locate(self, timestamp: int, side: str = 'left') -> int:
+        """
+        Row position of timestamp as numpy.searchsorted would return it, only touching the index block it
+        falls in instead of the whole timestamp column.
+        """
+        indexed = min(self.index.size, (self.rows + self.index_stride - 1) // self.index_stride)
+        block = int(numpy.searchsorted(self.index[:indexed], timestamp, side)) - 1
+        low = max(0, block * self.index_stride)
+        high = self.rows if block + 1 >= indexed else (block + 1) * self.index_stride
+        # Rows past the last index entry, still being written, are searched directly
+        return low + int(numpy.searchsorted(self.timestamps[low:high], timestamp, side))
+
+    @property
+    def first_time(self) -> Union[None, int]:
+        return int(self.timestamps[0]) if self.rows > 0 else None
+
+    @property
+    def last_time(self) -> Union[None, int]:
+        return int(self.timestamps[-1]) if self.rows > 0 else None
+
+
+class StoreWindow:
+    """
+    Rows of a time range. Each part is a tuple of timestamp and column views into one segment's memory
+    maps, no data is copied until timestamps or column() is asked to join several segments.
+    """
+
+    def __init__(self, columns: List[str], parts: List[tuple]):
+        self.columns = columns
+        self.parts = parts  # (timestamps int64 view, {column: view})
+
+    @property
+    def rows(self) -> int:
+        return sum(part[0].size for part in self.parts)
+
+    @property
+    def zero_copy(self) -> bool:
+        return len(self.parts) <= 1
+
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        if len(self.parts) == 0:
+            return numpy.zeros(0, dtype='datetime64[ns]')
+        if len(self.parts) == 1:
+            return self.parts[0][0].view('datetime64[ns]')
+        return numpy.concatenate([part[0] for part in self.parts]).view('datetime64[ns]')
+
+    def column(self, name: str) -> numpy.ndarray:
+        if len(self.parts) == 0:
+            return numpy.zeros(0)
+        if len(self.parts) == 1:
+            return self.parts[0][1][name]
+        return numpy.concatenate([part[1][name] for part in self.parts])
+
+    def decimate(self, max_points: int) -> 'StoreWindow':
+        # Every n-th row so at most about max_points remain, strided views keep it zero copy
+        step = max(1, -(-self.rows // max_points))
+        return StoreWindow(self.columns, [(timestamps[::step], {name: view[::step] for name, view in values.items()})
+                                          for timestamps, values in self.parts])
+
+
+class StoreWriter:
+    """
+    Appends rows to a new segment. Rows must come in time order. Every append is flushed so readers in
+    other processes see it at their next refresh, fsync() makes it durable.
+    """
+
+    def __init__(self, store: 'HtolStore', path: str):
+        self.store = store
+        self.path = path
+        os.makedirs(path)
+        self._active = _hold_marker(os.path.join(path, ACTIVE_FILE))
+        self._timestamps = open(os.path.join(path, TIMESTAMP_FILE), mode='ab')
+        self._index = open(os.path.join(path, INDEX_FILE), mode='ab')
+        self._values = {column: open(os.path.join(path, column + '.col'), mode='ab') for column in store.columns}
+        self.rows = 0
+        self.last_time = store.last_time()
+
+    def append(self, timestamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        """
+        Append rows, timestamps as datetime64 and values as rows x columns in the store's column order.
+        """
+        stamps = numpy.asarray(timestamps, dtype='datetime64[ns]').view(numpy.int64)
+        values = numpy.asarray(values, dtype=self.store.dtype).reshape(stamps.size, len(self.store.columns))
+        if stamps.size == 0:
+            return
+        if numpy.any(numpy.diff(stamps) < 0) or (self.last_time is not None and stamps[0] < self.last_time):
+            raise Exception('htol_store.py: Rows must be appended in time order.')
+
+        for index, column in enumerate(self.store.columns):
+            self._values[column].write(numpy.ascontiguousarray(values[:, index]).tobytes())
+            self._values[column].flush()
+        self._timestamps.write(stamps.tobytes())
+        self._timestamps.flush()
+        # Timestamps go last, a row only counts once every column of it is on disk
+
+        positions = numpy.arange(self.rows, self.rows + stamps.size)
+        indexed = stamps[positions % self.store.index_stride == 0]
+        if indexed.size > 0:
+            self._index.write(indexed.tobytes())
+            self._index.flush()
+
+        self.rows += stamps.size
+        self.last_time = int(stamps[-1])
+
+    # Same call as MeasurementLogger so a scan can feed either
+    log_rows = append
+
+    def fsync(self) -> None:
+        for file in [self._timestamps, self._index] + list(self._values.values()):
+            os.fsync(file.fileno())
+
+    def close(self) -> None:
+        self.fsync()
+        for file in [self._timestamps, self._index, self._active] + list(self._values.values()):
+            file.close()
+        os.remove(os.path.join(self.path, ACTIVE_FILE))
+
+    def __enter__(self) -> 'StoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class HtolStore:
+    """
+    On-disk store of measurement streams for long HTOL runs.
+
+    Every channel is a fixed-width column file, memory-mapped for reading. Each writer session appends a
+    new segment, so acquisition keeps writing while other processes query. A sparse index holding the
+    timestamp of every index_stride-th row finds a time range by touching only two small blocks of the
+    timestamp column, and the query returns views into the memory maps.
+
+    compact() merges the closed segments into one, which also drops rows torn by a crash and rows that
+    overlap in time, so later queries are single views again. Opening the store finishes a compaction that
+    crashed after the merged segment was complete and clears the ACTIVE marker of writers that crashed.
+
+    Layout: root/store.json, root/segments/<000001>/{timestamp.i8, index.i8, <column>.col}
+    """
+
+    def __init__(self, root: str, columns: Union[None, List[str]] = None, dtype: str = 'float64',
+                 index_stride: int = 4096):
+        self.root = root
+        meta_path = os.path.join(root, 'store.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, mode='r') as file:
+                meta = json.load(file)
+            if columns is not None and columns != meta['columns']:
+                raise Exception(f"htol_store.py: Store {root} has columns {meta['columns']}, not {columns}.")
+        else:
+            if columns is None:
+                raise Exception(f'htol_store.py: Columns are needed to create the store {root}.')
+            meta = {'columns': columns, 'dtype': dtype, 'index_stride': index_stride}
+            os.makedirs(os.path.join(root, 'segments'), exist_ok=True)
+            with open(meta_path, mode='w') as file:
+                json.dump(meta, file, indent=2)
+
+        self.columns = meta['columns']
+        self.dtype = numpy.dtype(meta['dtype'])
+        self.index_stride = meta['index_stride']
+        self._segments = {}  # name -> Segment, kept so refreshes only map new rows
+        self.recover()
+
+    def _segment_dir(self) -> str:
+        return os.path.join(self.root, 'segments')
+
+    def recover(self) -> None:
+        """
+        Clean up after crashed processes: finish a compaction whose merged segment was complete, drop one
+        that was not, and clear the ACTIVE marker of segments whose writer is gone.
+        """
+        segment_dir = self._segment_dir()
+        if os.path.exists(os.path.join(segment_dir, COMPACTED_DIR)):
+            self._finish_compaction()
+        target = os.path.join(segment_dir, COMPACT_DIR)
+        if os.path.exists(target) and _stale(os.path.join(target, ACTIVE_FILE)):
+            shutil.rmtree(target)
+        for name in os.listdir(segment_dir):
+            marker = os.path.join(segment_dir, name, ACTIVE_FILE)
+            if name.isdigit() and os.path.exists(marker) and _stale(marker):
+                os.remove(marker)
+
+    def _finish_compaction(self) -> None:
+        # The merged segment is complete, delete its sources and give it the name of the first of them
+        done = os.path.join(self._segment_dir(), COMPACTED_DIR)
+        with open(os.path.join(done, SOURCES_FILE), mode='r') as file:
+            names = json.load(file)
+        self._segments = {}
+        for name in names:
+            path = os.path.join(self._segment_dir(), name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        first = os.path.join(self._segment_dir(), names[0])
+        os.replace(done, first)
+        os.remove(os.path.join(first, SOURCES_FILE))
+
+    def segments(self) -> List[Segment]:
+        names = sorted(name for name in os.listdir(self._segment_dir()) if name.isdigit())
+        for name in list(self._segments):
+            if name not in names:
+                del self._segments[name]
+        for name in names:
+            if name in self._segments:
+                self._segments[name].refresh()
+            else:
+                self._segments[name] = Segment(os.path.join(self._segment_dir(), name), self.columns, self.dtype,
+                                               self.index_stride)
+        return [self._segments[name] for name in names]
+
+    def last_time(self) -> Union[None, int]:
+        times = [segment.last_time for segment in self.segments() if segment.rows > 0]
+        return times[-1] if len(times) > 0 else None
+
+    def time_range(self) -> tuple:
+        segments = [segment for segment in self.segments() if segment.rows > 0]
+        if len(segments) == 0:
+            return None, None
+        return (numpy.datetime64(segments[0].first_time, 'ns'), numpy.datetime64(segments[-1].last_time, 'ns'))
+
+    def rows(self) -> int:
+        return sum(segment.rows for segment in self.segments())
+
+    def writer(self) -> StoreWriter:
+        names = [int(name) for name in os.listdir(self._segment_dir()) if name.isdigit()]
+        return StoreWriter(self, os.path.join(self._segment_dir(), f'{max(names, default=0) + 1:06d}'))
+
+    def query(self, start=None, end=None, columns: Union[None, List[str]] = None) -> StoreWindow:
+        """
+        Rows with start <= timestamp < end, either may be None for an open end. Times are anything
+        numpy.datetime64 accepts.
+        """
+        columns = self.columns if columns is None else columns
+        start_ns = None if start is None else _to_ns(start)
+        end_ns = None if end is None else _to_ns(end)
+
+        parts = []
+        for segment in self.segments():
+            if segment.rows == 0:
+                continue
+            if (end_ns is not None and segment.first_time >= end_ns) or \
+                    (start_ns is not None and segment.last_time < start_ns):
+                continue
+            low = 0 if start_ns is None else segment.locate(start_ns, 'left')
+            high = segment.rows if end_ns is None else segment.locate(end_ns, 'left')
+            if high > low:
+                parts.append((segment.timestamps[low:high],
+                              {column: segment.values[column][low:high] for column in columns}))
+        return StoreWindow(columns, parts)
+
+    def compact(self, chunk_rows: int = 1 << 20) -> int:
+        """
+        Merge every closed segment into one, copying chunk_rows at a time so memory stays bounded. Rows not
+        later than the previous kept row are dropped. Returns the number of rows dropped.
+        """
+        self.recover()
+        closed = [segment for segment in self.segments() if not segment.active]
+        if len(closed) <= 1:
+            return 0
+
+        target = os.path.join(self._segment_dir(), COMPACT_DIR)
+        if os.path.exists(target):
+            raise Exception(f'htol_store.py: Store {self.root} is being compacted by another process.')
+        os.makedirs(target)
+        active = _hold_marker(os.path.join(target, ACTIVE_FILE))
+        timestamps = open(os.path.join(target, TIMESTAMP_FILE), mode='wb')
+        index = open(os.path.join(target, INDEX_FILE), mode='wb')
+        values = {column: open(os.path.join(target, column + '.col'), mode='wb') for column in self.columns}
+
+        rows, dropped, last = 0, 0, None
+        for segment in closed:
+            for low in range(0, segment.rows, chunk_rows):
+                stamps = numpy.array(segment.timestamps[low:low + chunk_rows])
+                keep = numpy.ones(stamps.size, dtype=bool)
+                keep[1:] = stamps[1:] > stamps[:-1]
+                if last is not None:
+                    keep &= stamps > last
+                dropped += int(stamps.size - keep.sum())
+                stamps = stamps[keep]
+                if stamps.size == 0:
+                    continue
+
+                for column in self.columns:
+                    values[column].write(numpy.array(segment.values[column][low:low + chunk_rows])[keep].tobytes())
+                timestamps.write(stamps.tobytes())
+                positions = numpy.arange(rows, rows + stamps.size)
+                index.write(stamps[positions % self.index_stride == 0].tobytes())
+                rows += stamps.size
+                last = int(stamps[-1])
+
+        sources = open(os.path.join(target, SOURCES_FILE), mode='w')
+        json.dump([segment.name for segment in closed], sources)
+        for file in [timestamps, index, sources] + list(values.values()):
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+        active.close()
+        os.remove(os.path.join(target, ACTIVE_FILE))
+
+        # Renamed before any source is deleted, from here on recover() completes the swap after a crash
+        os.replace(target, os.path.join(self._segment_dir(), COMPACTED_DIR))
+        # The merged segment takes the name of the first one so the order of segments is kept
+        self._finish_compaction()
+        return dropped
@@ -0,0 +1,306 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Callable
+
+from instrument_lib.dac.amc7836 import Amc7836
+
+
+class InterlockChannel:
+    """
+    Drain current limit of one stage, sensed on one of the AMC7836 unipolar inputs LV_ADC16 to LV_ADC20.
+    """
+
+    def __init__(self, name: str, adc_input: int, trip_current: float, volts_per_amp: float = 1.0,
+                 hysteresis_codes: int = 8):
+        if adc_input < 16 or adc_input > 20:
+            raise Exception('interlock.py: Alarm thresholds exist for ADC inputs 16 to 20 only.')
+        self.name = name
+        self.adc_input = adc_input
+        self.trip_current = trip_current  # A
+        self.volts_per_amp = volts_per_amp  # Current sense gain
+        self.hysteresis_codes = hysteresis_codes
+
+    @property
+    def bit(self) -> int:
+        # Same bit in ALARM_STAT0, DAC_CLR_SRC0, ALARMOUT_SRC0 and ADC_MUX2
+        return 1 << (self.adc_input - 16)
+
+    @property
+    def upper_code(self) -> int:
+        code = int(round(self.trip_current * self.volts_per_amp / HardwareInterlock.ADC_LSB_V))
+        return max(0, min(0xFFF, code))
+
+
+class AlarmStatus:
+
+    def __init__(self, raw: List[int], read_time: float):
+        self.raw = raw  # ALARM_STAT0, ALARM_STAT1, GEN_STAT
+        self.read_time = read_time  # time.perf_counter() when the read returned
+
+    @property
+    def adc_alarms(self) -> int:
+        return self.raw[0] & 0x1F
+
+    @property
+    def tripped(self) -> bool:
+        # GALR is the OR of every alarm bit, the thermal alarm included
+        return self.adc_alarms != 0 or (self.raw[1] & 0x04) != 0 or (self.raw[2] & 0x02) != 0
+
+    def names(self, channels: List[InterlockChannel]) -> List[str]:
+        names = [channel.name for channel in channels if self.adc_alarms & channel.bit]
+        if self.raw[1] & 0x04:
+            names.append('THERM')
+        return names
+
+
+class HardwareInterlock:
+    """
+    First layer of the over-current interlock, run by the AMC7836 itself. Each stage's drain current
+    sense goes to an LV_ADC input with an upper alarm threshold. The alarm clears the gate DACs to code 0,
+    which pinches the stages off, and drives ALARMOUT. The host takes no part in the clear.
+
+    Reading the alarm status registers clears latched alarms whose cause has gone.
+    """
+    ADC_LSB_V = 5.0 / 4096  # V per code on the 0 to 2 x Vref unipolar inputs
+    ADC_CFG_AUTO = 0x90  # CMODE auto conversion, ADC-REF-BUFF enabled
+    FALSE_ALARM_SAMPLES = {1: 0x00, 4: 0x20, 8: 0x40, 16: 0x60, 32: 0x80, 64: 0xA0, 128: 0xC0, 256: 0xE0}
+
+    def __init__(self, amc7836: Amc7836, channels: List[InterlockChannel], clear_dacs: List[str],
+                 false_alarm_samples: int = 4):
+        if false_alarm_samples not in self.FALSE_ALARM_SAMPLES:
+            raise Exception(f'interlock.py: False alarm count must be one of {sorted(self.FALSE_ALARM_SAMPLES)}.')
+        self._amc7836 = amc7836
+        self.channels = channels
+        self.clear_dacs = clear_dacs  # DAC data register names of the gates to clear, e.g. 'DACA0_DATA_LO'
+        self.false_alarm_samples = false_alarm_samples  # Consecutive samples over the threshold before a trip
+
+    def _address(self, key: str) -> int:
+        return self._amc7836.REGISTER_ADDRESSES[key]
+
+    def _clear_mask(self) -> int:
+        # DAC n is bit n of DAC_CLR_EN0/1 and DAC_CLR0/1, its data register is 0x50 + 2n
+        mask = 0
+        for key in self.clear_dacs:
+            mask |= 1 << ((self._address(key) - self._address('DACA0_DATA_LO')) // 2)
+        return mask
+
+    def _update_register(self, key: str, set_bits: int) -> None:
+        value = self._amc7836.read_register(self._address(key), 1)
+        # A one register read returns an int, longer reads a list
+        self._amc7836.write_register(self._address(key), value | set_bits)
+
+    def program(self) -> None:
+        """
+        Program the thresholds and the alarm routing, then start the ADC converting continuously.
+        """
+        adc_bits = 0
+        for channel in self.channels:
+            code = channel.upper_code
+            self._amc7836.write_register(self._address(f'ADC{channel.adc_input}_UP_THR_LO'),
+                                         [code & 0xFF, code >> 8, 0x00, 0x00])
+            # Upper and lower threshold in one burst, the lower one at 0 never trips
+            self._amc7836.write_register(self._address(f'ADC{channel.adc_input}_HYST'), channel.hysteresis_codes & 0x7F)
+            adc_bits |= channel.bit
+
+        mask = self._clear_mask()
+        self._amc7836.write_register(self._address('FALSE_ALARM_CFG'),
+                                     self.FALSE_ALARM_SAMPLES[self.false_alarm_samples] | 0x10)
+        # 0x10 is TEMP-FALR-CT 10, the temperature alarm needs 4 consecutive samples
+        self._amc7836.write_register(self._address('DAC_CLR_EN0'), [mask & 0xFF, mask >> 8])
+        self._amc7836.write_register(self._address('DAC_CLR_SRC0'), [adc_bits, 0x04])
+        # Clear on the drain current alarms and on the die thermal alarm
+        self._amc7836.write_register(self._address('ALARMOUT_SRC0'), [adc_bits, 0x04])
+        # ALARM-LATCH-DIS stays 0 so a short over-current is still seen by the watchdog
+        self._update_register('GPIO_CFG', 0x02)
+        # GPIO1 becomes ALARMOUT
+
+        self._update_register('ADC_MUX2', adc_bits)
+        self._update_register('ADC_PD2', 0x01)
+        # Power up the ADC, PREF is left as configured
+        self._amc7836.write_register(self._address('ADC_CFG'), self.ADC_CFG_AUTO)
+        self._amc7836.write_register(self._address('ADC_TRIG'), 0x01)
+
+        self.read_status()
+        # Drop alarms latched before the thresholds were set
+
+    def read_status(self) -> AlarmStatus:
+        # Both alarm status registers and the general status in one SPI transaction
+        raw = self._amc7836.read_register(self._address('ALARM_STAT0'), 3)
+        return AlarmStatus(list(raw), time.perf_counter())
+
+    def clear_dacs_now(self) -> None:
+        # Software clear of the same gate DACs, for trips the chip did not see itself
+        mask = self._clear_mask()
+        self._amc7836.write_register(self._address('DAC_CLR0'), [mask & 0xFF, mask >> 8])
+
+    def release(self) -> None:
+        """
+        Stop clearing on alarms and take the gate DACs out of the clear state. The DACs return to the codes
+        in their data registers, so those must be safe before calling this.
+        """
+        self._amc7836.write_register(self._address('DAC_CLR_SRC0'), [0x00, 0x00])
+        self._amc7836.write_register(self._address('ALARMOUT_SRC0'), [0x00, 0x00])
+        self._amc7836.write_register(self._address('DAC_CLR0'), [0x00, 0x00])
+
+
+class TripReport:
+
+    def __init__(self, status: AlarmStatus, alarms: List[str], last_clear_poll: float):
+        self.status = status
+        self.alarms = alarms
+        self.last_clear_poll = last_clear_poll  # perf_counter of the last poll without an alarm
+        self.actions = {}  # action name -> (seconds from detection to done, error or None)
+        self.safe_time = None  # perf_counter when the last action finished
+
+    @property
+    def detection_window(self) -> float:
+        # The trip happened at most this long before the watchdog saw it
+        return self.status.read_time - self.last_clear_poll
+
+    @property
+    def shutdown_latency(self) -> float:
+        return self.safe_time - self.status.read_time
+
+    @property
+    def trip_to_safe(self) -> float:
+        # Upper bound, from the last poll that was still clear
+        return self.safe_time - self.last_clear_poll
+
+    @property
+    def succeeded(self) -> bool:
+        return all(error is None for _, error in self.actions.values())
+
+    def __str__(self) -> str:
+        lines = [f"Interlock trip: {', '.join(self.alarms) or 'unknown'} "
+                 f"(status 0x{self.status.raw[0]:02X} 0x{self.status.raw[1]:02X} 0x{self.status.raw[2]:02X})",
+                 f"  detected within {self.detection_window * 1000:.2f} ms, shutdown {self.shutdown_latency * 1000:.2f} ms, "
+                 f"trip to safe <= {self.trip_to_safe * 1000:.2f} ms"]
+        for name, (elapsed, error) in sorted(self.actions.items(), key=lambda item: item[1][0]):
+            lines.append(f"  {name:<12} {elapsed * 1000:8.2f} ms  {'FAILED: ' + str(error) if error else 'ok'}")
+        return '\n'.join(lines)
+
+
+class InterlockWatchdog:
+    """
+    Second layer of the over-current interlock. A background thread polls the AMC7836 alarm status and, on
+    a trip, runs every shutdown action at once on its own thread, so the slowest supply sets the latency
+    rather than the sum of them. The watchdog latches after a trip and has to be armed again.
+
+    read_status runs under lock, which must be the lock of everything else using the FTDI cable. Reading
+    the status clears the latched alarm, and with it the hardware clear of the gate DACs, which then go back
+    to their codes. clear_gates, e.g. HardwareInterlock.clear_dacs_now, is therefore called before the lock
+    is let go, ahead of the shutdown actions.
+    """
+
+    def __init__(self, read_status: Callable[[], AlarmStatus], shutdown_actions: dict,
+                 channels: Union[None, List[InterlockChannel]] = None, poll_interval: float = 0.005,
+                 lock: Union[None, threading.RLock] = None,
+                 on_trip: Union[None, Callable[[TripReport], None]] = None,
+                 clear_gates: Union[None, Callable[[], None]] = None):
+        self.read_status = read_status
+        self.clear_gates = clear_gates
+        self.shutdown_actions = shutdown_actions  # name -> callable
+        self.channels = [] if channels is None else channels
+        self.poll_interval = poll_interval  # s
+        self.lock = threading.RLock() if lock is None else lock
+        self.on_trip = on_trip
+        self.polls = 0
+        self.poll_errors = 0
+        self.report: Union[None, TripReport] = None
+        self.tripped = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def _clear_gates(self, report: TripReport) -> None:
+        # Called with lock held, so nothing else reaches the chip between the status read and the clear
+        if self.clear_gates is None:
+            return
+        error = None
+        try:
+            self.clear_gates()
+        except Exception as exception:
+            error = exception
+        report.actions['clear_gates'] = (time.perf_counter() - report.status.read_time, error)
+
+    def trip(self, status: AlarmStatus, last_clear_poll: float) -> TripReport:
+        """
+        Clear the gates, then run all shutdown actions concurrently and wait for them. Also used to trip from
+        the host side.
+        """
+        if self._executor is None:
+            raise Exception('interlock.py: The watchdog must be armed to trip.')
+        report = TripReport(status, status.names(self.channels), last_clear_poll)
+        with self.lock:
+            self._clear_gates(report)
+        return self._shut_down(report)
+
+    def _shut_down(self, report: TripReport) -> TripReport:
+        status = report.status
+
+        def run(name: str, action: Callable) -> None:
+            error = None
+            try:
+                action()
+            except Exception as exception:
+                error = exception
+            report.actions[name] = (time.perf_counter() - status.read_time, error)
+
+        futures = [self._executor.submit(run, name, action) for name, action in self.shutdown_actions.items()]
+        for future in futures:
+            future.result()
+        report.safe_time = time.perf_counter()
+
+        self.report = report
+        self.tripped.set()
+        if self.on_trip is not None:
+            self.on_trip(report)
+        return report
+
+    def _run(self) -> None:
+        last_clear_poll = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                with self.lock:
+                    status = self.read_status()
+                    if status.tripped:
+                        report = TripReport(status, status.names(self.channels), last_clear_poll)
+                        self._clear_gates(report)
+            except Exception as error:
+                self.poll_errors += 1
+                print(f'interlock.py: Alarm status read failed: {error}')
+                self._stop.wait(self.poll_interval)
+                continue
+            self.polls += 1
+
+            if status.tripped:
+                self._shut_down(report)
+                return
+            last_clear_poll = status.read_time
+            self._stop.wait(self.poll_interval)
+
+    def arm(self) -> None:
+        if self._thread is not None:
+            return
+        self.report = None
+        self.tripped.clear()
+        self._stop.clear()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.shutdown_actions)),
+                                                thread_name_prefix='interlock-shutdown')
+            for future in [self._executor.submit(time.sleep, 0.01) for _ in self.shutdown_actions]:
+                future.result()
+            # Start the shutdown threads now instead of on the first trip
+        self._thread = threading.Thread(target=self._run, name='interlock-watchdog', daemon=True)
+        self._thread.start()
+
+    def disarm(self) -> Union[None, TripReport]:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        return self.report
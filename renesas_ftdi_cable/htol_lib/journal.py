@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class RunState:
+    """
+    State of an HTOL run folded from its journal, the latest value of everything that was set.
+    """
+
+    def __init__(self):
+        self.registers = {}  # AMC7836 configuration writes, start address -> values
+        self.dac_codes = {}  # DAC data register low byte address -> code
+        self.supplies = {}  # Supply name -> configure_outputs arguments, in the order last set
+        self.scan = None  # Scan settings, start time and sweeps logged
+        self.started = False
+        self.finished = False
+        self.last_sequence = 0
+
+    def apply(self, record: dict) -> None:
+        kind = record['kind']
+        if kind == 'snapshot':
+            state = record['state']
+            self.registers = {int(address): values for address, values in state['registers'].items()}
+            self.dac_codes = {int(address): code for address, code in state['dac_codes'].items()}
+            self.supplies = state['supplies']
+            self.scan = state['scan']
+            self.started = state['started']
+            self.finished = state['finished']
+        elif kind == 'run':
+            self.started = record['state'] == 'started'
+            self.finished = record['state'] == 'finished'
+        elif kind == 'registers':
+            self.registers[record['address']] = record['values']
+        elif kind == 'dac_codes':
+            self.dac_codes.update({int(address): code for address, code in record['codes'].items()})
+        elif kind == 'supply':
+            self.supplies.pop(record['name'], None)
+            self.supplies[record['name']] = record['settings']
+        elif kind == 'scan':
+            self.scan = dict(record['settings'], start_time=None, sweeps=0, finished=False)
+        elif kind == 'scan_start' and self.scan is not None:
+            self.scan['start_time'] = record['start_time']
+        elif kind == 'scan_progress' and self.scan is not None:
+            self.scan['sweeps'] = record['sweeps']
+        elif kind == 'scan_end' and self.scan is not None:
+            self.scan['finished'] = True
+        self.last_sequence = record['seq']
+
+    def to_dict(self) -> dict:
+        return {'registers': {str(address): values for address, values in self.registers.items()},
+                'dac_codes': {str(address): code for address, code in self.dac_codes.items()},
+                'supplies': self.supplies, 'scan': self.scan, 'started': self.started, 'finished': self.finished}
+
+    @property
+    def scan_in_progress(self) -> bool:
+        return self.scan is not None and not self.scan['finished']
+
+
+class RunJournal:
+    """
+    Write-ahead journal of every state-changing action of an HTOL run, one JSON object per line.
+
+    A record is written and fsynced before the action it describes is sent to the hardware, so after a
+    crash the journal holds at least everything that may have been applied. replay() folds the journal
+    into a RunState, ignoring a last line torn by the crash. Once max_records records follow the last
+    snapshot the journal is rewritten as a single snapshot of the state, which keeps it short over a
+    multi-week run. Records may come from several threads, e.g. the regulator and the interlock watchdog.
+    """
+
+    def __init__(self, filename: str = 'htol_journal.jsonl', fsync: bool = True, max_records: int = 10000):
+        self.filename = filename
+        self.fsync = fsync
+        self.max_records = max_records
+        self._trim_torn_line()
+        self.state = self.replay()
+        self._sequence = self.state.last_sequence
+        self._records_since_snapshot = 0
+        self._lock = threading.Lock()
+        self._file = open(self.filename, mode='a')
+
+    def _trim_torn_line(self) -> None:
+        # Cut a last line left unfinished by a crash so new records do not run on from it
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, mode='rb+') as file:
+            data = file.read()
+            if len(data) > 0 and not data.endswith(b'\n'):
+                file.truncate(data.rfind(b'\n') + 1)
+
+    def replay(self) -> RunState:
+        state = RunState()
+        if not os.path.exists(self.filename):
+            return state
+        with open(self.filename, mode='r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                # Only the last line can be torn, nothing after it was written
+                state.apply(record)
+        return state
+
+    def record(self, kind: str, **fields) -> None:
+        with self._lock:
+            self._sequence += 1
+            record = dict(seq=self._sequence, time=datetime.now().isoformat(timespec='milliseconds'), kind=kind,
+                          **fields)
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.state.apply(record)
+
+            self._records_since_snapshot += 1
+            if self._records_since_snapshot >= self.max_records:
+                self._snapshot()
+
+    def snapshot(self) -> None:
+        with self._lock:
+            self._snapshot()
+
+    def _snapshot(self) -> None:
+        # Replace the journal by one record holding the folded state, swapped in atomically
+        self._sequence += 1
+        record = {'seq': self._sequence, 'time': datetime.now().isoformat(timespec='milliseconds'),
+                  'kind': 'snapshot', 'state': self.state.to_dict()}
+        temporary = self.filename + '.tmp'
+        with open(temporary, mode='w') as file:
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(temporary, self.filename)
+        self._file = open(self.filename, mode='a')
+        self._records_since_snapshot = 0
+
+    def start_run(self) -> None:
+        # A new run starts from an empty state
+        with self._lock:
+            self.state = RunState()
+            self._snapshot()
+        self.record('run', state='started')
+
+    def finish_run(self) -> None:
+        self.record('run', state='finished')
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,263 @@
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Union, List, Callable
+
+from instrument_lib.dac.ftdi_base import FtdiBase
+from instrument_lib.instrument_base import InstrumentBase
+
+
+class DutConfig:
+    """
+    One DUT in the chamber: the FT2232H cable driving its AMC7836, the DAQ channels of its stages and the
+    supply channels feeding it.
+    """
+
+    def __init__(self, name: str, ftdi_serial: str, stages: List[dict], supply_channels: Union[None, dict] = None):
+        self.name = name
+        self.ftdi_serial = ftdi_serial  # 8 character cable serial, ports A and B add a suffix
+        self.stages = stages  # BiasStage keyword arguments, e.g. name, dac_address_key, daq_ch, target, start_code
+        self.supply_channels = {} if supply_channels is None else supply_channels
+        # Shared supply name -> channels of the DUT's rails, e.g. {'e36312a': [2, 3]}
+
+    @property
+    def daq_channels(self) -> List[int]:
+        return list(dict.fromkeys(stage['daq_ch'] for stage in self.stages))
+
+
+def discover_cables() -> List[str]:
+    """
+    Serials of the FT2232H cables on the bus, only cables with both the A (SPI) and B (level shifter) port.
+    """
+    serials = FtdiBase.list_serials("DEVICE_2232H")
+    ports = set(serials)
+    return sorted(serial[:-1] for serial in serials if serial.endswith('A') and serial[:-1] + 'B' in ports)
+
+
+class BrokerClient:
+    # Picklable handle a worker process uses to call the shared instruments
+
+    def __init__(self, worker: str, requests: multiprocessing.Queue, responses: multiprocessing.Queue):
+        self.worker = worker
+        self._requests = requests
+        self._responses = responses
+        self._count = 0
+
+    def call(self, instrument: str, method: str, *args, **kwargs):
+        self._count += 1
+        self._requests.put((self.worker, self._count, instrument, method, args, kwargs))
+        request_id, ok, result = self._responses.get()
+        if request_id != self._count:
+            raise Exception(f'orchestrator.py: Response {request_id} does not match request {self._count}.')
+        if not ok:
+            raise Exception(result)
+        return result
+
+
+class InstrumentProxy:
+    # Stands in for a shared instrument in a worker, every method call goes through the broker
+
+    def __init__(self, client: BrokerClient, instrument: str):
+        self._client = client
+        self._instrument = instrument
+
+    def __getattr__(self, method: str) -> Callable:
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self._client.call(self._instrument, method, *args, **kwargs)
+
+
+class InstrumentBroker:
+    """
+    Owns the shared instruments in the parent process and executes the calls of every worker in turn.
+    Requests arriving within coalesce_window of each other are batched, and the read_voltage calls of a
+    batch with the same profile are merged into one multi-channel DAQ read. With many DUTs the DAQ then
+    scans once for all of them instead of once per DUT.
+    """
+    COALESCED_METHODS = ['read_voltage']
+
+    def __init__(self, instruments: dict, coalesce_window: float = 0.002):
+        self.instruments = instruments  # name -> instrument object
+        self.coalesce_window = coalesce_window  # s
+        self.requests = multiprocessing.Queue()
+        self.responses = {}
+        self.request_count = 0
+        self.call_count = 0  # Instrument calls made, fewer than requests when reads are merged
+        self._stop = threading.Event()
+        self._thread = None
+
+    def client(self, worker: str) -> BrokerClient:
+        self.responses[worker] = multiprocessing.Queue()
+        return BrokerClient(worker, self.requests, self.responses[worker])
+
+    def _reply(self, request: tuple, ok: bool, result) -> None:
+        worker, request_id = request[0], request[1]
+        self.responses[worker].put((request_id, ok, result))
+
+    def _execute(self, batch: List[tuple]) -> None:
+        merged = {}
+        for request in batch:
+            worker, request_id, instrument, method, args, kwargs = request
+            if method in self.COALESCED_METHODS and len(kwargs) == 0 and len(args) in (1, 2):
+                key = (instrument, method, args[1] if len(args) == 2 else None)
+                merged.setdefault(key, []).append(request)
+                continue
+
+            try:
+                self.call_count += 1
+                self._reply(request, True, getattr(self.instruments[instrument], method)(*args, **kwargs))
+            except Exception as error:
+                self._reply(request, False, str(error))
+
+        for (instrument, method, profile), requests in merged.items():
+            channel_lists = [InstrumentBase.expand_channels(request[4][0]) for request in requests]
+            # Sorted so the same DUTs give the same scan list and the DAQ is not reconfigured between batches
+            channels = sorted(set(channel for channel_list in channel_lists for channel in channel_list))
+            try:
+                self.call_count += 1
+                call_args = (channels,) if profile is None else (channels, profile)
+                values = dict(zip(channels, getattr(self.instruments[instrument], method)(*call_args)))
+            except Exception as error:
+                for request in requests:
+                    self._reply(request, False, str(error))
+                continue
+
+            for request, channel_list in zip(requests, channel_lists):
+                result = [values[channel] for channel in channel_list]
+                self._reply(request, True, result[0] if isinstance(request[4][0], int) else result)
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            deadline = time.perf_counter() + self.coalesce_window
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.request_count += len(batch)
+            self._execute(batch)
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='instrument-broker', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _worker_main(worker: Callable, config: DutConfig, client: BrokerClient, instrument_names: List[str],
+                 results: multiprocessing.Queue) -> None:
+    instruments = {name: InstrumentProxy(client, name) for name in instrument_names}
+    try:
+        results.put((config.name, True, worker(config, instruments)))
+    except BaseException as error:
+        # Also SystemExit, Amc7836Init.init calls exit() when the cable does not answer
+        results.put((config.name, False, f'{type(error).__name__}: {error}'))
+
+
+class Orchestrator:
+    """
+    Runs one worker process per DUT. The worker owns its DUT's FTDI cable and reaches the shared DAQ and
+    supplies through proxies to the InstrumentBroker in this process.
+
+    worker is a module level function worker(config, instruments) -> result, instruments maps the shared
+    instrument names to proxies. Every supply named in a DutConfig's supply_channels must be one of them.
+    Results come back keyed by DUT name, an Exception for a DUT whose worker failed or died without a result.
+    """
+    POLL_INTERVAL = 0.1  # s
+
+    def __init__(self, configs: List[DutConfig], instruments: dict, worker: Callable,
+                 coalesce_window: float = 0.002):
+        for config in configs:
+            for supply in config.supply_channels:
+                if supply not in instruments:
+                    raise Exception(f'orchestrator.py: DUT {config.name} uses supply {supply}, '
+                                    f'which is not a shared instrument.')
+        self.configs = configs
+        self.worker = worker
+        self.broker = InstrumentBroker(instruments, coalesce_window)
+        self.results = {}
+        self.elapsed = 0.0  # s
+
+    @staticmethod
+    def discover(mapping: dict) -> List[DutConfig]:
+        """
+        Match the cables on the bus to DUTs. mapping is cable serial -> DutConfig keyword arguments without
+        ftdi_serial. Cables without an entry are reported and left out.
+        """
+        configs = []
+        for serial in discover_cables():
+            if serial not in mapping:
+                print(f'FTDI cable {serial} has no DUT mapping, skipping')
+                continue
+            configs.append(DutConfig(ftdi_serial=serial, **mapping[serial]))
+        return configs
+
+    def run(self, timeout: Union[None, float] = None) -> dict:
+        start = time.perf_counter()
+        results = multiprocessing.Queue()
+        instrument_names = list(self.broker.instruments)
+
+        processes = []
+        for config in self.configs:
+            client = self.broker.client(config.name)
+            processes.append(multiprocessing.Process(target=_worker_main, name=f'dut-{config.name}',
+                                                     args=(self.worker, config, client, instrument_names, results)))
+
+        self.broker.start()
+        try:
+            for process in processes:
+                process.start()
+
+            self.results = {}
+            running = {config.name: process for config, process in zip(self.configs, processes)}
+            exited = set()
+            while len(running) > 0:
+                remaining = None if timeout is None else timeout - (time.perf_counter() - start)
+                if remaining is not None and remaining <= 0:
+                    raise Exception('orchestrator.py: Workers did not finish within the timeout.')
+                try:
+                    name, ok, result = results.get(timeout=self.POLL_INTERVAL if remaining is None
+                                                   else min(self.POLL_INTERVAL, remaining))
+                except queue.Empty:
+                    for name, process in list(running.items()):
+                        if process.is_alive():
+                            continue
+                        if name not in exited:
+                            exited.add(name)
+                            # Its result may still be in the queue, it fails if the next poll brings none
+                            continue
+                        del running[name]
+                        self.results[name] = Exception(f'orchestrator.py: Worker exited with code '
+                                                       f'{process.exitcode} without a result.')
+                        print(f'DUT {name} failed: worker exited with code {process.exitcode}')
+                    continue
+                running.pop(name, None)
+                self.results[name] = result if ok else Exception(result)
+                if not ok:
+                    print(f'DUT {name} failed: {result}')
+        finally:
+            for process in processes:
+                process.join(timeout=1.0)
+                if process.is_alive():
+                    process.terminate()
+            self.broker.stop()
+
+        self.elapsed = time.perf_counter() - start
+        print(f'{len(processes)} DUTs in {self.elapsed:.2f} s, {self.broker.request_count} instrument requests '
+              f'served with {self.broker.call_count} instrument calls')
+        return self.results
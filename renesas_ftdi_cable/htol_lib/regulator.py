@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import deque
+from typing import Union, List, Callable
+
+import numpy
+
+from htol_lib.bias_search import BiasSearch
+
+
+class RegulatedStage:
+    """
+    Drain current set point of one amplifier stage and its PID state. Gains are in DAC codes per amp of
+    error (kp), per amp second (ki) and per amp per second (kd).
+    """
+
+    def __init__(self, name: str, dac_address_key: str, daq_ch: int, target: float, code: int,
+                 kp: float = 100.0, ki: float = 200.0, kd: float = 0.0, max_step: int = 8,
+                 min_code: int = 0, code_limit: int = BiasSearch.CODE_LIMIT):
+        self.name = name
+        self.dac_address_key = dac_address_key
+        self.daq_ch = daq_ch
+        self.target = target  # A
+        self.code = code
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_step = max_step  # Largest code change in one cycle
+        self.min_code = min_code
+        self.code_limit = code_limit
+        self._errors = deque(maxlen=2)  # Previous errors, newest last
+        self._remainder = 0.0  # Fraction of a code not applied yet
+
+    def update(self, current: float, dt: float) -> tuple:
+        """
+        Return the new code and whether it was limited, from the PID in velocity form.
+        """
+        error = self.target - current
+        previous = self._errors[-1] if len(self._errors) > 0 else error
+        before_previous = self._errors[-2] if len(self._errors) > 1 else previous
+        self._errors.append(error)
+
+        delta = (self.kp * (error - previous) + self.ki * error * dt +
+                 self.kd * (error - 2 * previous + before_previous) / dt)
+        delta += self._remainder
+
+        step = int(round(delta))
+        limited = abs(step) > self.max_step
+        step = max(-self.max_step, min(self.max_step, step))
+        code = self.code + step
+        if code < self.min_code or code > self.code_limit - 1:
+            code = max(self.min_code, min(self.code_limit - 1, code))
+            limited = True
+
+        # Drop the unapplied part when limited so the integral does not wind up
+        self._remainder = 0.0 if limited else delta - step
+        return code, limited
+
+
+class RegulatorStats:
+
+    def __init__(self, period: float, history_length: int = 1000):
+        self.period = period  # s
+        self.cycles = 0
+        self.skipped = 0  # Cycles without a fresh reading
+        self.overruns = 0  # Cycles that ended after the next one was due
+        self.writes = 0  # DAC bursts
+        self.codes_moved = 0
+        self.limited = 0  # Stage updates cut by max_step or the code range
+        self.lateness = deque(maxlen=history_length)  # s each cycle started after its schedule
+        self.cycle_times = deque(maxlen=history_length)  # s each cycle took
+        self.errors = {}  # stage name -> deque of errors in A
+
+    def record_error(self, name: str, error: float) -> None:
+        if name not in self.errors:
+            self.errors[name] = deque(maxlen=self.lateness.maxlen)
+        self.errors[name].append(error)
+
+    def summary(self) -> dict:
+        lateness = numpy.array(self.lateness) if len(self.lateness) > 0 else numpy.zeros(1)
+        cycle_times = numpy.array(self.cycle_times) if len(self.cycle_times) > 0 else numpy.zeros(1)
+        return {
+            'cycles': self.cycles,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'writes': self.writes,
+            'codes_moved': self.codes_moved,
+            'limited': self.limited,
+            'jitter_std_s': float(lateness.std()),
+            'jitter_max_s': float(lateness.max()),
+            'cycle_mean_s': float(cycle_times.mean()),
+            'cycle_max_s': float(cycle_times.max()),
+            'error_rms_a': {name: float(numpy.sqrt(numpy.mean(numpy.square(errors))))
+                            for name, errors in self.errors.items()},
+        }
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        lines = [f"Regulator: {summary['cycles']} cycles at {1 / self.period:.2f} Hz, {summary['skipped']} skipped, "
+                 f"{summary['overruns']} overruns",
+                 f"  jitter std {summary['jitter_std_s'] * 1000:.2f} ms, max {summary['jitter_max_s'] * 1000:.2f} ms, "
+                 f"cycle mean {summary['cycle_mean_s'] * 1000:.2f} ms, max {summary['cycle_max_s'] * 1000:.2f} ms",
+                 f"  {summary['writes']} DAC bursts, {summary['codes_moved']} codes moved, "
+                 f"{summary['limited']} limited updates"]
+        for name, rms in summary['error_rms_a'].items():
+            lines.append(f'  {name}: error rms {rms * 1000:.3f} mA')
+        return '\n'.join(lines)
+
+
+class DrainCurrentRegulator:
+    """
+    Background thread holding the drain current of each stage at its target with a PID loop.
+
+    Every cycle reads all stage channels with one call of read_currents and writes all changed codes with
+    one call of set_codes, both under lock so the loop interleaves with other users of the DAQ and DAC.
+    read_currents returns None when there is no fresh reading, and the cycle is skipped.
+    """
+
+    def __init__(self, stages: List[RegulatedStage], read_currents: Callable[[List[int]], Union[None, List[float]]],
+                 set_codes: Callable[[dict], None], rate_hz: float = 1.0,
+                 lock: Union[None, threading.RLock] = None):
+        self.stages = stages
+        self.read_currents = read_currents
+        self.set_codes = set_codes
+        self.period = 1.0 / rate_hz  # s
+        self.lock = threading.RLock() if lock is None else lock
+        self.stats = RegulatorStats(self.period)
+        self._channels = list(dict.fromkeys(stage.daq_ch for stage in stages))
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_cycle = None
+
+    def step(self, dt: float) -> bool:
+        """
+        Run one cycle, dt seconds after the last one that had readings. Returns False when skipped.
+        """
+        with self.lock:
+            currents = self.read_currents(self._channels)
+            if currents is None:
+                self.stats.skipped += 1
+                return False
+            values = dict(zip(self._channels, currents))
+
+            codes = {}
+            for stage in self.stages:
+                current = values[stage.daq_ch]
+                self.stats.record_error(stage.name, stage.target - current)
+                code, limited = stage.update(current, dt)
+                self.stats.limited += int(limited)
+                if code != stage.code:
+                    self.stats.codes_moved += abs(code - stage.code)
+                    stage.code = code
+                    codes[stage.dac_address_key] = code
+
+            if len(codes) > 0:
+                self.set_codes(codes)
+                self.stats.writes += 1
+        return True
+
+    def _run(self) -> None:
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            self.stats.lateness.append(start - next_time)
+            dt = self.period if self._last_cycle is None else start - self._last_cycle
+
+            try:
+                if self.step(dt):
+                    self._last_cycle = start
+            except Exception as error:
+                print(f'regulator.py: Cycle failed: {error}')
+            self.stats.cycles += 1
+            self.stats.cycle_times.append(time.perf_counter() - start)
+
+            next_time += self.period
+            if time.perf_counter() > next_time:
+                # Drop the missed cycles rather than running them back to back
+                self.stats.overruns += 1
+                next_time = time.perf_counter()
+            self._stop.wait(max(0.0, next_time - time.perf_counter()))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._last_cycle = None
+        self._thread = threading.Thread(target=self._run, name='drain-current-regulator', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> RegulatorStats:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.stats
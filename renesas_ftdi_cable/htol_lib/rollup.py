@@ -0,0 +1,274 @@
+import os
+from typing import Union, List
+
+import numpy
+
+from htol_lib.htol_store import HtolStore, StoreWriter, _to_ns
+
+DEFAULT_RESOLUTIONS = [10, 60, 3600, 86400]  # s, 10 s, 1 min, 1 h and 1 day buckets
+STATISTICS = ['min', 'max', 'mean', 'm2']  # m2 is the sum of squared deviations from the mean
+
+
+def _label(resolution: int) -> str:
+    for unit, seconds in [('d', 86400), ('h', 3600), ('m', 60)]:
+        if resolution % seconds == 0:
+            return f'{resolution // seconds}{unit}'
+    return f'{resolution}s'
+
+
+def merge(count_a, mean_a, m2_a, count_b, mean_b, m2_b) -> tuple:
+    # Chan et al. pairwise update of count, mean and m2, works on scalars and arrays alike
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = numpy.where(count > 0, mean_a + delta * count_b / count, 0.0)
+        m2 = numpy.where(count > 0, m2_a + m2_b + delta * delta * count_a * count_b / count, 0.0)
+    return count, mean, m2
+
+
+def fold_buckets(stamps: numpy.ndarray, values: numpy.ndarray, resolution_ns: int) -> tuple:
+    """
+    Group time ordered rows, int64 ns stamps and rows x columns values, into buckets of resolution_ns.
+    Returns bucket start, count, min, max, mean and m2 with one row per bucket touched.
+    """
+    buckets = stamps - stamps % resolution_ns
+    starts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(buckets)) + 1])
+    count = numpy.diff(numpy.append(starts, stamps.size)).astype(numpy.float64)
+    mean = numpy.add.reduceat(values, starts, axis=0) / count[:, None]
+    m2 = numpy.add.reduceat((values - numpy.repeat(mean, count.astype(numpy.int64), axis=0)) ** 2, starts, axis=0)
+    minimum = numpy.minimum.reduceat(values, starts, axis=0)
+    maximum = numpy.maximum.reduceat(values, starts, axis=0)
+    return buckets[starts], count, minimum, maximum, mean, m2
+
+
+class RollupWindow:
+    """
+    Buckets of one tier over a time range. count is per bucket, the statistics are per bucket and column.
+    """
+
+    def __init__(self, resolution: int, columns: List[str], timestamps: numpy.ndarray, count: numpy.ndarray,
+                 stats: dict):
+        self.resolution = resolution  # s
+        self.columns = columns
+        self.timestamps = timestamps  # Bucket start, datetime64[ns]
+        self.count = count
+        self.stats = stats  # column -> {statistic: array}
+
+    @property
+    def rows(self) -> int:
+        return self.timestamps.size
+
+    def column(self, name: str, statistic: str = 'mean') -> numpy.ndarray:
+        if statistic == 'count':
+            return self.count
+        if statistic == 'std':
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                return numpy.sqrt(self.stats[name]['m2'] / (self.count - 1))
+        return self.stats[name][statistic]
+
+    def summary(self) -> dict:
+        """
+        Merge every bucket into one, column -> count, min, max, mean and std over the whole window.
+        """
+        result = {}
+        count = float(self.count.sum())
+        for name in self.columns:
+            stats = self.stats[name]
+            if count == 0:
+                result[name] = {'count': 0, 'min': numpy.nan, 'max': numpy.nan, 'mean': numpy.nan, 'std': numpy.nan}
+                continue
+            mean = float((self.count * stats['mean']).sum() / count)
+            m2 = float(stats['m2'].sum() + (self.count * (stats['mean'] - mean) ** 2).sum())
+            result[name] = {'count': int(count), 'min': float(stats['min'].min()), 'max': float(stats['max'].max()),
+                            'mean': mean, 'std': float(numpy.sqrt(m2 / (count - 1))) if count > 1 else numpy.nan}
+        return result
+
+
+class RollupTier:
+    """
+    Fixed-size time buckets of one resolution, kept as an HtolStore with one row per closed bucket. The
+    bucket still filling is only in memory, see RollupWriter, so query() folds the raw rows after the last
+    closed bucket in as it reads.
+    """
+
+    def __init__(self, root: str, raw: HtolStore, resolution: int):
+        self.raw = raw
+        self.columns = raw.columns
+        self.resolution = resolution
+        self.resolution_ns = resolution * 1_000_000_000
+        self.store = HtolStore(root, ['count'] + [f'{name}_{statistic}' for name in self.columns
+                                                  for statistic in STATISTICS])
+
+    def _open_buckets(self, start, end) -> Union[None, tuple]:
+        # Buckets of the raw rows after the last closed one that start in [start, end), see fold_buckets
+        last_bucket = self.store.last_time()
+        low = None if last_bucket is None else last_bucket + self.resolution_ns
+        if start is not None:
+            start_ns = _to_ns(start)
+            start_ns += -start_ns % self.resolution_ns
+            low = start_ns if low is None else max(low, start_ns)
+        high = None
+        if end is not None:
+            end_ns = _to_ns(end)
+            high = end_ns + -end_ns % self.resolution_ns
+        # Bucket boundaries, the raw rows of a bucket starting before end reach up to the next boundary
+
+        window = self.raw.query(None if low is None else numpy.datetime64(low, 'ns'),
+                                None if high is None else numpy.datetime64(high, 'ns'))
+        if window.rows == 0:
+            return None
+        return fold_buckets(window.timestamps.view(numpy.int64),
+                            numpy.column_stack([window.column(name) for name in self.columns]), self.resolution_ns)
+
+    def query(self, start=None, end=None) -> RollupWindow:
+        window = self.store.query(start, end)
+        timestamps = window.timestamps
+        count = window.column('count')
+        stats = {name: {statistic: window.column(f'{name}_{statistic}') for statistic in STATISTICS}
+                 for name in self.columns}
+
+        open_buckets = self._open_buckets(start, end)
+        if open_buckets is not None:
+            buckets, open_count, minimum, maximum, mean, m2 = open_buckets
+            timestamps = numpy.concatenate([timestamps, buckets.view('datetime64[ns]')])
+            count = numpy.concatenate([count, open_count])
+            for index, name in enumerate(self.columns):
+                for statistic, values in zip(STATISTICS, [minimum, maximum, mean, m2]):
+                    stats[name][statistic] = numpy.concatenate([stats[name][statistic], values[:, index]])
+        return RollupWindow(self.resolution, self.columns, timestamps, count, stats)
+
+
+class RollupWriter:
+    """
+    Folds every appended row into all tiers at once. Rows of a batch are grouped per bucket with numpy
+    reductions and merged into the open bucket with the pairwise Welford update, so nothing is ever
+    re-read. A bucket is written to its tier as soon as a row of a later bucket arrives.
+
+    Buckets closed before a crash are on disk, the open ones are rebuilt from the raw store when the writer
+    is opened. That reads only the raw rows after each tier's last closed bucket, and backfills tiers added
+    to an existing store.
+    """
+
+    def __init__(self, rollup: 'HtolRollup'):
+        self.rollup = rollup
+        column_count = len(rollup.columns)
+        self._writers = {}  # resolution -> StoreWriter
+        self._open = {}  # resolution -> [bucket start ns, count, min, max, mean, m2]
+        for tier in rollup.tiers:
+            self._writers[tier.resolution] = tier.store.writer()
+            self._open[tier.resolution] = [None, 0, numpy.full(column_count, numpy.inf),
+                                           numpy.full(column_count, -numpy.inf), numpy.zeros(column_count),
+                                           numpy.zeros(column_count)]
+
+        for tier in rollup.tiers:
+            last_bucket = tier.store.last_time()
+            start = None if last_bucket is None else numpy.datetime64(last_bucket + tier.resolution_ns, 'ns')
+            window = rollup.raw.query(start, None)
+            # Raw rows the tier has not closed a bucket for yet, written before a crash
+            if window.rows > 0:
+                self._fold(tier, window.timestamps.view(numpy.int64),
+                           numpy.column_stack([window.column(name) for name in rollup.columns]))
+
+    def _write(self, tier: RollupTier, buckets: numpy.ndarray, count: numpy.ndarray, minimum: numpy.ndarray,
+               maximum: numpy.ndarray, mean: numpy.ndarray, m2: numpy.ndarray) -> None:
+        rows = [count[:, None]]
+        for index in range(len(self.rollup.columns)):
+            rows.extend([minimum[:, index:index + 1], maximum[:, index:index + 1], mean[:, index:index + 1],
+                         m2[:, index:index + 1]])
+        self._writers[tier.resolution].append(buckets.view('datetime64[ns]'), numpy.hstack(rows))
+
+    def _fold(self, tier: RollupTier, stamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        buckets, count, minimum, maximum, mean, m2 = fold_buckets(stamps, values, tier.resolution_ns)
+
+        open_bucket = self._open[tier.resolution]
+        if open_bucket[0] is not None:
+            if open_bucket[0] == buckets[0]:
+                count[0], mean[0], m2[0] = merge(open_bucket[1], open_bucket[4], open_bucket[5],
+                                                 count[0], mean[0], m2[0])
+                minimum[0] = numpy.minimum(minimum[0], open_bucket[2])
+                maximum[0] = numpy.maximum(maximum[0], open_bucket[3])
+            else:
+                self._write(tier, numpy.array([open_bucket[0]]), numpy.array([open_bucket[1]], dtype=numpy.float64),
+                            open_bucket[2][None], open_bucket[3][None], open_bucket[4][None], open_bucket[5][None])
+
+        if buckets.size > 1:
+            self._write(tier, buckets[:-1], count[:-1], minimum[:-1], maximum[:-1], mean[:-1], m2[:-1])
+        self._open[tier.resolution] = [int(buckets[-1]), float(count[-1]), minimum[-1], maximum[-1], mean[-1], m2[-1]]
+
+    def append(self, timestamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        """
+        Fold rows in, timestamps as datetime64 and values as rows x columns in the store's column order.
+        """
+        stamps = numpy.asarray(timestamps, dtype='datetime64[ns]').view(numpy.int64)
+        if stamps.size == 0:
+            return
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(stamps.size, len(self.rollup.columns))
+        for tier in self.rollup.tiers:
+            self._fold(tier, stamps, values)
+
+    # Same call as MeasurementLogger and StoreWriter
+    log_rows = append
+
+    def open_window(self, resolution: int) -> RollupWindow:
+        # The bucket still filling, empty before the first row
+        bucket, count, minimum, maximum, mean, m2 = self._open[resolution]
+        rows = 0 if bucket is None else 1
+        stats = {name: {'min': minimum[None, index][:rows], 'max': maximum[None, index][:rows],
+                        'mean': mean[None, index][:rows], 'm2': m2[None, index][:rows]}
+                 for index, name in enumerate(self.rollup.columns)}
+        return RollupWindow(resolution, self.rollup.columns, numpy.array([bucket] * rows, dtype='datetime64[ns]'),
+                            numpy.array([count] * rows, dtype=numpy.float64), stats)
+
+    def close(self) -> None:
+        # Open buckets are not written, the next writer and RollupTier.query rebuild them from the raw store
+        for writer in self._writers.values():
+            writer.close()
+
+    def __enter__(self) -> 'RollupWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class HtolRollup:
+    """
+    Min, max, mean and standard deviation of every column of an HtolStore at several bucket sizes, kept
+    next to the raw data in <store root>/rollup_<resolution>. Feed it with writer() alongside the store
+    writer. query() answers from the coarsest tier that still gives max_points buckets, so a report over
+    the whole run reads a few hundred rows instead of the raw stream.
+    """
+
+    def __init__(self, raw: HtolStore, resolutions: Union[None, List[int]] = None):
+        self.raw = raw
+        self.columns = raw.columns
+        self.tiers = [RollupTier(os.path.join(raw.root, f'rollup_{_label(resolution)}'), raw, resolution)
+                      for resolution in sorted(DEFAULT_RESOLUTIONS if resolutions is None else resolutions)]
+
+    def tier(self, resolution: int) -> RollupTier:
+        for tier in self.tiers:
+            if tier.resolution == resolution:
+                return tier
+        raise Exception(f'rollup.py: No rollup tier of {resolution} seconds.')
+
+    def writer(self) -> RollupWriter:
+        return RollupWriter(self)
+
+    def query(self, start=None, end=None, resolution: Union[None, int] = None,
+              max_points: int = 2000) -> RollupWindow:
+        """
+        Buckets with start <= bucket start < end. Without resolution the finest tier giving at most about
+        max_points buckets is used, open ends are taken from the raw store.
+        """
+        if resolution is not None:
+            return self.tier(resolution).query(start, end)
+
+        first, last = self.raw.time_range()
+        if first is None:
+            return self.tiers[0].query(start, end)
+        start_ns = _to_ns(first) if start is None else _to_ns(start)
+        end_ns = _to_ns(last) + self.tiers[0].resolution_ns if end is None else _to_ns(end)
+        for tier in self.tiers:
+            if (end_ns - start_ns) // tier.resolution_ns <= max_points:
+                return tier.query(start, end)
+        return self.tiers[-1].query(start, end)
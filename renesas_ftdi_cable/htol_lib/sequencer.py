@@ -0,0 +1,185 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Union, List, Callable
+
+from instrument_lib.instrument_base import wait_until
+
+
+class SequenceStep:
+    """
+    One step of a sequence: an action, a condition to wait for, or an action followed by the condition it
+    should bring about. A step starts once every step in depends_on has completed, and holds the lock of its
+    resource while it talks to the instrument.
+    """
+
+    def __init__(self, name: str, action: Union[None, Callable[[], object]] = None,
+                 condition: Union[None, Callable[[], bool]] = None, depends_on: Union[None, List[str]] = None,
+                 resource: Union[None, str] = None, timeout: float = 10.0, poll_interval: float = 0.05):
+        self.name = name
+        self.action = action
+        self.condition = condition
+        self.depends_on = [] if depends_on is None else depends_on
+        self.resource = resource  # Instrument the step uses, steps on one resource never overlap
+        self.timeout = timeout  # s to wait for the condition
+        self.poll_interval = poll_interval  # s
+
+
+class StepTiming:
+
+    def __init__(self, name: str, resource: Union[None, str]):
+        self.name = name
+        self.resource = resource
+        self.status = 'pending'  # pending, done, failed or skipped
+        self.ready = None  # s from the sequence start when the dependencies were met
+        self.start = None  # s when the step got its resource
+        self.action_end = None  # s when the action returned and the condition wait started
+        self.end = None  # s
+        self.error = None
+
+
+class SequenceTrace:
+
+    def __init__(self, name: str, steps: List[SequenceStep]):
+        self.name = name
+        self.timings = {step.name: StepTiming(step.name, step.resource) for step in steps}
+        self.elapsed = 0.0  # s
+
+    @property
+    def succeeded(self) -> bool:
+        return all(timing.status == 'done' for timing in self.timings.values())
+
+    def rows(self) -> List[list]:
+        # One [name, resource, status, ready, start, action end, end] row per step in start order
+        timings = sorted(self.timings.values(), key=lambda t: float('inf') if t.start is None else t.start)
+        return [[t.name, t.resource, t.status, t.ready, t.start, t.action_end, t.end] for t in timings]
+
+    def __str__(self) -> str:
+        lines = [f'Sequence {self.name}: {"done" if self.succeeded else "failed"} in {self.elapsed:.3f} s']
+        for name, resource, status, ready, start, action_end, end in self.rows():
+            if start is None:
+                lines.append(f'  {name:<24} {str(resource):<10} {status}')
+                continue
+            wait_text = '' if action_end is None or end is None else f', waited {end - action_end:.3f} s'
+            lines.append(f'  {name:<24} {str(resource):<10} {status:<7} start {start:8.3f} s, '
+                         f'blocked {start - ready:.3f} s, took {end - start:.3f} s{wait_text}')
+        return '\n'.join(lines)
+
+
+class Sequencer:
+    """
+    Runs a graph of SequenceSteps, every step as soon as its dependencies are done, so steps on different
+    instruments run concurrently. If a step fails no new steps start, the running ones finish and the
+    rest are marked skipped. Each run leaves a SequenceTrace with the timing of every step.
+    """
+
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        self.max_workers = max_workers
+        self.steps = {}
+        self.trace: Union[None, SequenceTrace] = None
+        self._locks = {}
+
+    def add(self, step: SequenceStep) -> SequenceStep:
+        if step.name in self.steps:
+            raise Exception(f'sequencer.py: Duplicate step {step.name}.')
+        self.steps[step.name] = step
+        return step
+
+    def validate(self) -> List[str]:
+        """
+        Check every dependency exists and that there is no cycle. Returns the steps in a valid order.
+        """
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise Exception(f'sequencer.py: Step {step.name} depends on unknown step {dependency}.')
+
+        order = []
+        done = set()
+        remaining = dict(self.steps)
+        while len(remaining) > 0:
+            ready = [name for name, step in remaining.items() if all(d in done for d in step.depends_on)]
+            if len(ready) == 0:
+                raise Exception(f'sequencer.py: Steps {", ".join(remaining)} form a dependency cycle.')
+            for name in ready:
+                order.append(name)
+                done.add(name)
+                del remaining[name]
+        return order
+
+    def _lock(self, resource: Union[None, str]) -> Union[None, threading.Lock]:
+        if resource is None:
+            return None
+        if resource not in self._locks:
+            self._locks[resource] = threading.Lock()
+        return self._locks[resource]
+
+    def _run_step(self, step: SequenceStep, timing: StepTiming, start: float) -> None:
+        lock = self._lock(step.resource)
+
+        def locked(function: Callable[[], object]):
+            if lock is None:
+                return function()
+            with lock:
+                return function()
+
+        def act() -> None:
+            # The step starts once it holds its resource
+            timing.start = time.perf_counter() - start
+            if step.action is not None:
+                step.action()
+
+        try:
+            locked(act)
+            timing.action_end = time.perf_counter() - start
+
+            if step.condition is not None:
+                # The resource is only held for each poll, other steps on it run in between
+                wait_until(lambda: locked(step.condition), step.timeout, step.poll_interval)
+        finally:
+            timing.end = time.perf_counter() - start
+
+    def run(self) -> SequenceTrace:
+        self.validate()
+        trace = SequenceTrace(self.name, list(self.steps.values()))
+        self.trace = trace
+        start = time.perf_counter()
+
+        done = set()
+        failed = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                if len(failed) == 0:
+                    for name, step in self.steps.items():
+                        timing = trace.timings[name]
+                        if timing.status == 'pending' and name not in running.values() and \
+                                all(dependency in done for dependency in step.depends_on):
+                            timing.ready = time.perf_counter() - start
+                            running[executor.submit(self._run_step, step, timing, start)] = name
+
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    timing = trace.timings[name]
+                    if future.exception() is None:
+                        timing.status = 'done'
+                        done.add(name)
+                    else:
+                        timing.status = 'failed'
+                        timing.error = future.exception()
+                        failed.append(name)
+
+        for timing in trace.timings.values():
+            if timing.status == 'pending':
+                timing.status = 'skipped'
+        trace.elapsed = time.perf_counter() - start
+
+        if len(failed) > 0:
+            raise Exception(f'sequencer.py: Sequence {self.name} stopped, step {failed[0]} failed: '
+                            f'{trace.timings[failed[0]].error}')
+        return trace
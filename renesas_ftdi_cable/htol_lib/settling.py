@@ -0,0 +1,100 @@
+import time
+from collections import deque
+from typing import Union, List, Callable
+
+import numpy
+
+
+class SettlingResult:
+
+    def __init__(self, settled: bool, elapsed: float, times: List[float], readings: List):
+        self.settled = settled  # False when the timeout was reached first
+        self.elapsed = elapsed  # s from the start of wait() to the decision
+        self.times = times  # s from the start of wait() of every reading
+        self.readings = readings
+
+    @property
+    def value(self):
+        # Mean of the last readings, the settled value
+        window = numpy.array(self.readings[-SettlingDetector.MIN_WINDOW:], dtype=float)
+        value = window.mean(axis=0)
+        return float(value) if value.ndim == 0 else value.tolist()
+
+
+class SettlingDetector:
+    """
+    Decides when a reading has settled after a change by reading it rapidly and fitting a line through the
+    last window readings. It is settled once the fitted slope and the scatter around the fit are both within
+    their limits, for every value when read returns a list. Without settling by timeout the last readings
+    are used anyway.
+
+    Observed settling times are kept per key, usually the DAQ channel, and the dwell estimate from them is
+    slept before polling starts, so later waits spend fewer readings on a value still moving.
+    """
+    MIN_WINDOW = 3
+
+    def __init__(self, slope_limit: float = 0.005, noise_limit: float = 0.0005, window: int = 5,
+                 timeout: float = 2.0, poll_interval: float = 0.0, dwell_fraction: float = 0.5,
+                 history_length: int = 50):
+        self.slope_limit = slope_limit  # units/s
+        self.noise_limit = noise_limit  # units rms
+        self.window = max(window, self.MIN_WINDOW)
+        self.timeout = timeout  # s
+        self.poll_interval = poll_interval  # s
+        self.dwell_fraction = dwell_fraction  # Part of the dwell estimate slept before the first reading
+        self.history_length = history_length
+        self.history = {}  # key -> deque of settling times in s
+
+    def record(self, key, elapsed: float) -> None:
+        if key not in self.history:
+            self.history[key] = deque(maxlen=self.history_length)
+        self.history[key].append(elapsed)
+
+    def dwell(self, key, default: float = 0.0) -> float:
+        """
+        Dwell estimate for key, the 90th percentile of the settling times seen, default until one is seen.
+        """
+        if key not in self.history or len(self.history[key]) == 0:
+            return default
+        return float(numpy.percentile(list(self.history[key]), 90))
+
+    def is_settled(self, times: List[float], readings: List) -> bool:
+        if len(readings) < self.window:
+            return False
+        t = numpy.array(times[-self.window:])
+        values = numpy.array(readings[-self.window:], dtype=float).reshape(self.window, -1)
+        if numpy.ptp(t) <= 0:
+            return False
+
+        coefficients = numpy.polyfit(t, values, 1)
+        residuals = values - (numpy.outer(t, coefficients[0]) + coefficients[1])
+        return bool(numpy.all(numpy.abs(coefficients[0]) <= self.slope_limit) and
+                    numpy.all(residuals.std(axis=0) <= self.noise_limit))
+
+    def wait(self, read: Callable[[], Union[float, List[float]]], key=None,
+             timeout: Union[None, float] = None) -> SettlingResult:
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+
+        dwell = self.dwell_fraction * self.dwell(key)
+        if dwell > 0:
+            time.sleep(min(dwell, timeout))
+
+        times = []
+        readings = []
+        while True:
+            readings.append(read())
+            times.append(time.perf_counter() - start)
+
+            if self.is_settled(times, readings):
+                # Settled when the window started to look flat
+                elapsed = times[-self.window]
+                self.record(key, elapsed)
+                return SettlingResult(True, elapsed, times, readings)
+
+            if times[-1] >= timeout:
+                self.record(key, times[-1])
+                return SettlingResult(False, times[-1], times, readings)
+
+            if self.poll_interval > 0:
+                time.sleep(self.poll_interval)
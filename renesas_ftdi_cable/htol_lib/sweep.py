@@ -0,0 +1,125 @@
+import time
+from datetime import datetime
+from typing import Union, List, Callable
+
+import numpy
+
+from htol_lib.bias_search import BiasSearch
+
+GATE_MIN_V = -10.0  # Gate DACs on the -10V to 0V range
+GATE_LSB_V = 10.0 / 4095
+
+FORWARD = 0
+REVERSE = 1
+
+
+def linear_codes(start: int, stop: int, points: int) -> numpy.ndarray:
+    # Evenly spaced DAC codes from start to stop, both included
+    return numpy.rint(numpy.linspace(start, stop, points)).astype(numpy.int32)
+
+
+def gate_voltage(codes: numpy.ndarray) -> numpy.ndarray:
+    return GATE_MIN_V + numpy.asarray(codes, dtype=numpy.float64) * GATE_LSB_V
+
+
+class SweepResult:
+    """
+    One row per sweep point. codes and gate_voltages have a column per DAC, currents a column per DAQ
+    channel, times are seconds from start_time when the point's reading returned.
+    """
+
+    def __init__(self, dac_keys: List[str], channels: List[int], codes: numpy.ndarray, currents: numpy.ndarray,
+                 times: numpy.ndarray, direction: numpy.ndarray, start_time: datetime, aborted: bool):
+        self.dac_keys = dac_keys
+        self.channels = channels
+        self.codes = codes
+        self.gate_voltages = gate_voltage(codes)
+        self.currents = currents  # A, the DAQ reads the drain shunt voltage
+        self.times = times
+        self.direction = direction  # FORWARD or REVERSE
+        self.start_time = start_time
+        self.aborted = aborted  # The current limit stopped the sweep early
+
+    @property
+    def point_count(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def elapsed(self) -> float:
+        return float(self.times[-1]) if self.point_count > 0 else 0.0
+
+    def current(self, channel: int) -> numpy.ndarray:
+        return self.currents[:, self.channels.index(channel)]
+
+    def hysteresis(self, channel: int, dac_key: Union[None, str] = None) -> tuple:
+        """
+        Return the codes reached in both directions and the reverse minus forward current of channel at them.
+        """
+        column = 0 if dac_key is None else self.dac_keys.index(dac_key)
+        current = self.current(channel)
+        forward = self.direction == FORWARD
+        reverse = self.direction == REVERSE
+
+        codes, forward_index, reverse_index = numpy.intersect1d(self.codes[forward, column],
+                                                                self.codes[reverse, column], return_indices=True)
+        return codes, current[reverse][reverse_index] - current[forward][forward_index]
+
+
+class IdVgSweep:
+    """
+    Steps one or more gate DACs through a code schedule and reads the drain currents after every step.
+
+    Each point is one set_codes call, a single DAC register burst, followed by one read call for the whole
+    channel list. The DAQ keeps its scan list and profile between reads, so a point costs a DAC burst and
+    one READ? instead of a MEAS per channel and a fixed sleep.
+
+    A schedule reaching code_limit, the same gate limit the bias search keeps to, is refused before any
+    code is written.
+    """
+
+    def __init__(self, set_codes: Callable[[dict], None], read: Callable[[List[int]], List[float]],
+                 channels: List[int], settle_time: float = 0.0, current_limit: Union[None, float] = None,
+                 code_limit: int = BiasSearch.CODE_LIMIT):
+        self.set_codes = set_codes  # Codes keyed by DAC data register name
+        self.read = read
+        self.channels = channels
+        self.settle_time = settle_time  # s between the DAC burst and the reading
+        self.current_limit = current_limit  # A on any channel, ends the sweep
+        self.code_limit = code_limit  # Lowest code not allowed
+
+    def run(self, schedule: dict, bidirectional: bool = False) -> SweepResult:
+        """
+        schedule maps DAC data register name to the codes of every point, all of the same length. With
+        bidirectional the schedule is played forward and then back to its start.
+        """
+        dac_keys = list(schedule)
+        codes = numpy.column_stack([numpy.asarray(schedule[key], dtype=numpy.int32) for key in dac_keys])
+        if numpy.any(codes >= self.code_limit) or numpy.any(codes < 0):
+            raise Exception(f'sweep.py: Schedule codes must be from 0 to {self.code_limit - 1}.')
+        direction = numpy.full(codes.shape[0], FORWARD, dtype=numpy.int8)
+        if bidirectional:
+            codes = numpy.concatenate([codes, codes[-2::-1]])
+            direction = numpy.concatenate([direction, numpy.full(codes.shape[0] - direction.size, REVERSE,
+                                                                 dtype=numpy.int8)])
+
+        currents = numpy.full((codes.shape[0], len(self.channels)), numpy.nan)
+        times = numpy.zeros(codes.shape[0])
+        aborted = False
+        start_time = datetime.now()
+        start = time.perf_counter()
+
+        points = 0
+        for point in range(codes.shape[0]):
+            self.set_codes({key: int(code) for key, code in zip(dac_keys, codes[point])})
+            if self.settle_time > 0:
+                time.sleep(self.settle_time)
+            currents[point] = self.read(self.channels)
+            times[point] = time.perf_counter() - start
+            points += 1
+
+            if self.current_limit is not None and numpy.any(numpy.abs(currents[point]) > self.current_limit):
+                aborted = True
+                break
+
+        return SweepResult(dac_keys, self.channels, codes[:points], currents[:points], times[:points],
+                           direction[:points], start_time, aborted)
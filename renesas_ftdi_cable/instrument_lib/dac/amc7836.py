@@ -87,6 +87,40 @@ class Amc7836():
         self.REGISTER_ADDRESSES['DACD14_DATA_HI'] = 0x6D
         self.REGISTER_ADDRESSES['DACD15_DATA_LO'] = 0x6E
         self.REGISTER_ADDRESSES['DACD15_DATA_HI'] = 0x6F
+        self.REGISTER_ADDRESSES['ALARM_STAT0'] = 0x70
+        self.REGISTER_ADDRESSES['ALARM_STAT1'] = 0x71
+        self.REGISTER_ADDRESSES['GEN_STAT'] = 0x72
+        self.REGISTER_ADDRESSES['GPIO'] = 0x7A
+        self.REGISTER_ADDRESSES['ADC16_UP_THR_LO'] = 0x80
+        self.REGISTER_ADDRESSES['ADC16_UP_THR_HI'] = 0x81
+        self.REGISTER_ADDRESSES['ADC16_LO_THR_LO'] = 0x82
+        self.REGISTER_ADDRESSES['ADC16_LO_THR_HI'] = 0x83
+        self.REGISTER_ADDRESSES['ADC17_UP_THR_LO'] = 0x84
+        self.REGISTER_ADDRESSES['ADC17_UP_THR_HI'] = 0x85
+        self.REGISTER_ADDRESSES['ADC17_LO_THR_LO'] = 0x86
+        self.REGISTER_ADDRESSES['ADC17_LO_THR_HI'] = 0x87
+        self.REGISTER_ADDRESSES['ADC18_UP_THR_LO'] = 0x88
+        self.REGISTER_ADDRESSES['ADC18_UP_THR_HI'] = 0x89
+        self.REGISTER_ADDRESSES['ADC18_LO_THR_LO'] = 0x8A
+        self.REGISTER_ADDRESSES['ADC18_LO_THR_HI'] = 0x8B
+        self.REGISTER_ADDRESSES['ADC19_UP_THR_LO'] = 0x8C
+        self.REGISTER_ADDRESSES['ADC19_UP_THR_HI'] = 0x8D
+        self.REGISTER_ADDRESSES['ADC19_LO_THR_LO'] = 0x8E
+        self.REGISTER_ADDRESSES['ADC19_LO_THR_HI'] = 0x8F
+        self.REGISTER_ADDRESSES['ADC20_UP_THR_LO'] = 0x90
+        self.REGISTER_ADDRESSES['ADC20_UP_THR_HI'] = 0x91
+        self.REGISTER_ADDRESSES['ADC20_LO_THR_LO'] = 0x92
+        self.REGISTER_ADDRESSES['ADC20_LO_THR_HI'] = 0x93
+        self.REGISTER_ADDRESSES['LT_UP_THR_LO'] = 0x94
+        self.REGISTER_ADDRESSES['LT_UP_THR_HI'] = 0x95
+        self.REGISTER_ADDRESSES['LT_LO_THR_LO'] = 0x96
+        self.REGISTER_ADDRESSES['LT_LO_THR_HI'] = 0x97
+        self.REGISTER_ADDRESSES['ADC16_HYST'] = 0xA0
+        self.REGISTER_ADDRESSES['ADC17_HYST'] = 0xA1
+        self.REGISTER_ADDRESSES['ADC18_HYST'] = 0xA2
+        self.REGISTER_ADDRESSES['ADC19_HYST'] = 0xA3
+        self.REGISTER_ADDRESSES['ADC20_HYST'] = 0xA4
+        self.REGISTER_ADDRESSES['LT_HYST'] = 0xA5
         self.REGISTER_ADDRESSES['DAC_CLR0'] = 0xB0
         self.REGISTER_ADDRESSES['DAC_CLR1'] = 0xB1
         self.REGISTER_ADDRESSES['DAC_PD0'] = 0xB2
@@ -2,6 +2,7 @@ from enum import IntEnum
 
 from instrument_lib.dac.ftdi_base import FTDI_BUS
 from instrument_lib.dac.ftdi_base import FTDI_DIRECTION
+from instrument_lib.dac.ftdi_recorder import FtdiRecorder
 from instrument_lib.dac.ftdi_spi import FtdiSpi
 
 
@@ -118,6 +119,22 @@ class Amc7836FtdiSpi:
             self.mpsse.close()
             self.mpsse_lev_shift.close()
 
+    def start_recording(self, filename: str) -> FtdiRecorder:
+        """
+        Record both ports into one trace, port A as channel 0 and the level shifter port B as channel 1.
+        Replay it with instrument_lib.sim.sim_mpsse.
+        """
+        recorder = FtdiRecorder(filename)
+        self.mpsse.enable_recording(recorder, 0)
+        self.mpsse_lev_shift.enable_recording(recorder, 1)
+        return recorder
+
+    def stop_recording(self) -> None:
+        recorder = self.mpsse.disable_recording()
+        self.mpsse_lev_shift.disable_recording()
+        if recorder is not None:
+            recorder.close()
+
     def _define_ftdi_pin_assignments_and_defaults(self):
         """
         Define the class private FTDI constants - this is called by the constructor.
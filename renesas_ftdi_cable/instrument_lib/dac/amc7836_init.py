@@ -24,4 +24,9 @@ class Amc7836Init:
         chip_version = amc_7836.read_register(amc_7836.REGISTER_ADDRESSES['CHIP_VERSION'], 1)
         print("Chip Version 0x%02X" % chip_version)
 
+        amc_7836.dut_id = "%s-%02X%04X%04X%02X" % (amc_7836.io.mpsse.serial, chip_type, (chip_id[1] << 8) + chip_id[0],
+                                                  (mfgr_id[1] << 8) + mfgr_id[0], chip_version)
+        # FTDI cable serial and chip IDs identify the DUT, e.g. in the bias cache
+        print("DUT ID %s" % amc_7836.dut_id)
+
         return amc_7836
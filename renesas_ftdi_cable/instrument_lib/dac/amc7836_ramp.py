@@ -0,0 +1,152 @@
+import time
+from math import ceil
+from typing import List
+
+from ftd2xx import defines
+
+from instrument_lib.dac.amc7836 import Amc7836
+from instrument_lib.dac.ftdi_base import FTDI_MPSSE_COMMANDS
+from instrument_lib.dac.ftdi_spi import FTDI_CS
+
+
+class DacRamp:
+
+    def __init__(self, first_address: int, codes: List[List[int]], chunks: List[bytes], step_period: float):
+        self.first_address = first_address
+        self.codes = codes  # Codes of every channel at every step
+        self.chunks = chunks  # MPSSE command buffers, split at step boundaries
+        self.step_period = step_period  # s
+
+    @property
+    def step_count(self) -> int:
+        return len(self.codes)
+
+    @property
+    def duration(self) -> float:
+        return self.step_count * self.step_period
+
+
+class Amc7836Ramp:
+    """
+    Precompiles DAC ramps into MPSSE command buffers and streams them to the FT2232H.
+
+    Every step is a no-read SPI burst of the contiguous DAC data registers, a REG_UPDATE write and idle clocks
+    with CS high that pad the step to the step period. The step timing therefore comes from the MPSSE clock
+    rather than host sleeps, and the host only hands over large buffers. GPIO commands for chip select add
+    well under one SPI clock each and are not counted.
+    """
+    DAC_LSB_V = 10.0 / 4095  # V per code on the -10V to 0V range
+    CHUNK_SIZE = 65536  # bytes per USB write
+    COMPLETION_TIMEOUT = 1.0  # s after the expected end of the ramp
+
+    def __init__(self, amc7836: Amc7836, chip_select: FTDI_CS = FTDI_CS.CHIP_SELECT_AD3):
+        self._amc7836 = amc7836
+        self._mpsse = amc7836.io.mpsse
+        self._chip_select = chip_select
+
+    def _frame(self, register_address: int, values: List[int]) -> List[int]:
+        (cs_active, cs_inactive, cs_cmd, cs_idle_dir) = self._mpsse.get_cs_cmd_mask(self._chip_select)
+
+        # Same SPI word as Amc7836FtdiSpi.write_register, clocked out without reading back
+        payload = [(int(register_address) & 0x7F00) >> 8, int(register_address) & 0xFF] + [v & 0xFF for v in values]
+
+        frame = [cs_cmd, cs_active, cs_idle_dir] * self._mpsse.CHIP_SELECT_LOW_REPEAT_COUNT
+        frame += [FTDI_MPSSE_COMMANDS.FT_MPSSE_WR_BYTES_CMD_FALLING_CLOCK_EDGE_NO_READ_MSB_FIRST,
+                  (len(payload) - 1) & 0xFF, (len(payload) - 1) >> 8]
+        frame += payload
+        frame += [cs_cmd, cs_active, cs_idle_dir] * self._mpsse.CHIP_SELECT_HIGH_REPEAT_COUNT
+        frame += [cs_cmd, cs_inactive, cs_idle_dir]
+        return frame
+
+    @staticmethod
+    def _delay(clocks: int) -> List[int]:
+        delay = []
+        byte_clocks, bit_clocks = divmod(clocks, 8)
+        while byte_clocks > 0:
+            count = min(byte_clocks, 0x10000)
+            delay += [FTDI_MPSSE_COMMANDS.FT_MPSSE_CLOCK_N_BYTES_NO_DATA_COMMAND, (count - 1) & 0xFF, (count - 1) >> 8]
+            byte_clocks -= count
+        if bit_clocks > 0:
+            delay += [FTDI_MPSSE_COMMANDS.FT_MPSSE_CLOCK_N_BITS_NO_DATA_COMMAND, bit_clocks - 1]
+        return delay
+
+    def compile(self, first_address: int, start_codes: List[int], end_codes: List[int],
+                slew_rate: float, step_period: float = 0.001) -> DacRamp:
+        """
+        Compile a linear ramp of the DAC data registers from first_address on, one code per channel, that
+        moves no channel faster than slew_rate V/s. All channels arrive at their end codes on the same step.
+        """
+        if len(start_codes) != len(end_codes):
+            raise Exception('amc7836_ramp.py: Start and end codes must cover the same channels.')
+
+        span = max(abs(end - start) for start, end in zip(start_codes, end_codes))
+        codes_per_step = slew_rate * step_period / self.DAC_LSB_V
+        step_count = max(1, ceil(span / codes_per_step))
+
+        clocks_per_step = round(step_period * self._mpsse.clock_frequency_mhz * 1E6)
+        spi_clocks = 8 * ((2 + 2 * len(start_codes)) + 3)
+        if spi_clocks > clocks_per_step:
+            raise Exception('amc7836_ramp.py: Step period is shorter than the SPI transfers of one step.')
+        delay = self._delay(clocks_per_step - spi_clocks)
+
+        update = self._frame(self._amc7836.REGISTER_ADDRESSES['REG_UPDATE'], [0x01])
+
+        codes = []
+        chunks = []
+        chunk = []
+        previous_codes = list(start_codes)
+        for step in range(1, step_count + 1):
+            step_codes = [int(round(start + (end - start) * step / step_count))
+                          for start, end in zip(start_codes, end_codes)]
+            codes.append(step_codes)
+
+            if step_codes == previous_codes:
+                # Slow ramps hold a code for several steps, those steps are idle clocks only
+                step_buffer = self._delay(clocks_per_step)
+            else:
+                data = []
+                for code in step_codes:
+                    data.extend([code & 0xFF, code >> 8])
+                step_buffer = self._frame(first_address, data) + update + delay
+            previous_codes = step_codes
+
+            if len(chunk) + len(step_buffer) > self.CHUNK_SIZE and len(chunk) > 0:
+                chunks.append(bytes(chunk))
+                chunk = []
+            chunk.extend(step_buffer)
+        chunks.append(bytes(chunk))
+
+        return DacRamp(first_address, codes, chunks, step_period)
+
+    def _write_all(self, buffer: bytes) -> None:
+        # The write returns early on the TX timeout while the MPSSE is still working through earlier steps
+        offset = 0
+        while offset < len(buffer):
+            offset += self._mpsse.ftdiInstance.write(buffer[offset:])
+
+    def play(self, ramp: DacRamp) -> float:
+        """
+        Stream the ramp and return once the MPSSE has executed it, with the time it took.
+        """
+        self._mpsse.ftdiInstance.purge(defines.PURGE_RX)
+        start = time.perf_counter()
+
+        for chunk in ramp.chunks:
+            self._write_all(chunk)
+
+        # Reading the GPIO after the last step answers only once every step before it has run
+        self._write_all(bytes([FTDI_MPSSE_COMMANDS.FT_MPSSE_GET_GPIO_LOW_COMMAND,
+                               FTDI_MPSSE_COMMANDS.FT_MPSSE_FLUSH_COMMAND]))
+
+        remaining = start + ramp.duration - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        deadline = time.perf_counter() + self.COMPLETION_TIMEOUT
+        while self._mpsse.ftdiInstance.getQueueStatus() < 1:
+            if time.perf_counter() > deadline:
+                raise Exception('amc7836_ramp.py: MPSSE did not complete the ramp.')
+            time.sleep(0.001)
+        self._mpsse.ftdiInstance.read(1)
+
+        return time.perf_counter() - start
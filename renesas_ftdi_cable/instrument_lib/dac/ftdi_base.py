@@ -1,9 +1,13 @@
 from enum import IntEnum
 from math import floor
+from typing import Union
 
 from ftd2xx import defines
 from ftd2xx import ftd2xx
 
+from instrument_lib.dac.ftdi_recorder import FtdiRecorder, RecordingFtdiDevice
+from instrument_lib.dac.ftdi_trace import FtdiTracer, TracedFtdiDevice
+
 
 class FTDI_DIRECTION(IntEnum):
     INPUT = 0
@@ -126,6 +130,10 @@ class FTDI_MPSSE_COMMANDS:
 
     FT_MPSSE_FLUSH_COMMAND = 0x87
 
+    # Clock without data transfer, used as delays encoded in the command stream
+    FT_MPSSE_CLOCK_N_BITS_NO_DATA_COMMAND = 0x8E  # n + 1 clocks, n is one byte 0 to 7
+    FT_MPSSE_CLOCK_N_BYTES_NO_DATA_COMMAND = 0x8F  # (n + 1) * 8 clocks, n is 16 bits low byte first
+
 
 class FtdiBase:
     ftdiInstance = 0
@@ -190,9 +198,30 @@ class FtdiBase:
             self._searchForSpecificSerialNumber = True
 
         self._isOpen = False
+        self._device = None
+
+    def use_device(self, device, serial: str = 'SIMULATED') -> None:
+        # open() takes device, e.g. an MpsseSimulator, instead of searching the USB bus
+        self._device = device
+        self.serial = serial
+
+    @staticmethod
+    def list_serials(device_type: str = "DEVICE_2232H") -> list:
+        # Serial numbers of every FTDI channel of device_type on the USB bus, e.g. FT2232H ports A and B
+        serials = []
+        for idx in range(0, ftd2xx.createDeviceInfoList()):
+            device_info_detail = ftd2xx.getDeviceInfoDetail(idx)
+            if device_info_detail['type'] == getattr(defines, device_type):
+                serials.append(device_info_detail['serial'].decode("utf-8"))
+        return serials
 
     def open(self):
 
+        if self._device is not None:
+            self.ftdiInstance = self._device
+            self.ftdiInstance.setBitMode(self.FT_MPSSE_LOW_BUS_IDLE_DIR, int(FTDI_BIT_MODE.RESET))
+            return
+
         self.deviceCount = ftd2xx.createDeviceInfoList()
         if self.deviceCount == 0:
             raise Exception('ftdi_base.py: No FTDI devices found on the USB Bus.')
@@ -262,6 +291,53 @@ class FtdiBase:
         # Reset the device
         self.ftdiInstance.setBitMode(self.FT_MPSSE_LOW_BUS_IDLE_DIR, int(FTDI_BIT_MODE.RESET))
 
+    def _find_wrapper(self, wrapper_type: type):
+        # Tracing and recording wrap ftdiInstance in either order, each keeps the next one in .device
+        layer = self.ftdiInstance
+        while isinstance(layer, (TracedFtdiDevice, RecordingFtdiDevice)):
+            if isinstance(layer, wrapper_type):
+                return layer
+            layer = layer.device
+        return None
+
+    def _remove_wrapper(self, wrapper) -> None:
+        if self.ftdiInstance is wrapper:
+            self.ftdiInstance = wrapper.device
+            return
+        layer = self.ftdiInstance
+        while layer.device is not wrapper:
+            layer = layer.device
+        layer.device = wrapper.device
+
+    def enable_trace(self, tracer: FtdiTracer = None) -> FtdiTracer:
+        # Time every ftdiInstance call from here on, after open()
+        traced = self._find_wrapper(TracedFtdiDevice)
+        if traced is not None:
+            return traced.tracer
+        self.ftdiInstance = TracedFtdiDevice(self.ftdiInstance, FtdiTracer() if tracer is None else tracer)
+        return self.ftdiInstance.tracer
+
+    def disable_trace(self) -> Union[None, FtdiTracer]:
+        # Put the device back so calls go to it directly, returns the tracer with what it recorded
+        traced = self._find_wrapper(TracedFtdiDevice)
+        if traced is None:
+            return None
+        self._remove_wrapper(traced)
+        return traced.tracer
+
+    def enable_recording(self, recorder: FtdiRecorder, channel: int = 0) -> None:
+        # Write every byte exchanged with ftdiInstance to recorder as channel, after open()
+        if self._find_wrapper(RecordingFtdiDevice) is None:
+            self.ftdiInstance = RecordingFtdiDevice(self.ftdiInstance, recorder, channel)
+
+    def disable_recording(self) -> Union[None, FtdiRecorder]:
+        # The recorder is shared between channels, closing it is left to the caller
+        recording = self._find_wrapper(RecordingFtdiDevice)
+        if recording is None:
+            return None
+        self._remove_wrapper(recording)
+        return recording.recorder
+
     def close(self):
 
         # Close the port if it's open
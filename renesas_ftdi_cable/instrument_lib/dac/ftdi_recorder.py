@@ -0,0 +1,244 @@
+import struct
+import threading
+import time
+from typing import List
+
+MAGIC = b'HTOLMPS1'
+FILE_HEADER = struct.Struct('<d')  # time.time() when recording started
+RECORD_HEADER = struct.Struct('<BBqqI')  # channel, operation, start ns, duration ns, payload bytes
+POLL_PAYLOAD = struct.Struct('<II')  # queue length returned, number of identical polls
+PURGE_PAYLOAD = struct.Struct('<I')  # purge mask
+
+WRITE = 0
+READ = 1
+QUEUE_STATUS = 2
+PURGE = 3
+OPERATION_NAMES = {WRITE: 'write', READ: 'read', QUEUE_STATUS: 'getQueueStatus', PURGE: 'purge'}
+
+
+class TraceRecord:
+
+    def __init__(self, channel: int, operation: int, start: int, duration: int, data: bytes = b'',
+                 value: int = 0, count: int = 1):
+        self.channel = channel
+        self.operation = operation
+        self.start = start  # ns from the start of the recording
+        self.duration = duration  # ns, all polls of a coalesced getQueueStatus record together
+        self.data = data  # Bytes written or read
+        self.value = value  # Queue length returned or purge mask
+        self.count = count  # Identical getQueueStatus results in a row
+
+    def payload(self) -> bytes:
+        if self.operation == QUEUE_STATUS:
+            return POLL_PAYLOAD.pack(self.value, self.count)
+        if self.operation == PURGE:
+            return PURGE_PAYLOAD.pack(self.value)
+        return bytes(self.data)
+
+
+class FtdiRecorder:
+    """
+    Writes every byte stream exchanged with one or more FTDI channels to a binary trace. Each record holds
+    the channel, the call, its start and duration and the bytes, so the trace can be replayed byte for
+    byte. Consecutive getQueueStatus calls returning the same length are kept as one record with a count,
+    which keeps busy polling loops from dominating the file.
+
+    Layout: MAGIC, start time, then records of RECORD_HEADER followed by the payload.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = open(filename, mode='wb')
+        self._file.write(MAGIC + FILE_HEADER.pack(time.time()))
+        self._origin = time.perf_counter_ns()
+        self._polls = {}  # channel -> TraceRecord of polls not written yet
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def _write(self, record: TraceRecord) -> None:
+        payload = record.payload()
+        self._file.write(RECORD_HEADER.pack(record.channel, record.operation, record.start, record.duration,
+                                            len(payload)) + payload)
+        self.records += 1
+
+    def record(self, channel: int, operation: int, start: int, end: int, data: bytes = b'', value: int = 0) -> None:
+        with self._lock:
+            polls = self._polls.get(channel)
+            if operation == QUEUE_STATUS and polls is not None and polls.value == value:
+                polls.count += 1
+                polls.duration += end - start
+                return
+            if polls is not None:
+                self._write(polls)
+                del self._polls[channel]
+
+            record = TraceRecord(channel, operation, start - self._origin, end - start, data, value)
+            if operation == QUEUE_STATUS:
+                self._polls[channel] = record
+            else:
+                self._write(record)
+
+    def close(self) -> None:
+        with self._lock:
+            for polls in self._polls.values():
+                self._write(polls)
+            self._polls = {}
+            self._file.close()
+
+
+def read_trace(filename: str) -> tuple:
+    """
+    Return the recording start time and the list of TraceRecords of a trace file. A record cut short by a
+    crash ends the list.
+    """
+    with open(filename, mode='rb') as file:
+        data = file.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise Exception(f'ftdi_recorder.py: {filename} is not an MPSSE trace.')
+    start_time = FILE_HEADER.unpack_from(data, len(MAGIC))[0]
+
+    records = []
+    offset = len(MAGIC) + FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        channel, operation, start, duration, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            break
+        payload = data[offset:offset + length]
+        offset += length
+        if operation == QUEUE_STATUS:
+            value, count = POLL_PAYLOAD.unpack(payload)
+            records.append(TraceRecord(channel, operation, start, duration, value=value, count=count))
+        elif operation == PURGE:
+            records.append(TraceRecord(channel, operation, start, duration, value=PURGE_PAYLOAD.unpack(payload)[0]))
+        else:
+            records.append(TraceRecord(channel, operation, start, duration, data=payload))
+    return start_time, records
+
+
+class RecordingFtdiDevice:
+    """
+    Stands in for an ftd2xx device and passes every write, read, getQueueStatus and purge to an
+    FtdiRecorder. Every other attribute goes to the device untouched. Installed by FtdiBase.enable_recording.
+    """
+
+    def __init__(self, device, recorder: FtdiRecorder, channel: int):
+        self.device = device
+        self.recorder = recorder
+        self.channel = channel
+
+    def write(self, data: bytes) -> int:
+        start = time.perf_counter_ns()
+        sent = self.device.write(data)
+        self.recorder.record(self.channel, WRITE, start, time.perf_counter_ns(), data=bytes(data[:sent]))
+        return sent
+
+    def read(self, length: int) -> bytes:
+        start = time.perf_counter_ns()
+        data = self.device.read(length)
+        self.recorder.record(self.channel, READ, start, time.perf_counter_ns(), data=bytes(data))
+        return data
+
+    def getQueueStatus(self) -> int:
+        start = time.perf_counter_ns()
+        length = self.device.getQueueStatus()
+        self.recorder.record(self.channel, QUEUE_STATUS, start, time.perf_counter_ns(), value=length)
+        return length
+
+    def purge(self, mask: int = 0) -> None:
+        start = time.perf_counter_ns()
+        self.device.purge(mask)
+        self.recorder.record(self.channel, PURGE, start, time.perf_counter_ns(), value=mask)
+
+    def __getattr__(self, name: str):
+        return getattr(self.device, name)
+
+
+class ReadMismatch:
+
+    def __init__(self, index: int, channel: int, expected: bytes, actual: bytes):
+        self.index = index  # Record number in the trace
+        self.channel = channel
+        self.expected = expected
+        self.actual = actual
+
+    @property
+    def first_difference(self) -> int:
+        for offset, (expected, actual) in enumerate(zip(self.expected, self.actual)):
+            if expected != actual:
+                return offset
+        return min(len(self.expected), len(self.actual))
+
+    def __str__(self) -> str:
+        offset = self.first_difference
+        return (f'record {self.index} channel {self.channel}: byte {offset} of {len(self.expected)}, '
+                f'expected {self.expected[offset:offset + 8].hex(" ")}, got {self.actual[offset:offset + 8].hex(" ")}')
+
+
+class ReplayReport:
+
+    def __init__(self, records: List[TraceRecord]):
+        self.record_count = len(records)
+        self.recorded_elapsed = (records[-1].start + records[-1].duration - records[0].start) / 1E9 if records else 0.0
+        self.recorded_time = {name: 0 for name in OPERATION_NAMES.values()}  # ns spent in each call when recorded
+        self.replay_time = {name: 0 for name in OPERATION_NAMES.values()}  # ns spent in each call on replay
+        for record in records:
+            self.recorded_time[OPERATION_NAMES[record.operation]] += record.duration
+        self.replay_elapsed = 0.0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.polls = 0  # getQueueStatus calls made on replay to wait for read data
+        self.mismatches: List[ReadMismatch] = []
+        self.bus_time = {}  # channel -> s of clocking, from simulated devices
+
+    @property
+    def identical(self) -> bool:
+        return len(self.mismatches) == 0
+
+    def __str__(self) -> str:
+        lines = [f'{self.record_count} records, {self.bytes_written} bytes written, {self.bytes_read} bytes read',
+                 f'elapsed: recorded {self.recorded_elapsed * 1000:.2f} ms, replay {self.replay_elapsed * 1000:.2f} ms']
+        for name in OPERATION_NAMES.values():
+            lines.append(f'  {name:<16} recorded {self.recorded_time[name] / 1E6:9.2f} ms   '
+                         f'replay {self.replay_time[name] / 1E6:9.2f} ms')
+        for channel, seconds in sorted(self.bus_time.items()):
+            lines.append(f'  channel {channel} bus clocking {seconds * 1000:.2f} ms')
+        lines.append(f'{len(self.mismatches)} read mismatches')
+        lines.extend(f'  {mismatch}' for mismatch in self.mismatches[:20])
+        return '\n'.join(lines)
+
+
+def replay(records: List[TraceRecord], devices: dict, read_timeout: float = 1.0) -> ReplayReport:
+    """
+    Send the recorded writes and purges to devices, channel -> ftd2xx-like device such as a simulator or
+    another cable, and compare every read with the recorded bytes. The recorded polls are not repeated,
+    before each read the device is polled until the data is there, so the replay runs as fast as the
+    device allows.
+    """
+    report = ReplayReport(records)
+    replay_start = time.perf_counter_ns()
+    for index, record in enumerate(records):
+        device = devices.get(record.channel)
+        if device is None:
+            continue
+        start = time.perf_counter_ns()
+        if record.operation == WRITE:
+            device.write(record.data)
+            report.bytes_written += len(record.data)
+        elif record.operation == PURGE:
+            device.purge(record.value)
+        elif record.operation == READ:
+            deadline = time.monotonic() + read_timeout
+            while device.getQueueStatus() < len(record.data) and time.monotonic() < deadline:
+                report.polls += 1
+            data = bytes(device.read(len(record.data)))
+            report.bytes_read += len(data)
+            if data != record.data:
+                report.mismatches.append(ReadMismatch(index, record.channel, record.data, data))
+        report.replay_time[OPERATION_NAMES[record.operation]] += time.perf_counter_ns() - start
+    report.replay_elapsed = (time.perf_counter_ns() - replay_start) / 1E9
+
+    for channel, device in devices.items():
+        if hasattr(device, 'bus_time'):
+            report.bus_time[channel] = device.bus_time
+    return report
@@ -0,0 +1,193 @@
+import time
+
+import numpy
+
+TRANSACTION_DTYPE = numpy.dtype([('start', '<f8'), ('duration_ns', '<i8'), ('bytes_out', '<u4'), ('bytes_in', '<u4'),
+                                 ('polls', '<u4'), ('purges', '<u2'), ('writes', '<u2')])
+OPERATIONS = ['write', 'read', 'getQueueStatus', 'purge']
+
+
+class HdrHistogram:
+    """
+    Log-linear histogram of non-negative integers in the HdrHistogram layout. Values below 2 x half are
+    counted exactly, above that every power of two is split into half linear buckets, so any recorded value
+    is known to within 1 / half of itself. Recording is a bit_length, a shift and a list increment.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_value: int = 1 << 40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.half = 1 << (sub_bucket_bits - 1)
+        self.counts = [0] * (self._index(max_value) + 1)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def _value(self, index: int) -> int:
+        # Middle of the values counted at index
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half) << shift) + ((1 << shift) - 1) // 2
+
+    def record(self, value: int) -> None:
+        self.counts[min(self._index(value), len(self.counts) - 1)] += 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total > 0 else 0.0
+
+    def percentile(self, percent: float) -> int:
+        if self.total == 0:
+            return 0
+        cumulative = numpy.cumsum(self.counts)
+        index = int(numpy.searchsorted(cumulative, max(1, int(numpy.ceil(self.total * percent / 100.0)))))
+        return min(self._value(index), self.max)
+
+    def buckets(self) -> numpy.ndarray:
+        # Value and count of every non-empty bucket
+        counts = numpy.array(self.counts, dtype=numpy.int64)
+        indexes = numpy.flatnonzero(counts)
+        if indexes.size == 0:
+            return numpy.zeros((0, 2), dtype=numpy.int64)
+        return numpy.column_stack([[self._value(int(index)) for index in indexes], counts[indexes]]).astype(numpy.int64)
+
+
+class FtdiTracer:
+    """
+    Timing of every call a TracedFtdiDevice forwards, plus a transaction view of them. A transaction starts
+    with the write that sends a command buffer, includes the queue checks and purges made just before it,
+    and ends with the read of its response, or at the next write for commands without one.
+
+    Transactions go to a ring of the last capacity of them. The ring and the histograms have a single
+    writer, the thread that holds the cable, and take no lock. Readers copy the ring with transactions().
+    """
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.ring = numpy.zeros(capacity, dtype=TRANSACTION_DTYPE)
+        self.count = 0  # Transactions ever recorded, the next goes to ring[count % capacity]
+        self.histograms = {name: HdrHistogram() for name in OPERATIONS}  # Call duration, ns
+        self.transaction_histogram = HdrHistogram()  # ns
+        self.poll_histogram = HdrHistogram()  # getQueueStatus calls after the write
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self._open = None  # [start ns, last call end ns, bytes out, bytes in, polls, purges, writes]
+        self._pending = None  # Checks and purges made before the next write
+
+    def call(self, name: str, start: int, end: int, bytes_out: int = 0, bytes_in: int = 0) -> None:
+        self.histograms[name].record(end - start)
+        if name == 'write':
+            self.bytes_out += bytes_out
+            if self._open is not None:
+                self._close()
+            pending = self._pending if self._pending is not None else [start, end, 0, 0, 0, 0, 0]
+            self._pending = None
+            pending[1] = end
+            pending[2] += bytes_out
+            pending[6] += 1
+            self._open = pending
+            return
+
+        if self._open is None and self._pending is None:
+            self._pending = [start, end, 0, 0, 0, 0, 0]
+        if self._open is None and name == 'read':
+            self._open, self._pending = self._pending, None
+        # A read with no write before it, e.g. flush_buffer, is a transaction of its own
+        transaction = self._pending if self._open is None else self._open
+        transaction[1] = end
+        if name == 'getQueueStatus' and transaction is self._open:
+            transaction[4] += 1
+        elif name == 'purge':
+            transaction[5] += 1
+        elif name == 'read':
+            self.bytes_in += bytes_in
+            transaction[3] += bytes_in
+            if transaction is self._open:
+                self._close()
+
+    def _close(self) -> None:
+        start, end, bytes_out, bytes_in, polls, purges, writes = self._open
+        self._open = None
+        self.ring[self.count % self.capacity] = (start / 1E9, end - start, bytes_out, bytes_in, polls, purges, writes)
+        self.count += 1
+        self.transaction_histogram.record(end - start)
+        self.poll_histogram.record(polls)
+
+    def transactions(self) -> numpy.ndarray:
+        # Recorded transactions still in the ring, oldest first, start in time.perf_counter seconds
+        count = self.count
+        if count <= self.capacity:
+            return self.ring[:count].copy()
+        split = count % self.capacity
+        return numpy.concatenate([self.ring[split:], self.ring[:split]])
+
+    def summary(self) -> str:
+        lines = [f"{'':<16}{'count':>10}{'mean us':>10}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>10}"]
+        for name, histogram in list(self.histograms.items()) + [('transaction', self.transaction_histogram)]:
+            lines.append(f'{name:<16}{histogram.total:>10}{histogram.mean / 1E3:>10.1f}'
+                         f'{histogram.percentile(50) / 1E3:>10.1f}{histogram.percentile(90) / 1E3:>10.1f}'
+                         f'{histogram.percentile(99) / 1E3:>10.1f}{histogram.max / 1E3:>10.1f}')
+        polls = self.poll_histogram
+        lines.append(f'polls/transaction mean {polls.mean:.1f}, p99 {polls.percentile(99)}, max {polls.max}')
+        lines.append(f'{self.bytes_out} bytes out, {self.bytes_in} bytes in')
+        return '\n'.join(lines)
+
+    def dump(self, filename: str) -> None:
+        """
+        Save the transactions and every histogram as value, count rows to a numpy .npz file.
+        """
+        histograms = {f'{name}_ns': histogram.buckets() for name, histogram in self.histograms.items()}
+        histograms['transaction_ns'] = self.transaction_histogram.buckets()
+        histograms['polls'] = self.poll_histogram.buckets()
+        numpy.savez(filename, transactions=self.transactions(), **histograms)
+
+
+class TracedFtdiDevice:
+    """
+    Stands in for an ftd2xx device and times write, read, getQueueStatus and purge through an FtdiTracer.
+    Every other attribute goes to the device untouched. Installed by FtdiBase.enable_trace, so the device
+    is called directly while tracing is off.
+    """
+
+    def __init__(self, device, tracer: FtdiTracer):
+        self.device = device
+        self.tracer = tracer
+
+    def write(self, data: bytes) -> int:
+        start = time.perf_counter_ns()
+        sent = self.device.write(data)
+        self.tracer.call('write', start, time.perf_counter_ns(), bytes_out=sent)
+        return sent
+
+    def read(self, length: int) -> bytes:
+        start = time.perf_counter_ns()
+        data = self.device.read(length)
+        self.tracer.call('read', start, time.perf_counter_ns(), bytes_in=len(data))
+        return data
+
+    def getQueueStatus(self) -> int:
+        start = time.perf_counter_ns()
+        length = self.device.getQueueStatus()
+        self.tracer.call('getQueueStatus', start, time.perf_counter_ns())
+        return length
+
+    def purge(self, mask: int = 0) -> None:
+        start = time.perf_counter_ns()
+        self.device.purge(mask)
+        self.tracer.call('purge', start, time.perf_counter_ns())
+
+    def __getattr__(self, name: str):
+        return getattr(self.device, name)
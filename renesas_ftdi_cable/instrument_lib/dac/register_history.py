@@ -0,0 +1,286 @@
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Union, List, Callable
+
+import numpy
+
+from instrument_lib.dac.amc7836 import Amc7836
+
+IMAGE_SIZE = 0xC1  # Registers 0x00 to ADC_TRIG at 0xC0
+VOLATILE_ADDRESSES = [0x0F] + list(range(0x20, 0x50)) + [0x70, 0x71, 0x72, 0x7A, 0xC0]
+# REG_UPDATE and ADC_TRIG clear themselves, ADC data, alarm status and GPIO inputs follow the hardware
+STATUS_FIRST = 0x70  # ALARM_STAT0, ALARM_STAT1 and GEN_STAT, reading them clears latched alarms
+STATUS_LAST = 0x72
+
+MAGIC = b'HTOLREG1'
+RECORD_HEADER = struct.Struct('<BqH')  # kind, time ns, payload entries
+BASE = 0
+DELTA = 1
+DELTA_DTYPE = numpy.dtype([('address', '<u2'), ('xor', 'u1')])
+
+
+def read_image(amc7836: Amc7836, size: int = IMAGE_SIZE) -> numpy.ndarray:
+    """
+    Every register from address 0, in one SPI burst up to the alarm status registers and one after them.
+    The status registers are never read, a snapshot must not clear an alarm the interlock watchdog has not
+    seen yet. They stay 0 in the image.
+    """
+    image = numpy.zeros(size, dtype=numpy.uint8)
+    for first, end in [(0x00, min(size, STATUS_FIRST)), (STATUS_LAST + 1, size)]:
+        if end > first:
+            image[first:end] = amc7836.read_register(first, end - first)
+    return image
+
+
+class RegisterChange:
+
+    def __init__(self, address: int, name: Union[None, str], old: int, new: int,
+                 timestamp: Union[None, numpy.datetime64] = None):
+        self.address = address
+        self.name = name
+        self.old = old
+        self.new = new
+        self.timestamp = timestamp  # Snapshot that first saw the new value
+
+    @property
+    def flipped_bits(self) -> int:
+        return self.old ^ self.new
+
+    def __str__(self) -> str:
+        when = '' if self.timestamp is None else f'{self.timestamp} '
+        return f'{when}0x{self.address:02X} {self.name or "?"}: 0x{self.old:02X} -> 0x{self.new:02X}'
+
+
+class RegisterHistory:
+    """
+    Append-only history of register images. The first snapshot, and one every base_interval after it, is
+    stored whole. Every other snapshot is stored as the XOR of the bytes that differ from the previous
+    one, so an unchanged image costs an 11 byte record and a minute-by-minute history of a long run stays
+    in the megabytes.
+
+    Opening the file builds an index of the snapshots at which each address changed, so changes() does not
+    rebuild images. image() starts from the nearest base and applies at most base_interval deltas.
+
+    Volatile addresses are zeroed before storing, they would otherwise change in every snapshot.
+    """
+
+    def __init__(self, filename: str = 'register_history.bin', image_size: int = IMAGE_SIZE,
+                 base_interval: int = 1440, names: Union[None, dict] = None,
+                 volatile: Union[None, List[int]] = None):
+        self.filename = filename
+        self.image_size = image_size
+        self.base_interval = base_interval
+        self.names = {} if names is None else {address: name for name, address in names.items()}
+        # names: register name -> address, inverted here
+        self._mask = numpy.ones(image_size, dtype=bool)
+        self._mask[[address for address in (VOLATILE_ADDRESSES if volatile is None else volatile)
+                    if address < image_size]] = False
+
+        self._times = []  # ns of every snapshot
+        self._offsets = []  # File offset of every snapshot record
+        self._bases = []  # Snapshot numbers of the base images
+        self._changes = {}  # address -> snapshot numbers at which it changed
+        self._last = None  # Last image
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            self._load()
+        else:
+            with open(filename, mode='wb') as file:
+                file.write(MAGIC + struct.pack('<H', image_size))
+        self._file = open(filename, mode='ab')
+
+    def _read_record(self, file) -> Union[None, tuple]:
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        kind, timestamp, entries = RECORD_HEADER.unpack(header)
+        size = self.image_size if kind == BASE else entries * DELTA_DTYPE.itemsize
+        payload = file.read(size)
+        if len(payload) < size:
+            return None
+        if kind == BASE:
+            return kind, timestamp, numpy.frombuffer(payload, dtype=numpy.uint8).copy()
+        return kind, timestamp, numpy.frombuffer(payload, dtype=DELTA_DTYPE)
+
+    def _load(self) -> None:
+        with open(self.filename, mode='rb') as file:
+            header = file.read(len(MAGIC) + 2)
+            if header[:len(MAGIC)] != MAGIC:
+                raise Exception(f'register_history.py: {self.filename} is not a register history.')
+            if struct.unpack('<H', header[len(MAGIC):])[0] != self.image_size:
+                raise Exception(f'register_history.py: {self.filename} holds images of another size.')
+
+            while True:
+                offset = file.tell()
+                record = self._read_record(file)
+                if record is None:
+                    break
+                kind, timestamp, payload = record
+                self._index(kind, timestamp, offset, payload)
+
+        if offset < os.path.getsize(self.filename):
+            with open(self.filename, mode='rb+') as file:
+                file.truncate(offset)
+        # Drop a record torn by a crash
+
+    def _index(self, kind: int, timestamp: int, offset: int, payload: numpy.ndarray) -> None:
+        number = len(self._times)
+        if kind == BASE:
+            changed = numpy.flatnonzero(payload != self._last) if self._last is not None else []
+            self._last = payload
+            self._bases.append(number)
+        else:
+            changed = payload['address']
+            self._last = self._last.copy()
+            self._last[changed] ^= payload['xor']
+        for address in changed:
+            self._changes.setdefault(int(address), []).append(number)
+        self._times.append(timestamp)
+        self._offsets.append(offset)
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    @property
+    def times(self) -> numpy.ndarray:
+        return numpy.array(self._times, dtype=numpy.int64).view('datetime64[ns]')
+
+    def record(self, image, timestamp: Union[None, datetime, numpy.datetime64] = None) -> List[RegisterChange]:
+        """
+        Append a snapshot and return the registers that differ from the previous one.
+        """
+        image = numpy.asarray(image, dtype=numpy.uint8)
+        if image.size != self.image_size:
+            raise Exception(f'register_history.py: Image has {image.size} registers, expected {self.image_size}.')
+        image = numpy.where(self._mask, image, 0).astype(numpy.uint8)
+        stamp = int(numpy.datetime64(datetime.now() if timestamp is None else timestamp, 'ns').astype(numpy.int64))
+
+        with self._lock:
+            previous = self._last
+            changed = numpy.array([], dtype=numpy.int64) if previous is None else numpy.flatnonzero(image != previous)
+            offset = self._file.tell()
+            if previous is None or len(self._times) - self._bases[-1] >= self.base_interval:
+                kind = BASE
+                self._file.write(RECORD_HEADER.pack(BASE, stamp, 0) + image.tobytes())
+                payload = image
+            else:
+                kind = DELTA
+                payload = numpy.zeros(changed.size, dtype=DELTA_DTYPE)
+                payload['address'] = changed
+                payload['xor'] = image[changed] ^ previous[changed]
+                self._file.write(RECORD_HEADER.pack(DELTA, stamp, changed.size) + payload.tobytes())
+            self._file.flush()
+            self._index(kind, stamp, offset, payload)
+
+        return [RegisterChange(int(address), self.names.get(int(address)), int(previous[address]), int(image[address]),
+                               numpy.datetime64(stamp, 'ns')) for address in changed]
+
+    def image(self, number: int) -> numpy.ndarray:
+        number = range(len(self._times))[number]
+        # Negative numbers count from the last snapshot
+        base = self._bases[numpy.searchsorted(self._bases, number, side='right') - 1]
+        with open(self.filename, mode='rb') as file:
+            file.seek(self._offsets[base])
+            image = self._read_record(file)[2]
+            for _ in range(number - base):
+                kind, _, payload = self._read_record(file)
+                if kind == BASE:
+                    image = payload
+                else:
+                    image[payload['address']] ^= payload['xor']
+        return image
+
+    def find(self, timestamp: Union[datetime, numpy.datetime64]) -> int:
+        # Number of the last snapshot taken at or before timestamp
+        stamp = int(numpy.datetime64(timestamp, 'ns').astype(numpy.int64))
+        return int(numpy.searchsorted(numpy.array(self._times, dtype=numpy.int64), stamp, side='right')) - 1
+
+    def address(self, register: Union[int, str]) -> int:
+        if isinstance(register, int):
+            return register
+        for address, name in self.names.items():
+            if name == register:
+                return address
+        raise Exception(f'register_history.py: Unknown register {register}.')
+
+    def changes(self, register: Union[int, str]) -> List[RegisterChange]:
+        """
+        Every change of one register, by address or name, with the snapshot that first saw it.
+        """
+        address = self.address(register)
+        changes = []
+        for number in self._changes.get(address, []):
+            before, after = self.image(number - 1)[address], self.image(number)[address]
+            changes.append(RegisterChange(address, self.names.get(address), int(before), int(after),
+                                          numpy.datetime64(self._times[number], 'ns')))
+        return changes
+
+    def changed_between(self, first: int, second: int) -> List[int]:
+        # Addresses with a change recorded after snapshot first up to snapshot second, from the index only
+        return sorted(address for address, numbers in self._changes.items()
+                      if any(first < number <= second for number in numbers))
+
+    def diff(self, first: int, second: int) -> List[RegisterChange]:
+        """
+        Registers whose value differs between two snapshots.
+        """
+        old, new = self.image(first), self.image(second)
+        return [RegisterChange(int(address), self.names.get(int(address)), int(old[address]), int(new[address]))
+                for address in numpy.flatnonzero(old != new)]
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class RegisterMonitor:
+    """
+    Background thread that snapshots the registers every interval seconds into a RegisterHistory and calls
+    on_change with the registers that changed. read_image runs under lock, the lock of everything else
+    using the FTDI cable.
+    """
+
+    def __init__(self, read_image: Callable[[], numpy.ndarray], history: RegisterHistory, interval: float = 60.0,
+                 lock: Union[None, threading.RLock] = None,
+                 on_change: Union[None, Callable[[List[RegisterChange]], None]] = None):
+        self.read_image = read_image
+        self.history = history
+        self.interval = interval  # s
+        self.lock = threading.RLock() if lock is None else lock
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self) -> List[RegisterChange]:
+        with self.lock:
+            image = self.read_image()
+        changes = self.history.record(image)
+        if len(changes) > 0 and self.on_change is not None:
+            self.on_change(changes)
+        return changes
+
+    def _run(self) -> None:
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.snapshot()
+            except Exception as error:
+                print(f'register_history.py: Register snapshot failed: {error}')
+            next_time += self.interval
+            self._stop.wait(max(0.0, next_time - time.monotonic()))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='register-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
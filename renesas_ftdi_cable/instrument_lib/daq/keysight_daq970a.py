@@ -1,11 +1,59 @@
 import pyvisa
 import time
 import csv
-from datetime import datetime, timedelta
+import numpy
+from datetime import datetime
 from typing import Union, List
+from instrument_lib.daq.scan_result import ScanResult
 from instrument_lib.instrument_base import InstrumentBase
 
+
+class MeasurementProfile:
+    # Integration, autozero, ranging and channel delay settings applied to a whole scan list
+
+    def __init__(self, name: str, nplc: float, autozero: str, fixed_range: bool,
+                 channel_delay: Union[None, float]):
+        self.name = name
+        self.nplc = nplc
+        self.autozero = autozero  # OFF, ONCE or ON
+        self.fixed_range = fixed_range  # Use the range learned per channel instead of autorange
+        self.channel_delay = channel_delay  # None selects the automatic channel delay
+        self.readings_per_second = None  # Measured on the bench with KeysightDaq970a.benchmark_profile
+
+
+def default_measurement_profiles() -> dict:
+    return {
+        # Bias search inner loop: shortest integration, no autozero, no settling delay
+        'fast': MeasurementProfile('fast', nplc=0.02, autozero='OFF', fixed_range=True, channel_delay=0),
+        # Interactive checks: one power line cycle rejects mains pickup
+        'balanced': MeasurementProfile('balanced', nplc=1, autozero='ONCE', fixed_range=True, channel_delay=0),
+        # Long term HTOL logging: full autozero and automatic channel delay
+        'precise': MeasurementProfile('precise', nplc=10, autozero='ON', fixed_range=True, channel_delay=None),
+    }
+
+
+# One record per reading returned with FORM:READ:CHAN/TIME/ALAR ON
+# time is seconds since the start of the scan (FORM:READ:TIME:TYPE REL)
+# alarm is 0 = no alarm, 1 = low limit, 2 = high limit
+SCAN_READING_DTYPE = numpy.dtype([('channel', numpy.int32),
+                                  ('time', numpy.float64),
+                                  ('value', numpy.float64),
+                                  ('alarm', numpy.int8)])
+
+
 class KeysightDaq970a(InstrumentBase):
+    # DCV ranges of the DAQM900A / internal DMM
+    VOLTAGE_RANGES = [0.1, 1.0, 10.0, 100.0, 300.0]
+    RANGE_HEADROOM = 1.2
+    OVERLOAD = 9.9E37
+
+    def __init__(self, resource_name: str, timeout: int = 5000):
+        super().__init__(resource_name, timeout)
+        self.profiles = default_measurement_profiles()
+        self._learned_ranges = {}
+        self._active_profile = None
+        # Order of the fields the instrument appends to every reading
+        self._reading_fields = ['value']
 
     def measure_voltage(self, ch: Union[int, str], v_range: Union[None, float] = None,
                         resolution: Union[None, float] = None) -> Union[float, List[float]]:
@@ -18,6 +66,9 @@ class KeysightDaq970a(InstrumentBase):
         else:
             command = f"{command} (@{ch})"
 
+        # MEAS? reprograms the configuration and scan list of the channels
+        self._active_profile = None
+
         response = self.query(command)
         if isinstance(ch, int):
             return float(response)
@@ -25,33 +76,221 @@ class KeysightDaq970a(InstrumentBase):
             values = response.split(',')
             return [float(value) for value in values]
 
-    def configure_scan(self, interval_count: int, interval_length: int):
+    def reset(self) -> None:
+        super().reset()
+        self._active_profile = None
+        self._reading_fields = ['value']
+
+    def configure_reading_format(self, channel: bool = True, time_stamp: bool = True, alarm: bool = True) -> None:
+        """
+        Make every reading carry its channel number, relative scan time and alarm state.
+        """
+        self.write("FORM:READ:UNIT OFF")
+        self.write(f"FORM:READ:TIME {'ON' if time_stamp else 'OFF'}")
+        self.write("FORM:READ:TIME:TYPE REL")
+        self.write(f"FORM:READ:CHAN {'ON' if channel else 'OFF'}")
+        self.write(f"FORM:READ:ALAR {'ON' if alarm else 'OFF'}")
+
+        # The instrument returns the fields in this order regardless of the order they were enabled
+        self._reading_fields = ['value']
+        if time_stamp:
+            self._reading_fields.append('time')
+        if channel:
+            self._reading_fields.append('channel')
+        if alarm:
+            self._reading_fields.append('alarm')
+
+    def decode_readings(self, response: str) -> numpy.ndarray:
+        """
+        Decode a FETCH?/READ? response into a SCAN_READING_DTYPE array. The whole response is parsed in one
+        numpy call and the fields are de-interleaved with strided views.
+        """
+        raw = numpy.fromstring(response, dtype=numpy.float64, sep=',')
+        field_count = len(self._reading_fields)
+        if raw.size % field_count != 0:
+            raise Exception(f'keysight_daq970a.py: Response has {raw.size} values, '
+                            f'not a multiple of {field_count} fields per reading.')
+
+        raw = raw.reshape(-1, field_count)
+        readings = numpy.zeros(raw.shape[0], dtype=SCAN_READING_DTYPE)
+        for index, field in enumerate(self._reading_fields):
+            readings[field] = raw[:, index]
+        return readings
+
+    def fetch_readings(self) -> numpy.ndarray:
+        return self.decode_readings(self.query("FETCH?"))
+
+    def last_readings(self, ch: Union[int, str, List[int]]) -> numpy.ndarray:
+        """
+        Latest reading of each channel from reading memory in one transfer. Unlike READ? this does not disturb
+        a scan in progress, the channels must be in its scan list.
+        """
+        channels = self.expand_channels(ch)
+        response = self.query(";:".join(f"DATA:LAST? 1,(@{channel})" for channel in channels))
+        return self.decode_readings(response.replace(';', ','))
+
+    def remove_readings(self) -> numpy.ndarray:
+        """
+        Take every reading in memory so far and erase it, oldest first. Called while a scan runs this keeps
+        reading memory short and hands over the readings as they come.
+        """
+        points = int(self.query("DATA:POIN?"))
+        if points == 0:
+            return numpy.zeros(0, dtype=SCAN_READING_DTYPE)
+        return self.decode_readings(self.query(f"DATA:REM? {points}"))
+
+    @staticmethod
+    def split_sweeps(readings: numpy.ndarray, ch: Union[str, List[int]]) -> numpy.ndarray:
+        """
+        Reshape readings into a sweeps x channels array, checking the channel column against the scan list.
+        """
+        channels = numpy.array(KeysightDaq970a.expand_channels(ch), dtype=numpy.int32)
+        if readings.size % channels.size != 0:
+            raise Exception('keysight_daq970a.py: Readings do not contain a whole number of sweeps.')
+
+        sweeps = readings.reshape(-1, channels.size)
+        if not numpy.array_equal(sweeps['channel'], numpy.broadcast_to(channels, sweeps.shape)):
+            raise Exception('keysight_daq970a.py: Reading channels do not follow the scan list order.')
+        return sweeps
+
+    def select_range(self, value: float) -> float:
+        for v_range in self.VOLTAGE_RANGES:
+            if abs(value) * self.RANGE_HEADROOM <= v_range:
+                return v_range
+        return self.VOLTAGE_RANGES[-1]
+
+    def learn_ranges(self, ch: Union[int, str, List[int]]) -> dict:
+        """
+        Measure each channel once with autorange and remember the smallest fixed range that covers it.
+        """
+        channels = self.expand_channels(ch)
+        values = self.measure_voltage(self.format_channels(channels))
+        for channel, value in zip(channels, values):
+            self._learned_ranges[channel] = self.select_range(value)
+        return {channel: self._learned_ranges[channel] for channel in channels}
+
+    def apply_profile(self, profile: Union[str, MeasurementProfile], ch: Union[int, str, List[int]]) -> None:
+        """
+        Configure DC voltage measurement on every channel of ch with the given profile and make ch the scan list.
+        """
+        if isinstance(profile, str):
+            profile = self.profiles[profile]
+        channels = self.expand_channels(ch)
+        channel_list = self.format_channels(channels)
+
+        if profile.fixed_range:
+            unknown = [channel for channel in channels if channel not in self._learned_ranges]
+            if len(unknown) > 0:
+                self.learn_ranges(unknown)
+
+            # Channels sharing a range are configured with one command
+            ranges = {}
+            for channel in channels:
+                ranges.setdefault(self._learned_ranges[channel], []).append(channel)
+            for v_range, range_channels in ranges.items():
+                self.write(f"CONF:VOLT:DC {v_range},(@{self.format_channels(range_channels)})")
+        else:
+            self.write(f"CONF:VOLT:DC AUTO,(@{channel_list})")
+
+        self.write(f"SENS:VOLT:DC:NPLC {profile.nplc},(@{channel_list})")
+        self.write(f"SENS:VOLT:DC:ZERO:AUTO {profile.autozero},(@{channel_list})")
+
+        if profile.channel_delay is None:
+            self.write(f"ROUT:CHAN:DEL:AUTO ON,(@{channel_list})")
+        else:
+            self.write(f"ROUT:CHAN:DEL {profile.channel_delay},(@{channel_list})")
+
+        self.write(f"ROUT:SCAN (@{channel_list})")
+
+        # One immediate sweep per READ?, a timer scan set up earlier would make READ? run the whole scan
+        self.write("TRIG:SOUR IMM")
+        self.write("TRIG:COUN 1")
+
+        self._active_profile = (profile.name, tuple(channels))
+
+    def read_voltage(self, ch: Union[int, str, List[int]],
+                     profile: Union[str, MeasurementProfile] = 'fast') -> Union[float, List[float]]:
+        """
+        Read the channels with a measurement profile. The instrument is only reconfigured when the profile or
+        channel list changes, and a channel that overloads its learned range is moved up one range and re-read.
+        """
+        if isinstance(profile, str):
+            profile = self.profiles[profile]
+        channels = self.expand_channels(ch)
+
+        if self._active_profile != (profile.name, tuple(channels)):
+            self.apply_profile(profile, channels)
+
+        values = [float(value) for value in self.decode_readings(self.query("READ?"))['value']]
+
+        overloaded = [channel for channel, value in zip(channels, values) if abs(value) >= self.OVERLOAD]
+        if profile.fixed_range and len(overloaded) > 0:
+            for channel in overloaded:
+                index = self.VOLTAGE_RANGES.index(self._learned_ranges[channel])
+                self._learned_ranges[channel] = self.VOLTAGE_RANGES[min(index + 1, len(self.VOLTAGE_RANGES) - 1)]
+            self.apply_profile(profile, channels)
+            values = [float(value) for value in self.decode_readings(self.query("READ?"))['value']]
+
+        if isinstance(ch, int):
+            return values[0]
+        return values
+
+    def start_timer_scan(self, interval_count: int, interval_length: float) -> None:
+        """
+        Start interval_count sweeps of the scan list, one every interval_length seconds.
+        """
+        self.write("TRIG:COUNT " + str(interval_count))
+        self.write("TRIG:SOUR TIMER")
+        self.write("TRIG:TIMER " + str(interval_length))
+        # The triggers no longer match the profile, read_voltage has to apply it again
+        self._active_profile = None
+        self.write("INIT")
+
+    def benchmark_profile(self, profile: Union[str, MeasurementProfile], ch: Union[int, str, List[int]],
+                          count: int = 20) -> float:
+        """
+        Time count scan sweeps with the profile and store the readings per second on the profile.
+        """
+        if isinstance(profile, str):
+            profile = self.profiles[profile]
+        channels = self.expand_channels(ch)
+
+        self.apply_profile(profile, channels)
+        # The first sweep includes the one-time autozero and range settling
+        self.query("READ?")
+
+        start = time.perf_counter()
+        for _ in range(count):
+            self.query("READ?")
+        elapsed = time.perf_counter() - start
+
+        profile.readings_per_second = (count * len(channels)) / elapsed
+        print(f"Profile {profile.name}: {profile.readings_per_second:.1f} readings/s on {len(channels)} channel(s)")
+        return profile.readings_per_second
+
+    def configure_scan(self, interval_count: int, interval_length: int,
+                       ch: Union[str, List[int]] = "111,112", profile: str = 'precise'):
         # Reset the instrument
         self.write("*RST")
         self.write("*CLS")
+        self._active_profile = None
         time.sleep(1)
 
         # Clear the scan list
         self.write("ROUT:SCAN (@)")
 
-        # Configure the channels for DC voltage measurement
-        self.write("CONF:VOLT:DC AUTO,DEF,(@111,112)")
-
-        # Add channels to the scan list
-        self.write("ROUT:SCAN (@111,112)")
-
-        self.write("TRIG:COUNT " + str(interval_count))
-
-        self.write("TRIG:SOUR TIMER")
+        # Configure the channels for DC voltage measurement and add them to the scan list
+        self.apply_profile(profile, ch)
 
-        self.write("TRIG:TIMER " + str(interval_length))
+        # Tag every reading with its channel, scan time and alarm state
+        self.configure_reading_format()
 
         # Initiate the scan
-        self.write("INIT")
+        self.start_timer_scan(interval_count, interval_length)
 
         time.sleep((interval_length * interval_count) + 5)
 
-        results = self.query("FETCH?")
+        results = self.fetch_readings()
         print("Scan Results:", results)
         return results
 
@@ -67,7 +306,7 @@ class KeysightDaq970a(InstrumentBase):
         return measurements
 
     def save_measurements_to_csv(self, measurements, filename):
-        # Save the measurements to a CSV file
+        # Save the measurements to a CSV file, written at once so the logger's file naming does not apply
         with open(filename, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(["Timestamp", "CurrentVDD2", "CurrentVDD3_C", "Interval (s)"])
@@ -82,29 +321,22 @@ def main():
 
     print(daq.query("*IDN?"))
 
-    # Retrieve start date and time
-    datetime_str = daq.retrieve_date_time()
-    start_datetime = datetime.strptime(datetime_str, "%Y,%m,%d,%H,%M,%S.%f")
-
     # Configuration parameters
     interval_count = 30  # Number of intervals
     interval_length = 10  # Length of each interval in seconds
 
     # Configure the scan and retrieve results
-    raw_results = daq.configure_scan(interval_count, interval_length)
+    readings = daq.configure_scan(interval_count, interval_length)
 
-    # Process the results
-    measurements = []
-    for i in range(interval_count):
-        # Calculate the timestamp for each interval
-        timestamp = start_datetime + timedelta(seconds=interval_length * i)
-        parsed_results = daq.parse_measurements(raw_results)
-        measurements.append((timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), parsed_results, interval_length * (i + 1)))
+    # Start date and time of the scan just run, the reading times count from it
+    datetime_str = daq.retrieve_date_time()
+    start_datetime = datetime.strptime(datetime_str, "%Y,%m,%d,%H,%M,%S.%f")
 
-    # Save to CSV
-    daq.save_measurements_to_csv(measurements, 'measurements.csv')
+    # One row per sweep stamped with the instrument time of its first reading, formatted only when written
+    result = ScanResult.from_readings(readings, "111,112", start_datetime)
+    files = result.export_csv('measurements.csv', ["CurrentVDD2", "CurrentVDD3_C"])
 
-    print("Measurements completed and saved to measurements.csv")
+    print(f"Measurements completed and saved to {', '.join(files)}")
 
 if __name__ == "__main__":
     main()
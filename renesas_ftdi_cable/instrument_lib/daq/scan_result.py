@@ -0,0 +1,98 @@
+import os
+from datetime import datetime
+from typing import Union, List
+
+import numpy
+
+from instrument_lib.instrument_base import InstrumentBase
+from instrument_lib.measurement_logger import MeasurementLogger
+
+
+class ScanResult:
+    """
+    Readings of a scan as channels x sweeps matrices of values and datetime64[ns] timestamps.
+
+    Timestamps are built for all readings at once, from the scan start time plus the instrument's relative
+    reading times, or plus sweep index x trigger interval when the readings carry no time. Nothing is
+    formatted as text until export.
+    """
+
+    def __init__(self, channels: List[int], values: numpy.ndarray, timestamps: numpy.ndarray,
+                 alarms: Union[None, numpy.ndarray] = None):
+        self.channels = channels
+        self.values = values  # channels x sweeps
+        self.timestamps = timestamps  # channels x sweeps, datetime64[ns]
+        self.alarms = alarms  # channels x sweeps, 0 none, 1 low, 2 high
+
+    @staticmethod
+    def _offsets(seconds: numpy.ndarray) -> numpy.ndarray:
+        return numpy.rint(numpy.asarray(seconds, dtype=numpy.float64) * 1E9).astype('timedelta64[ns]')
+
+    @classmethod
+    def from_readings(cls, readings: numpy.ndarray, ch: Union[str, List[int]],
+                      start_time: Union[datetime, numpy.datetime64],
+                      interval: Union[None, float] = None) -> 'ScanResult':
+        """
+        Build from readings with channel, time, value and alarm fields in scan list order, as returned by
+        KeysightDaq970a.fetch_readings. With interval every channel of a sweep gets the sweep's trigger time
+        instead of its own reading time.
+        """
+        channels = InstrumentBase.expand_channels(ch)
+        if readings.size % len(channels) != 0:
+            raise Exception('scan_result.py: Readings do not contain a whole number of sweeps.')
+
+        sweeps = readings.reshape(-1, len(channels)).T
+        # Row n is channel n of the scan list, column m is sweep m
+        if not numpy.array_equal(sweeps['channel'], numpy.broadcast_to(numpy.array(channels)[:, None], sweeps.shape)):
+            raise Exception('scan_result.py: Reading channels do not follow the scan list order.')
+
+        start = numpy.datetime64(start_time, 'ns')
+        if interval is None:
+            timestamps = start + cls._offsets(sweeps['time'])
+        else:
+            timestamps = numpy.broadcast_to(start + cls._offsets(numpy.arange(sweeps.shape[1]) * interval),
+                                            sweeps.shape)
+        return cls(channels, numpy.array(sweeps['value']), timestamps, numpy.array(sweeps['alarm']))
+
+    @classmethod
+    def from_values(cls, values: Union[List[float], numpy.ndarray], ch: Union[str, List[int]],
+                    start_time: Union[datetime, numpy.datetime64], interval: float) -> 'ScanResult':
+        # Plain values without reading fields, e.g. from FORM:READ:TIME OFF
+        channels = InstrumentBase.expand_channels(ch)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.size % len(channels) != 0:
+            raise Exception('scan_result.py: Values do not contain a whole number of sweeps.')
+
+        values = values.reshape(-1, len(channels)).T
+        start = numpy.datetime64(start_time, 'ns')
+        timestamps = numpy.broadcast_to(start + cls._offsets(numpy.arange(values.shape[1]) * interval), values.shape)
+        return cls(channels, values, timestamps)
+
+    @property
+    def sweep_count(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def sweep_times(self) -> numpy.ndarray:
+        # Time of the first reading of every sweep
+        return self.timestamps[0]
+
+    def channel(self, ch: int) -> numpy.ndarray:
+        return self.values[self.channels.index(ch)]
+
+    def format_timestamps(self, unit: str = 'us') -> numpy.ndarray:
+        return numpy.char.replace(numpy.datetime_as_string(self.timestamps, unit=unit), 'T', ' ')
+
+    def log(self, logger: MeasurementLogger) -> None:
+        # One row per sweep, the logger formats on its own thread
+        logger.log_rows(self.sweep_times, self.values.T)
+
+    def export_csv(self, filename: str, names: Union[None, List[str]] = None) -> List[str]:
+        """
+        Write one row per sweep through MeasurementLogger and return the files written. filename without
+        its extension is the logger's base name.
+        """
+        names = [str(channel) for channel in self.channels] if names is None else names
+        with MeasurementLogger(os.path.splitext(filename)[0], names) as logger:
+            self.log(logger)
+        return logger.files
@@ -1,35 +1,121 @@
+import time
+from typing import Union, List, Callable
+
 from pyvisa import ResourceManager
 from pyvisa.resources import MessageBasedResource
 
+from instrument_lib.scpi_trace import ScpiTracer
+
+
+def wait_until(condition: Callable[[], bool], timeout: float, poll_interval: float = 0.05) -> float:
+    """
+    Poll condition until it returns True and return the time it took. Raises if timeout seconds pass first.
+    """
+    start = time.perf_counter()
+    while True:
+        if condition():
+            return time.perf_counter() - start
+        if time.perf_counter() - start > timeout:
+            raise Exception(f'instrument_base.py: Condition not met within {timeout} seconds.')
+        time.sleep(poll_interval)
+
 
 class InstrumentBase:
 
     def __init__(self, resource_name: str, timeout: int = 5000):
         self._resource = None
+        self._tracer: Union[None, ScpiTracer] = None
+        self._trace_name = self.__class__.__name__
         rm = ResourceManager()
         self._resource: MessageBasedResource = rm.open_resource(resource_name)
         self._resource.timeout = timeout
+        if resource_name.upper().endswith('::SOCKET'):
+            # Raw sockets have no end of message signalling, SCPI instruments terminate with a line feed
+            self._resource.read_termination = '\n'
+            self._resource.write_termination = '\n'
+
+    def enable_trace(self, tracer: Union[None, ScpiTracer] = None, name: Union[None, str] = None) -> ScpiTracer:
+        # Record every write, query and read from here on, name tells instruments of one model apart
+        if self._tracer is None:
+            self._tracer = ScpiTracer() if tracer is None else tracer
+        if name is not None:
+            self._trace_name = name
+        return self._tracer
+
+    def disable_trace(self) -> Union[None, ScpiTracer]:
+        tracer, self._tracer = self._tracer, None
+        return tracer
 
     def clear(self) -> None:
-        self._resource.write("*CLS")
+        self.write("*CLS")
 
     def close(self) -> None:
         self._resource.close()
 
+    @staticmethod
+    def format_channels(ch: Union[int, str, List[int]]) -> str:
+        if isinstance(ch, (list, tuple)):
+            return ",".join(str(c) for c in ch)
+        return str(ch)
+
+    @staticmethod
+    def expand_channels(ch: Union[int, str, List[int]]) -> List[int]:
+        if isinstance(ch, int):
+            return [ch]
+        if isinstance(ch, (list, tuple)):
+            return [int(c) for c in ch]
+
+        channels = []
+        for item in str(ch).split(','):
+            if ':' in item:
+                first, last = item.split(':')
+                channels.extend(range(int(first), int(last) + 1))
+            else:
+                channels.append(int(item))
+        return channels
+
     def get_id(self) -> str:
-        response = self._resource.query("*IDN?")
+        response = self.query("*IDN?")
         return response
 
     def query(self, command: str) -> str:
+        if self._tracer is not None:
+            return self._tracer.call(self._trace_name, 'query', command, self._resource.query, command)
         response = self._resource.query(command)
         return response
 
     def read(self) -> str:
+        if self._tracer is not None:
+            return self._tracer.call(self._trace_name, 'read', None, self._resource.read)
         response = self._resource.read()
         return response
 
     def reset(self) -> None:
-        self._resource.write("*RST")
+        self.write("*RST")
 
     def write(self, command: str) -> None:
+        if self._tracer is not None:
+            self._tracer.call(self._trace_name, 'write', command, self._resource.write, command)
+            return
         self._resource.write(command)
+
+    def wait_complete(self) -> None:
+        if int(self.query("*OPC?")) != 1:
+            raise Exception('instrument_base.py: *OPC? did not report completion.')
+
+    def write_batch(self, commands: List[str], wait: bool = True) -> None:
+        """
+        Send commands as one semicolon separated transfer. With wait the batch ends with *OPC? and returns
+        once the instrument has executed every command.
+        """
+        if len(commands) == 0:
+            return
+
+        # Root every subsystem command so its path does not depend on the command before it
+        message = ";".join(command if command.startswith(('*', ':')) else f":{command}" for command in commands)
+
+        if wait:
+            if int(self.query(f"{message};*OPC?")) != 1:
+                raise Exception('instrument_base.py: *OPC? did not report completion.')
+        else:
+            self.write(message)
@@ -0,0 +1,226 @@
+import csv
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Union, List
+
+import numpy
+
+COLUMNAR_MAGIC = b'HTOLCOL1'
+BLOCK_HEADER = struct.Struct('<II')  # rows, payload bytes
+
+
+class CsvSink:
+    extension = '.csv'
+
+    def __init__(self, file, columns: List[str]):
+        self.file = file
+        self.columns = columns
+        self._writer = csv.writer(file)
+
+    def write_header(self) -> None:
+        self._writer.writerow(['Timestamp'] + self.columns)
+
+    def write_rows(self, timestamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        # Formatted here on the writer thread, never in the acquisition loop
+        stamps = numpy.datetime_as_string(timestamps, unit='us')
+        for stamp, row in zip(stamps, values.tolist()):
+            self._writer.writerow([stamp.replace('T', ' ')] + row)
+
+
+class ColumnarSink:
+    """
+    Compact binary log. After a JSON schema the file is a sequence of blocks, each holding the timestamp
+    column (datetime64[ns]) and then every value column (float64) of its rows contiguously. A block is only
+    counted when it was written completely, so a crash loses at most the block being written.
+    """
+    extension = '.htol'
+
+    def __init__(self, file, columns: List[str]):
+        self.file = file
+        self.columns = columns
+
+    def write_header(self) -> None:
+        schema = json.dumps({'timestamp': 'datetime64[ns]', 'columns': self.columns, 'dtype': 'float64'}).encode()
+        self.file.write(COLUMNAR_MAGIC + struct.pack('<I', len(schema)) + schema)
+
+    def write_rows(self, timestamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        payload = (timestamps.astype('datetime64[ns]').view(numpy.int64).tobytes() +
+                   numpy.ascontiguousarray(values.T, dtype=numpy.float64).tobytes())
+        self.file.write(BLOCK_HEADER.pack(len(timestamps), len(payload)) + payload)
+
+
+def read_columnar(filename: str) -> tuple:
+    """
+    Read a columnar log into the timestamps and a rows x columns value array, and return the column names.
+    A truncated last block is ignored.
+    """
+    with open(filename, mode='rb') as file:
+        data = file.read()
+    if data[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise Exception(f'measurement_logger.py: {filename} is not a columnar measurement log.')
+
+    offset = len(COLUMNAR_MAGIC)
+    (schema_length,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    columns = json.loads(data[offset:offset + schema_length])['columns']
+    offset += schema_length
+
+    timestamps, values = [], []
+    while offset + BLOCK_HEADER.size <= len(data):
+        rows, payload_length = BLOCK_HEADER.unpack_from(data, offset)
+        offset += BLOCK_HEADER.size
+        if offset + payload_length > len(data):
+            break
+        block = numpy.frombuffer(data, dtype=numpy.int64, count=rows, offset=offset)
+        timestamps.append(block.view('datetime64[ns]'))
+        values.append(numpy.frombuffer(data, dtype=numpy.float64, count=rows * len(columns),
+                                       offset=offset + rows * 8).reshape(len(columns), rows).T)
+        offset += payload_length
+
+    if len(timestamps) == 0:
+        return numpy.zeros(0, dtype='datetime64[ns]'), numpy.zeros((0, len(columns))), columns
+    return numpy.concatenate(timestamps), numpy.concatenate(values), columns
+
+
+class MeasurementLogger:
+    """
+    Append-only measurement log written by a background thread.
+
+    log() only puts the rows on a bounded queue, so the acquisition loop never waits for the disk and
+    memory stays constant however long the run. The writer appends whatever is queued, flushes every
+    flush_interval and fsyncs every fsync_interval, so a crash loses at most the last fsync_interval of
+    data. Files are rotated when they reach max_file_bytes or max_file_age, every file starts with its own
+    header and is named <base>_<start time>_<index><extension>.
+
+    Rows that do not fit in the queue are dropped and counted rather than blocking the caller.
+    """
+    SINKS = {'csv': CsvSink, 'columnar': ColumnarSink}
+
+    def __init__(self, base_name: str, columns: List[str], file_format: str = 'csv',
+                 flush_interval: float = 1.0, fsync_interval: float = 10.0,
+                 max_file_bytes: int = 64 * 1024 * 1024, max_file_age: float = 24 * 3600,
+                 queue_length: int = 100000):
+        if file_format not in self.SINKS:
+            raise Exception(f'measurement_logger.py: Unknown format {file_format}, use one of {list(self.SINKS)}.')
+        self.base_name = base_name
+        self.columns = columns
+        self.file_format = file_format
+        self.flush_interval = flush_interval  # s
+        self.fsync_interval = fsync_interval  # s
+        self.max_file_bytes = max_file_bytes
+        self.max_file_age = max_file_age  # s
+        self.files = []  # Every file written, oldest first
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.fsyncs = 0
+        self._queue = queue.Queue(maxsize=queue_length)
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._sink = None
+        self._file_start = None
+        self._file_index = 0
+
+    def log(self, timestamp: Union[datetime, numpy.datetime64], values: List[float]) -> None:
+        self.log_rows(numpy.array([timestamp], dtype='datetime64[ns]'), numpy.array([values], dtype=numpy.float64))
+
+    def log_rows(self, timestamps: numpy.ndarray, values: numpy.ndarray) -> None:
+        """
+        Queue several rows at once, timestamps as datetime64 and values as rows x columns.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, len(self.columns))
+        try:
+            self._queue.put_nowait((numpy.asarray(timestamps, dtype='datetime64[ns]'), values))
+        except queue.Full:
+            self.rows_dropped += values.shape[0]
+
+    def _open(self) -> None:
+        self._file_index += 1
+        filename = (f"{self.base_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._file_index:04d}"
+                    f"{self.SINKS[self.file_format].extension}")
+        self._file = open(filename, mode='w' if self.file_format == 'csv' else 'wb',
+                          **({'newline': ''} if self.file_format == 'csv' else {}))
+        self._sink = self.SINKS[self.file_format](self._file, self.columns)
+        self._sink.write_header()
+        self._file_start = time.monotonic()
+        self.files.append(filename)
+
+    def _close(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+        self._file.close()
+        self._file = None
+
+    def _rotate_due(self) -> bool:
+        return (self._file.tell() >= self.max_file_bytes or
+                time.monotonic() - self._file_start >= self.max_file_age)
+
+    def _drain(self) -> None:
+        batches = []
+        while True:
+            try:
+                batches.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(batches) == 0:
+            return
+
+        if self._file is None:
+            self._open()
+        elif self._rotate_due():
+            self._close()
+            self._open()
+        # Rotation happens between writes, one drain can overrun max_file_bytes by its own size
+
+        timestamps = numpy.concatenate([batch[0] for batch in batches])
+        values = numpy.concatenate([batch[1] for batch in batches])
+        self._sink.write_rows(timestamps, values)
+        self.rows_written += len(timestamps)
+
+    def _run(self) -> None:
+        last_flush = last_fsync = time.monotonic()
+        while True:
+            stopping = self._stop.wait(min(self.flush_interval, self.fsync_interval))
+            try:
+                self._drain()
+                now = time.monotonic()
+                if self._file is not None and now - last_flush >= self.flush_interval:
+                    self._file.flush()
+                    last_flush = now
+                if self._file is not None and now - last_fsync >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                    last_fsync = now
+            except Exception as error:
+                print(f'measurement_logger.py: Write failed: {error}')
+            if stopping:
+                break
+        self._close()
+
+    def start(self) -> 'MeasurementLogger':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='measurement-logger', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        # Writes everything still queued, then fsyncs and closes the current file
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'MeasurementLogger':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -1,24 +1,25 @@
 from typing import Union, List
-from instrument_lib.instrument_base import InstrumentBase
+from instrument_lib.power_supply.power_supply_base import PowerSupplyBase
 
 
-class KeysightE36234a(InstrumentBase):
+class KeysightE36234a(PowerSupplyBase):
     # Two channels each at 60V, 10A, 200W
+    CHANNELS = [1, 2]
 
     def enable_output(self, ch: Union[int, str], enable: bool) -> None:
-        self.write(f"OUTP {int(enable)},(@{ch})")
+        self._set_output_state(self.expand_channels(ch), enable)
         return
 
     def set_output_current(self, ch: Union[int, str], current: float) -> None:
-        self.write(f"CURR {current:.3f},(@{ch})")
+        self._set_current(self.expand_channels(ch), current)
         return
 
     def set_output_voltage(self, ch: Union[int, str], voltage: float) -> None:
-        self.write(f"VOLT {voltage:.3f},(@{ch})")
+        self._set_voltage(self.expand_channels(ch), voltage)
         return
 
     def measure_current(self, ch: Union[int, str]) -> float:
-        return float(self.query(f"MEAS:CURR?,(@{ch})"))
+        return float(self.query(f"MEAS:CURR? (@{ch})"))
 
     def measure_voltage(self, ch: Union[int, str]) -> float:
-        return float(self.query(f"MEAS:VOLT?,(@{ch})"))
+        return float(self.query(f"MEAS:VOLT? (@{ch})"))
@@ -1,23 +1,25 @@
 from typing import Union, List
-from instrument_lib.instrument_base import InstrumentBase
+from instrument_lib.power_supply.power_supply_base import PowerSupplyBase
 
 
-class KeysightE36312a(InstrumentBase):
+class KeysightE36312a(PowerSupplyBase):
     # Channel 1: 6V, 5A, 30W Channel 2: 25V, 1A, 25W, Channel 3: 25V, 1A, 25W
+    CHANNELS = [1, 2, 3]
+
     def enable_output(self, ch: Union[int, str], enable: bool) -> None:
-        self.write(f"OUTP {int(enable)},(@{ch})")
+        self._set_output_state(self.expand_channels(ch), enable)
         return
 
     def set_output_current(self, ch: Union[int, str], current: float) -> None:
-        self.write(f"CURR {current:.3f},(@{ch})")
+        self._set_current(self.expand_channels(ch), current)
         return
 
     def set_output_voltage(self, ch: Union[int, str], voltage: float) -> None:
-        self.write(f"VOLT {voltage:.3f},(@{ch})")
+        self._set_voltage(self.expand_channels(ch), voltage)
         return
 
     def measure_current(self, ch: Union[int, str]) -> float:
-        return float(self.query(f"MEAS:CURR?,(@{ch})"))
+        return float(self.query(f"MEAS:CURR? (@{ch})"))
 
     def measure_voltage(self, ch: Union[int, str]) -> float:
-        return float(self.query(f"MEAS:VOLT?,(@{ch})"))
+        return float(self.query(f"MEAS:VOLT? (@{ch})"))
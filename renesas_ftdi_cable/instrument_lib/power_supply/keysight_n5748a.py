@@ -1,18 +1,25 @@
-from instrument_lib.instrument_base import InstrumentBase
+from typing import List
+from instrument_lib.power_supply.power_supply_base import PowerSupplyBase
 
 
-class KeysightN5748a(InstrumentBase):
+class KeysightN5748a(PowerSupplyBase):
     # 80V, 9.5A
+    # Single output, SCPI commands take no channel list
+    CHANNELS = [1]
+
+    def _channel_list(self, channels: List[int]) -> str:
+        return ""
+
     def enable_output(self, enable: bool) -> None:
-        self.write(f"OUTP {int(enable)})")
+        self._set_output_state(self.CHANNELS, enable)
         return
 
     def set_output_current(self, current: float) -> None:
-        self.write(f"CURR {current:.3f}")
+        self._set_current(self.CHANNELS, current)
         return
 
     def set_output_voltage(self, voltage: float) -> None:
-        self.write(f"VOLT {voltage:.3f}")
+        self._set_voltage(self.CHANNELS, voltage)
         return
 
     def measure_current(self) -> float:
@@ -0,0 +1,168 @@
+import numpy
+from typing import Union, List
+from instrument_lib.instrument_base import InstrumentBase, wait_until
+
+
+class PowerSupplyBase(InstrumentBase):
+    # Keeps a host-side shadow of the voltage, current and output state of every channel.
+    # The shadow is seeded from the instrument on connect, and setters skip the SCPI write
+    # when the requested value already matches it within the programming resolution.
+    CHANNELS = [1]
+    VOLTAGE_RESOLUTION = 0.001  # V
+    CURRENT_RESOLUTION = 0.001  # A
+
+    def __init__(self, resource_name: str, timeout: int = 5000):
+        super().__init__(resource_name, timeout)
+        self._state = {}
+        self._pending = []  # (channel, field, value) of commands built but not sent yet
+        self.sync()
+
+    def _channel_list(self, channels: List[int]) -> str:
+        return f"(@{self.format_channels(channels)})"
+
+    def _command(self, header: str, value: str, channels: List[int]) -> str:
+        channel_list = self._channel_list(channels)
+        if channel_list == "":
+            return f"{header} {value}"
+        return f"{header} {value},{channel_list}"
+
+    def _query_values(self, header: str, channels: List[int]) -> List[float]:
+        response = self.query(f"{header} {self._channel_list(channels)}".strip())
+        return [float(value) for value in response.split(',')]
+
+    def sync(self) -> None:
+        """
+        Re-read the setpoints and output state of every channel from the instrument.
+        """
+        voltages = self._query_values("VOLT?", self.CHANNELS)
+        currents = self._query_values("CURR?", self.CHANNELS)
+        outputs = self._query_values("OUTP?", self.CHANNELS)
+
+        self._state = {}
+        for index, channel in enumerate(self.CHANNELS):
+            self._state[channel] = {'voltage': voltages[index],
+                                    'current': currents[index],
+                                    'output': bool(int(outputs[index]))}
+
+    def get_state(self, ch: Union[int, str]) -> dict:
+        return dict(self._state[self.expand_channels(ch)[0]])
+
+    def reset(self) -> None:
+        super().reset()
+        self.sync()
+
+    def _changed_channels(self, channels: List[int], field: str, value, resolution: Union[None, float]) -> List[int]:
+        # A field of None is unknown, after a write that failed
+        if resolution is None:
+            return [channel for channel in channels if self._state[channel][field] != value]
+        return [channel for channel in channels
+                if self._state[channel][field] is None or abs(self._state[channel][field] - value) >= resolution / 2]
+
+    def _setting_commands(self, channels: List[int], field: str, value, resolution: Union[None, float],
+                          header: str, text: str) -> List[str]:
+        # The shadow takes the value in _send, once the command went out
+        changed = self._changed_channels(channels, field, value, resolution)
+        if len(changed) == 0:
+            return []
+        self._pending.extend((channel, field, value) for channel in changed)
+        return [self._command(header, text, changed)]
+
+    def _output_state_commands(self, channels: List[int], enable: bool) -> List[str]:
+        return self._setting_commands(channels, 'output', enable, None, "OUTP", str(int(enable)))
+
+    def _current_commands(self, channels: List[int], current: float) -> List[str]:
+        return self._setting_commands(channels, 'current', current, self.CURRENT_RESOLUTION, "CURR", f"{current:.3f}")
+
+    def _voltage_commands(self, channels: List[int], voltage: float) -> List[str]:
+        return self._setting_commands(channels, 'voltage', voltage, self.VOLTAGE_RESOLUTION, "VOLT", f"{voltage:.3f}")
+
+    def _send(self, commands: List[str], batch: bool = False) -> None:
+        """
+        Send the commands built since the last send and only then take their settings into the shadow. If
+        sending fails the settings are marked unknown, so the next call sends them again.
+        """
+        pending, self._pending = self._pending, []
+        try:
+            if batch:
+                self.write_batch(commands)
+            else:
+                for command in commands:
+                    self.write(command)
+        except Exception:
+            for channel, field, _ in pending:
+                self._state[channel][field] = None
+            raise
+        for channel, field, value in pending:
+            self._state[channel][field] = value
+
+    def _set_output_state(self, channels: List[int], enable: bool) -> None:
+        self._send(self._output_state_commands(channels, enable))
+
+    def _set_current(self, channels: List[int], current: float) -> None:
+        self._send(self._current_commands(channels, current))
+
+    def _set_voltage(self, channels: List[int], voltage: float) -> None:
+        self._send(self._voltage_commands(channels, voltage))
+
+    def configure_outputs(self, ch: Union[None, int, str, List[int]] = None,
+                          voltage: Union[None, float, List[float]] = None,
+                          current: Union[None, float, List[float]] = None,
+                          enable: Union[None, bool] = None) -> None:
+        """
+        Program current limit, voltage and output state of the channels in one transfer confirmed with *OPC?.
+        voltage and current take one value for all channels or a list with one value per channel. Settings that
+        already match the shadow state are left out of the batch.
+        """
+        channels = self.CHANNELS if ch is None else self.expand_channels(ch)
+
+        commands = []
+        if current is not None:
+            currents = current if isinstance(current, (list, tuple)) else [current] * len(channels)
+            for channel, value in zip(channels, currents):
+                commands.extend(self._current_commands([channel], value))
+        if voltage is not None:
+            voltages = voltage if isinstance(voltage, (list, tuple)) else [voltage] * len(channels)
+            for channel, value in zip(channels, voltages):
+                commands.extend(self._voltage_commands([channel], value))
+        if enable is not None:
+            commands.extend(self._output_state_commands(channels, enable))
+
+        self._send(commands, batch=True)
+
+    def wait_for_voltage(self, ch: Union[None, int, str, List[int]], voltage: Union[float, List[float]],
+                         tolerance: float = 0.05, timeout: float = 10, poll_interval: float = 0.05) -> float:
+        """
+        Wait until every channel in ch measures within tolerance of voltage and return the time it took.
+        """
+        channels = self.CHANNELS if ch is None else self.expand_channels(ch)
+        targets = numpy.array(voltage if isinstance(voltage, (list, tuple)) else [voltage] * len(channels))
+        return wait_until(lambda: bool(numpy.all(numpy.abs(self.measure_voltages(channels) - targets) <= tolerance)),
+                          timeout, poll_interval)
+
+    def measure_voltages(self, ch: Union[None, int, str, List[int]] = None) -> numpy.ndarray:
+        """
+        Measure the voltage of every channel in ch (all channels by default) with one MEAS query.
+        """
+        channels = self.CHANNELS if ch is None else self.expand_channels(ch)
+        return numpy.array(self._query_values("MEAS:VOLT?", channels))
+
+    def measure_currents(self, ch: Union[None, int, str, List[int]] = None) -> numpy.ndarray:
+        """
+        Measure the current of every channel in ch (all channels by default) with one MEAS query.
+        """
+        channels = self.CHANNELS if ch is None else self.expand_channels(ch)
+        return numpy.array(self._query_values("MEAS:CURR?", channels))
+
+    def measure_outputs(self, ch: Union[None, int, str, List[int]] = None) -> numpy.ndarray:
+        """
+        Measure voltage and current of every channel in ch in a single round trip.
+
+        Returns a 2 x channels array, row 0 voltages and row 1 currents.
+        """
+        channels = self.CHANNELS if ch is None else self.expand_channels(ch)
+        channel_list = self._channel_list(channels)
+        response = self.query(";:".join(f"{header} {channel_list}".strip() for header in ["MEAS:VOLT?", "MEAS:CURR?"]))
+
+        # The two query responses come back separated by a semicolon
+        values = numpy.fromstring(response.replace(';', ','), dtype=numpy.float64, sep=',')
+        return values.reshape(2, len(channels))
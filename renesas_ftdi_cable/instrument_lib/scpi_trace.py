@@ -0,0 +1,155 @@
+import json
+import re
+import threading
+import time
+from collections import deque
+from typing import Union, List, Callable
+
+from pyvisa import VisaIOError
+from pyvisa.constants import StatusCode
+
+from instrument_lib.dac.ftdi_trace import HdrHistogram
+
+_CHANNEL_LIST = re.compile(r'\(@[^)]*\)')
+_STRING = re.compile(r'"[^"]*"|\'[^\']*\'')
+_NUMBER = re.compile(r'(?<![A-Za-z0-9])[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?(?![A-Za-z0-9])')
+
+
+def command_pattern(command: str) -> str:
+    """
+    Command with the values taken out, so calls differing only in channels or settings add up together.
+    Keywords such as AUTO, DEF or MIN stay, MEAS:VOLT:DC? AUTO,(@111) and MEAS:VOLT:DC? 10,(@111) are
+    counted apart so the cost of autoranging shows.
+    """
+    parts = []
+    for part in command.strip().split(';'):
+        part = _CHANNEL_LIST.sub('(@)', part.strip())
+        part = _STRING.sub('""', part)
+        header, _, arguments = part.partition(' ')
+        arguments = _NUMBER.sub('#', arguments.replace(' ', ''))
+        parts.append(f'{header.lstrip(":").upper()} {arguments.upper()}'.strip())
+    return ';'.join(parts)
+
+
+def _is_timeout(error: Exception) -> bool:
+    return isinstance(error, VisaIOError) and error.error_code == StatusCode.error_timeout
+
+
+class ScpiPatternStats:
+
+    def __init__(self, instrument: str, pattern: str):
+        self.instrument = instrument
+        self.pattern = pattern
+        self.histogram = HdrHistogram()  # ns
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    @property
+    def count(self) -> int:
+        return self.histogram.total
+
+    @property
+    def total_time(self) -> float:
+        return self.histogram.sum / 1E9
+
+
+class ScpiTracer:
+    """
+    Duration, bytes and failures of every write, query and read of the instruments it is enabled on, see
+    InstrumentBase.enable_trace. Calls are added up per instrument and command pattern, and the last
+    capacity of them are kept as events for dump(). Instruments run on several threads, e.g. the DAQ scan
+    and the interlock watchdog, so recording takes a lock.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        self.events = deque(maxlen=capacity)
+        self.stats = {}  # (instrument, pattern) -> ScpiPatternStats
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def call(self, instrument: str, operation: str, command: Union[None, str], function: Callable, *args):
+        """
+        Run function, the VISA call, and record it. Exceptions are recorded and raised again.
+        """
+        start_time = time.time()
+        start = time.perf_counter_ns()
+        response = None
+        error = None
+        try:
+            response = function(*args)
+            return response
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            duration = time.perf_counter_ns() - start
+            self.record(instrument, operation, command, start_time, duration,
+                        len(command) if command is not None else 0,
+                        len(response) if isinstance(response, (str, bytes)) else 0, error)
+
+    def record(self, instrument: str, operation: str, command: Union[None, str], start_time: float,
+               duration: int, bytes_out: int, bytes_in: int, error: Union[None, Exception] = None) -> None:
+        # A read has no command of its own, it is counted as READ under the instrument
+        pattern = 'READ' if command is None else command_pattern(command)
+        timed_out = error is not None and _is_timeout(error)
+        with self._lock:
+            stats = self.stats.get((instrument, pattern))
+            if stats is None:
+                stats = self.stats[(instrument, pattern)] = ScpiPatternStats(instrument, pattern)
+            stats.histogram.record(duration)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            if timed_out:
+                stats.timeouts += 1
+            elif error is not None:
+                stats.errors += 1
+            self.events.append({'time': start_time, 'instrument': instrument, 'operation': operation,
+                                'command': command, 'duration_ns': duration, 'bytes_out': bytes_out,
+                                'bytes_in': bytes_in, 'timeout': timed_out,
+                                'error': None if error is None or timed_out else str(error)})
+
+    def top(self, count: Union[None, int] = None) -> List[ScpiPatternStats]:
+        # Patterns by total time, the largest first
+        with self._lock:
+            stats = sorted(self.stats.values(), key=lambda item: item.histogram.sum, reverse=True)
+        return stats if count is None else stats[:count]
+
+    def summary(self, count: int = 20) -> str:
+        stats = self.top()
+        total = sum(item.total_time for item in stats)
+        lines = [f'{total:.2f} s in {sum(item.count for item in stats)} SCPI calls over '
+                 f'{time.time() - self.started:.0f} s',
+                 f"{'instrument':<18}{'pattern':<44}{'count':>8}{'total s':>10}{'%':>7}{'mean ms':>10}"
+                 f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'timeouts':>10}"]
+        for item in stats[:count]:
+            histogram = item.histogram
+            lines.append(f'{item.instrument:<18.18}{item.pattern:<44.44}{item.count:>8}{item.total_time:>10.3f}'
+                         f'{100 * item.total_time / total if total > 0 else 0:>7.1f}{histogram.mean / 1E6:>10.2f}'
+                         f'{histogram.percentile(50) / 1E6:>9.2f}{histogram.percentile(99) / 1E6:>9.2f}'
+                         f'{histogram.max / 1E6:>9.2f}{item.timeouts:>10}')
+        if len(stats) > count:
+            rest = stats[count:]
+            lines.append(f"{'':<18}{f'{len(rest)} more patterns':<44}{sum(item.count for item in rest):>8}"
+                         f'{sum(item.total_time for item in rest):>10.3f}')
+        return '\n'.join(lines)
+
+    def dump(self, filename: str) -> None:
+        """
+        Write the kept events as JSON lines, followed by one line per pattern with its statistics.
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(filename, mode='w') as file:
+            for event in events:
+                file.write(json.dumps(dict(kind='call', **event)) + '\n')
+            for item in self.top():
+                histogram = item.histogram
+                file.write(json.dumps({'kind': 'pattern', 'instrument': item.instrument, 'pattern': item.pattern,
+                                       'count': item.count, 'total_ns': histogram.sum,
+                                       'min_ns': histogram.min, 'p50_ns': histogram.percentile(50),
+                                       'p90_ns': histogram.percentile(90), 'p99_ns': histogram.percentile(99),
+                                       'max_ns': histogram.max, 'bytes_out': item.bytes_out,
+                                       'bytes_in': item.bytes_in, 'timeouts': item.timeouts,
+                                       'errors': item.errors}) + '\n')
@@ -0,0 +1,113 @@
+import math
+import random
+import threading
+import time
+from typing import Union, List, Callable
+
+
+class AmplifierStage:
+    # Square-law GaN HEMT with a smooth turn-on: Id = beta * (vt * softplus((Vg - Vth) / vt))^2
+
+    def __init__(self, name: str, dac_address: int, daq_channels: List[int], rail: tuple,
+                 vth: float = -2.8, beta: float = 2.0, vt: float = 0.05,
+                 vth_temp_coefficient: float = -0.002, vth_drift_per_hour: float = 0.0,
+                 settling_tau: float = 0.02):
+        self.name = name
+        self.dac_address = dac_address  # Low byte address of the gate DAC data register
+        self.daq_channels = daq_channels  # DAQ channels measuring the drain shunt
+        self.rail = rail  # (supply name, channel) feeding the drain
+        self.vth = vth  # V at 25C
+        self.beta = beta  # A/V^2
+        self.vt = vt  # V
+        self.vth_temp_coefficient = vth_temp_coefficient  # V/C
+        self.vth_drift_per_hour = vth_drift_per_hour  # V/h of simulated time, models ageing
+        self.settling_tau = settling_tau  # s, first order response of the drain current to a gate step
+
+        self.code = 0
+        self._previous_current = 0.0
+        self._change_time = 0.0
+
+
+def default_stages() -> List[AmplifierStage]:
+    return [
+        AmplifierStage('driver', 0x50, [111, 104], ('n5748a', 1), vth=-2.80),  # VGG2 on DACA0
+        AmplifierStage('carrier', 0x52, [112], ('n5748a', 1), vth=-2.75),  # VGG3_C on DACA1
+        AmplifierStage('peaking', 0x54, [113], ('n5748a', 1), vth=-2.85),  # VGG3_P on DACA2
+    ]
+
+
+class DutModel:
+    """
+    Electrical model of the RF amplifier module shared by the simulated DAC, DAQ and supplies.
+
+    Gate DAC codes set the drain current of each stage, the drain current is seen by the DAQ as the voltage
+    across a 1 ohm shunt and by the supplies as rail current. A stage only conducts when its drain rail is up.
+    """
+    DAC_FULL_SCALE = 4095
+    GATE_MIN_V = -10.0  # DAC range -10V to 0V
+    GATE_SPAN_V = 10.0
+    SHUNT_OHMS = 1.0
+    RAIL_ON_V = 1.0
+
+    def __init__(self, stages: Union[None, List[AmplifierStage]] = None, noise_std: float = 20E-6,
+                 temperature_c: float = 25.0, time_scale: float = 1.0, seed: Union[None, int] = None):
+        self.stages = default_stages() if stages is None else stages
+        self.noise_std = noise_std  # V rms at 1 NPLC
+        self.temperature_c = temperature_c
+        self.time_scale = time_scale  # Simulated seconds per wall clock second, used for drift
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._rails = {}
+        self._start = time.perf_counter()
+
+    def register_rail(self, supply: str, ch: int, voltage: Callable[[], float]) -> None:
+        self._rails[(supply, ch)] = voltage
+
+    def rail_voltage(self, rail: tuple) -> Union[None, float]:
+        if rail not in self._rails:
+            return None
+        return self._rails[rail]()
+
+    def gate_voltage(self, code: int) -> float:
+        return self.GATE_MIN_V + code * self.GATE_SPAN_V / self.DAC_FULL_SCALE
+
+    def _steady_current(self, stage: AmplifierStage) -> float:
+        rail = self.rail_voltage(stage.rail)
+        # Without a registered supply the drain is assumed powered so the DAQ can be simulated alone
+        if rail is not None and rail < self.RAIL_ON_V:
+            return 0.0
+
+        hours = (time.perf_counter() - self._start) * self.time_scale / 3600
+        vth = (stage.vth + stage.vth_temp_coefficient * (self.temperature_c - 25.0) +
+               stage.vth_drift_per_hour * hours)
+        x = (self.gate_voltage(stage.code) - vth) / stage.vt
+        softplus = x if x > 30 else math.log1p(math.exp(x))
+        return stage.beta * (stage.vt * softplus) ** 2
+
+    def drain_current(self, stage: AmplifierStage) -> float:
+        with self.lock:
+            target = self._steady_current(stage)
+            age = time.perf_counter() - stage._change_time
+            if stage.settling_tau <= 0:
+                return target
+            return target + (stage._previous_current - target) * math.exp(-age / stage.settling_tau)
+
+    def set_dac_code(self, address: int, code: int) -> None:
+        with self.lock:
+            for stage in self.stages:
+                if stage.dac_address == address and stage.code != code:
+                    stage._previous_current = self.drain_current(stage)
+                    stage._change_time = time.perf_counter()
+                    stage.code = code
+
+    def daq_voltage(self, ch: int, nplc: float = 1.0) -> float:
+        noise = self._random.gauss(0.0, self.noise_std / math.sqrt(max(nplc, 0.001)))
+        with self.lock:
+            for stage in self.stages:
+                if ch in stage.daq_channels:
+                    return self.drain_current(stage) * self.SHUNT_OHMS + noise
+        return noise
+
+    def rail_current(self, supply: str, ch: int) -> float:
+        with self.lock:
+            return sum(self.drain_current(stage) for stage in self.stages if stage.rail == (supply, ch))
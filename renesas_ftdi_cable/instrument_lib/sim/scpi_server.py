@@ -0,0 +1,151 @@
+import re
+import socketserver
+import threading
+import time
+from typing import Union, List, Callable
+
+from instrument_lib.instrument_base import InstrumentBase
+
+# Upper case long forms that clients may send instead of the short form
+LONG_FORMS = {
+    'ALARM': 'ALAR', 'CHANNEL': 'CHAN', 'CONFIGURE': 'CONF', 'COUNT': 'COUN', 'CURRENT': 'CURR',
+    'DELAY': 'DEL', 'FETCH': 'FETC', 'FORMAT': 'FORM', 'INITIATE': 'INIT', 'MEASURE': 'MEAS',
+    'NPLCYCLES': 'NPLC', 'OUTPUT': 'OUTP', 'POINTS': 'POIN', 'RANGE': 'RANG', 'READING': 'READ',
+    'ROUTE': 'ROUT', 'SENSE': 'SENS', 'SOURCE': 'SOUR', 'SYSTEM': 'SYST', 'TIMER': 'TIM',
+    'TRIGGER': 'TRIG', 'VOLTAGE': 'VOLT', 'ABORT': 'ABOR', 'STATE': 'STAT', 'REMOVE': 'REM',
+}
+
+# Optional root nodes dropped before dispatch
+OPTIONAL_ROOTS = ['SENS', 'SOUR']
+
+
+def normalize_header(header: str) -> str:
+    nodes = []
+    for node in header.strip().lstrip(':').split(':'):
+        query = node.endswith('?')
+        name = node.rstrip('?')
+        if any(c.islower() for c in name):
+            # Mixed case is the SCPI long form with the short form in upper case, e.g. SYSTem
+            name = ''.join(c for c in name if not c.islower())
+        else:
+            name = LONG_FORMS.get(name.upper(), name.upper())
+        nodes.append(name + ('?' if query else ''))
+
+    if len(nodes) > 1 and nodes[0] in OPTIONAL_ROOTS:
+        nodes = nodes[1:]
+    return ':'.join(nodes)
+
+
+def split_arguments(arguments: str) -> tuple:
+    """
+    Split SCPI arguments into the plain values and the channel list, None when no (@...) is given.
+    """
+    channels = None
+    match = re.search(r'\(@([^)]*)\)', arguments)
+    if match is not None:
+        channels = InstrumentBase.expand_channels(match.group(1)) if match.group(1).strip() != "" else []
+        arguments = arguments[:match.start()] + arguments[match.end():]
+    values = [value.strip() for value in arguments.split(',') if value.strip() != ""]
+    return values, channels
+
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ScpiServer:
+    """
+    Line based SCPI instrument on a local TCP port, opened by the drivers as TCPIP0::127.0.0.1::<port>::SOCKET.
+
+    Subclasses register handlers by normalised header in self.commands. A handler receives the argument
+    values and the channel list and returns the response text for queries. Commands execute one at a time
+    like on a real instrument, and every command can be given an extra latency.
+    """
+
+    def __init__(self, idn: str, host: str = '127.0.0.1', port: int = 0,
+                 command_latency: Union[None, dict] = None, default_latency: float = 0.0):
+        self.idn = idn
+        self.host = host
+        self.port = port
+        self.command_latency = {} if command_latency is None else command_latency  # header prefix -> seconds
+        self.default_latency = default_latency
+        self.command_count = 0
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+
+        self.commands = {
+            '*IDN?': lambda values, channels: self.idn,
+            '*OPC?': lambda values, channels: '1',
+            '*CLS': lambda values, channels: None,
+            '*RST': lambda values, channels: self.reset(),
+        }
+
+    @property
+    def resource_name(self) -> str:
+        return f"TCPIP0::{self.host}::{self.port}::SOCKET"
+
+    def reset(self) -> None:
+        return
+
+    def latency(self, header: str) -> float:
+        matches = [prefix for prefix in self.command_latency if header.startswith(prefix)]
+        if len(matches) == 0:
+            return self.default_latency
+        return self.command_latency[max(matches, key=len)]
+
+    def execute(self, message: str) -> Union[None, str]:
+        """
+        Execute a semicolon separated program message and return the joined query responses.
+        """
+        responses = []
+        with self._lock:
+            for unit in message.strip().split(';'):
+                if unit.strip() == "":
+                    continue
+                parts = unit.strip().split(None, 1)
+                header = normalize_header(parts[0])
+                values, channels = split_arguments(parts[1] if len(parts) > 1 else "")
+
+                if header not in self.commands:
+                    raise Exception(f'scpi_server.py: Undefined header {parts[0]}')
+
+                delay = self.latency(header)
+                if delay > 0:
+                    time.sleep(delay)
+                self.command_count += 1
+
+                response = self.commands[header](values, channels)
+                if header.endswith('?') and response is not None:
+                    responses.append(response)
+
+        if len(responses) == 0:
+            return None
+        return ';'.join(responses)
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = server.execute(line.decode('ascii'))
+                    except Exception as error:
+                        print(error)
+                        continue
+                    if response is not None:
+                        self.wfile.write((response + '\n').encode('ascii'))
+
+        self._server = _TcpServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.resource_name
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
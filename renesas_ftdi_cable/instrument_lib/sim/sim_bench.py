@@ -0,0 +1,83 @@
+import os
+import time
+
+# The simulators are raw TCP sockets, the pure Python VISA backend is enough to open them
+os.environ.setdefault('PYVISA_LIBRARY', '@py')
+
+from instrument_lib.daq.keysight_daq970a import KeysightDaq970a
+from instrument_lib.power_supply.keysight_n5748a import KeysightN5748a
+from instrument_lib.power_supply.keysight_e36312a import KeysightE36312a
+from instrument_lib.power_supply.keysight_e36234a import KeysightE36234a
+from instrument_lib.sim.dut_model import DutModel
+from instrument_lib.sim.sim_daq970a import SimulatedDaq970a
+from instrument_lib.sim.sim_power_supply import simulated_e36234a, simulated_e36312a, simulated_n5748a
+
+
+class SimulatedBench:
+    """
+    Starts the simulated DAQ and supplies around one DutModel and opens the real drivers on them.
+    """
+
+    def __init__(self, model: DutModel = None, time_scale: float = 1.0, command_latency: dict = None,
+                 default_latency: float = 0.0):
+        self.model = DutModel(time_scale=time_scale) if model is None else model
+        latency = {'command_latency': command_latency, 'default_latency': default_latency}
+        self.servers = {
+            'daq970a': SimulatedDaq970a(self.model, time_scale=time_scale, **latency),
+            'n5748a': simulated_n5748a(self.model, **latency),
+            'e36312a': simulated_e36312a(self.model, **latency),
+            'e36234a': simulated_e36234a(self.model, **latency),
+        }
+        for server in self.servers.values():
+            server.start()
+
+        self.daq970a = KeysightDaq970a(self.servers['daq970a'].resource_name)
+        self.n5748a = KeysightN5748a(self.servers['n5748a'].resource_name)
+        self.e36312a = KeysightE36312a(self.servers['e36312a'].resource_name)
+        self.e36234a = KeysightE36234a(self.servers['e36234a'].resource_name)
+
+    def close(self) -> None:
+        for instrument in [self.daq970a, self.n5748a, self.e36312a, self.e36234a]:
+            instrument.close()
+        for server in self.servers.values():
+            server.stop()
+
+
+def benchmark_bias_loop(bench: SimulatedBench, iterations: int = 50) -> float:
+    # DAC write then DAQ read, the inner loop of the gate bias adjustment
+    stage = bench.model.stages[0]
+    start = time.perf_counter()
+    for i in range(iterations):
+        bench.model.set_dac_code(stage.dac_address, 2880 + i)
+        bench.daq970a.read_voltage(stage.daq_channels[0], 'fast')
+    elapsed = time.perf_counter() - start
+    print(f"Bias loop: {iterations / elapsed:.1f} steps/s")
+    return iterations / elapsed
+
+
+def main():
+    bench = SimulatedBench(time_scale=100.0)
+    try:
+        print(bench.daq970a.get_id().strip())
+
+        bench.n5748a.configure_outputs(voltage=28, current=2, enable=True)
+        bench.n5748a.wait_for_voltage(None, 28)
+        print("Rails:", bench.n5748a.measure_outputs())
+
+        for name in bench.daq970a.profiles:
+            bench.daq970a.benchmark_profile(name, "111,112")
+
+        benchmark_bias_loop(bench)
+
+        # A 10 sweep timer scan, 10 seconds per interval compressed by time_scale
+        bench.daq970a.apply_profile('fast', "111,112")
+        bench.daq970a.configure_reading_format()
+        bench.daq970a.write_batch(["TRIG:COUN 10", "TRIG:SOUR TIMER", "TRIG:TIM 10", "INIT"])
+        sweeps = bench.daq970a.split_sweeps(bench.daq970a.fetch_readings(), "111,112")
+        print("Scan sweep times:", sweeps['time'][:, 0])
+    finally:
+        bench.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Union, List
+
+from instrument_lib.sim.dut_model import DutModel
+from instrument_lib.sim.scpi_server import ScpiServer
+
+
+class ChannelConfig:
+
+    def __init__(self):
+        self.v_range = None  # None is autorange
+        self.nplc = 1.0
+        self.autozero = 'ON'
+        self.delay = None  # None is automatic channel delay
+
+
+class SimulatedDaq970a(ScpiServer):
+    """
+    DAQ970A with DAQM900A cards measuring the shunt voltages of a DutModel.
+
+    Every reading costs the integration time of its channel (doubled with autozero ON), an extra range
+    search when autoranging and the channel delay, so measurement profiles can be compared off the bench.
+    Trigger timer intervals are divided by time_scale so long interval scans can be run quickly.
+    """
+    VOLTAGE_RANGES = [0.1, 1.0, 10.0, 100.0, 300.0]
+    OVERRANGE = 1.2
+    OVERLOAD = 9.9E37
+    LINE_FREQUENCY = 60.0
+    AUTORANGE_TIME = 0.02  # s
+    AUTO_DELAY = 0.002  # s
+    SWITCH_TIME = 0.0005  # s, relay move between channels
+
+    def __init__(self, model: DutModel, time_scale: float = 1.0, **kwargs):
+        super().__init__('Keysight Technologies,DAQ970A,SIM00001,A.03.00-02.00-03.00', **kwargs)
+        self.model = model
+        self.time_scale = time_scale
+        self._scan_thread = None
+        self.reset()
+
+        self.commands.update({
+            'MEAS:VOLT:DC?': self._measure,
+            'CONF:VOLT:DC': self._configure,
+            'VOLT:DC:NPLC': lambda values, channels: self._set(channels, 'nplc', float(values[0])),
+            'VOLT:DC:ZERO:AUTO': lambda values, channels: self._set(channels, 'autozero', values[0].upper()),
+            'VOLT:DC:RANG': lambda values, channels: self._set(channels, 'v_range', self._parse_range(values[0])),
+            'ROUT:CHAN:DEL': lambda values, channels: self._set(channels, 'delay', float(values[0])),
+            'ROUT:CHAN:DEL:AUTO': lambda values, channels: self._set(channels, 'delay', None),
+            'ROUT:SCAN': self._set_scan_list,
+            'ROUT:SCAN?': lambda values, channels: f"#0(@{','.join(str(c) for c in self.scan_list)})",
+            'TRIG:COUN': lambda values, channels: setattr(self, 'trigger_count', int(float(values[0]))),
+            'TRIG:SOUR': lambda values, channels: setattr(self, 'trigger_source', values[0].upper()),
+            'TRIG:TIM': lambda values, channels: setattr(self, 'trigger_timer', float(values[0])),
+            'FORM:READ:CHAN': lambda values, channels: self._set_format('channel', values[0]),
+            'FORM:READ:TIME': lambda values, channels: self._set_format('time', values[0]),
+            'FORM:READ:TIME:TYPE': lambda values, channels: None,
+            'FORM:READ:ALAR': lambda values, channels: self._set_format('alarm', values[0]),
+            'FORM:READ:UNIT': lambda values, channels: None,
+            'INIT': lambda values, channels: self._initiate(),
+            'ABOR': lambda values, channels: self._abort(),
+            'FETC?': lambda values, channels: self._fetch(),
+            'READ?': lambda values, channels: self._read(),
+            'DATA:POIN?': lambda values, channels: str(len(self.readings)),
+            'DATA:LAST?': self._last,
+            'DATA:REM?': self._remove,
+            'SYST:TIME:SCAN?': lambda values, channels: self.scan_start.strftime("%Y,%m,%d,%H,%M,%S.%f")[:-3],
+        })
+
+    def reset(self) -> None:
+        self._abort()
+        self.config = {}
+        self.scan_list = []
+        self.trigger_count = 1
+        self.trigger_source = 'IMM'
+        self.trigger_timer = 1.0
+        self.format = {'time': False, 'channel': False, 'alarm': False}
+        self.readings = []
+        self.recent = deque(maxlen=1000)  # DATA:LAST? still sees readings taken by DATA:REM?
+        self.scan_start = datetime.now()
+
+    def _channel(self, ch: int) -> ChannelConfig:
+        if ch not in self.config:
+            self.config[ch] = ChannelConfig()
+        return self.config[ch]
+
+    def _parse_range(self, value: str) -> Union[None, float]:
+        if value.upper() in ('AUTO', 'DEF', 'MIN', 'MAX'):
+            return None
+        return float(value)
+
+    def _set(self, channels: List[int], field: str, value) -> None:
+        for ch in channels:
+            setattr(self._channel(ch), field, value)
+
+    def _set_format(self, field: str, value: str) -> None:
+        self.format[field] = value.upper() in ('ON', '1')
+
+    def _set_scan_list(self, values: List[str], channels: List[int]) -> None:
+        self.scan_list = list(channels)
+
+    def _configure(self, values: List[str], channels: List[int]) -> None:
+        v_range = self._parse_range(values[0]) if len(values) > 0 else None
+        for ch in channels:
+            config = ChannelConfig()
+            config.v_range = v_range
+            self.config[ch] = config
+        # CONF redefines the scan list
+        self.scan_list = list(channels)
+
+    def _measure(self, values: List[str], channels: List[int]) -> str:
+        self._configure(values, channels)
+        self.trigger_count = 1
+        self.trigger_source = 'IMM'
+        return self._read()
+
+    def _reading(self, ch: int, elapsed: float) -> tuple:
+        config = self._channel(ch)
+        duration = config.nplc / self.LINE_FREQUENCY
+        if config.autozero == 'ON':
+            duration *= 2
+        duration += self.SWITCH_TIME
+        duration += self.AUTO_DELAY if config.delay is None else config.delay
+
+        value = self.model.daq_voltage(ch, config.nplc)
+        if config.v_range is None:
+            duration += self.AUTORANGE_TIME
+        elif abs(value) > config.v_range * self.OVERRANGE:
+            value = self.OVERLOAD
+
+        time.sleep(duration)
+        return value, elapsed, ch, 0
+
+    def _sweep_loop(self) -> None:
+        start = time.perf_counter()
+        for sweep in range(self.trigger_count):
+            if self._stop_scan:
+                break
+            if self.trigger_source == 'TIMER':
+                wake = start + sweep * self.trigger_timer / self.time_scale
+                while time.perf_counter() < wake and not self._stop_scan:
+                    time.sleep(min(0.01, wake - time.perf_counter()))
+            for ch in self.scan_list:
+                elapsed = (time.perf_counter() - start) * self.time_scale
+                reading = self._reading(ch, elapsed)
+                self.readings.append(reading)
+                self.recent.append(reading)
+
+    def _initiate(self) -> None:
+        self._abort()
+        self.readings = []
+        self.recent = deque(maxlen=1000)  # DATA:LAST? still sees readings taken by DATA:REM?
+        self.scan_start = datetime.now()
+        self._stop_scan = False
+        self._scan_thread = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._scan_thread.start()
+
+    def _abort(self) -> None:
+        self._stop_scan = True
+        if self._scan_thread is not None:
+            self._scan_thread.join()
+            self._scan_thread = None
+
+    def _format(self, readings: List[tuple]) -> str:
+        fields = []
+        for value, elapsed, ch, alarm in readings:
+            fields.append(f"{value:+.9E}")
+            if self.format['time']:
+                fields.append(f"{elapsed:013.3f}")
+            if self.format['channel']:
+                fields.append(str(ch))
+            if self.format['alarm']:
+                fields.append(str(alarm))
+        return ','.join(fields)
+
+    def _last(self, values: List[str], channels: Union[None, List[int]]) -> str:
+        count = int(values[0]) if len(values) > 0 else 1
+        readings = [reading for reading in list(self.recent) if channels is None or reading[2] in channels]
+        return self._format(readings[-count:])
+
+    def _remove(self, values: List[str], channels: Union[None, List[int]]) -> str:
+        # Oldest readings first, erased from memory
+        count = min(int(values[0]), len(self.readings))
+        readings = self.readings[:count]
+        del self.readings[:count]
+        return self._format(readings)
+
+    def _fetch(self) -> str:
+        if self._scan_thread is not None:
+            self._scan_thread.join()
+        return self._format(self.readings)
+
+    def _read(self) -> str:
+        self._initiate()
+        return self._fetch()
@@ -0,0 +1,290 @@
+import sys
+import threading
+from typing import Union
+
+from instrument_lib.dac.amc7836 import Amc7836
+from instrument_lib.dac.ftdi_base import FTDI_MPSSE_COMMANDS
+from instrument_lib.dac.ftdi_recorder import read_trace, replay, ReplayReport
+from instrument_lib.sim.dut_model import DutModel
+
+PURGE_RX = 1  # ftd2xx.defines.PURGE_RX
+PURGE_TX = 2
+
+
+def _reverse_bits(value: int) -> int:
+    return int(f'{value:08b}'[::-1], 2)
+
+
+class SimulatedAmc7836:
+    """
+    SPI side of the AMC7836 as a register file. A frame is the R/W bit and a 15 bit address over two bytes
+    followed by data at ascending addresses, or descending when ADDR_ASCEND in ITFC_CFG0 is cleared. DAC data
+    registers written in a frame are passed to the DutModel when chip select goes high.
+
+    Alarms latched with alarm() clear when their status register is read, their cause is taken as gone.
+    While an alarm latched in ALARM_STAT0/1 is routed by DAC_CLR_SRC0/1, the DACs enabled in DAC_CLR_EN0/1
+    are in the clear state, see cleared_dacs.
+    """
+    ITFC_CFG0 = 0x00
+    ADDR_ASCEND = 0x20
+    DAC_CLR_EN0 = 0x18
+    DAC_CLR_SRC0 = 0x1A
+    DAC_DATA_FIRST = 0x50  # DAC0 data low byte, the high byte follows
+    DAC_DATA_LAST = 0x6F
+    ALARM_STAT0 = 0x70
+    ALARM_STAT1 = 0x71
+    DAC_CLR0 = 0xB0
+
+    def __init__(self, model: Union[None, DutModel] = None, reset_values: Union[None, dict] = None,
+                 size: int = 0x100):
+        self.model = model
+        self.registers = bytearray(size)
+        self.registers[self.ITFC_CFG0] = 0x30  # SDO active, address ascending
+        for address, value in ({} if reset_values is None else reset_values).items():
+            self.registers[address] = value
+        self._byte = 0  # Byte number in the current frame
+        self._read = False
+        self._address = 0
+        self._dac_written = set()
+        self.status_reads = 0  # Reads of ALARM_STAT0 or ALARM_STAT1
+
+    def alarm(self, stat0: int = 0, stat1: int = 0) -> None:
+        self.registers[self.ALARM_STAT0] |= stat0
+        self.registers[self.ALARM_STAT1] |= stat1
+
+    @property
+    def cleared_dacs(self) -> int:
+        # Bit n set while DAC n is held at its clear code, by a routed alarm or by DAC_CLR0/1
+        mask = self.registers[self.DAC_CLR0] | self.registers[self.DAC_CLR0 + 1] << 8
+        if self.registers[self.ALARM_STAT0] & self.registers[self.DAC_CLR_SRC0] or \
+                self.registers[self.ALARM_STAT1] & self.registers[self.DAC_CLR_SRC0 + 1]:
+            mask |= self.registers[self.DAC_CLR_EN0] | self.registers[self.DAC_CLR_EN0 + 1] << 8
+        return mask
+
+    def select(self) -> None:
+        self._byte = 0
+        self._dac_written = set()
+
+    def deselect(self) -> None:
+        if self.model is not None:
+            for low in sorted(self._dac_written):
+                self.model.set_dac_code(low, self.registers[low] | (self.registers[low + 1] & 0x0F) << 8)
+        self._dac_written = set()
+
+    def transfer(self, mosi: int) -> int:
+        # One byte clocked each way, returns MISO
+        byte, self._byte = self._byte, self._byte + 1
+        if byte == 0:
+            self._read = bool(mosi & 0x80)
+            self._address = (mosi & 0x7F) << 8
+            return 0x00
+        if byte == 1:
+            self._address |= mosi
+            return 0x00
+
+        address = self._address
+        self._address += 1 if self.registers[self.ITFC_CFG0] & self.ADDR_ASCEND else -1
+        if not 0 <= address < len(self.registers):
+            return 0x00
+        if self._read:
+            value = self.registers[address]
+            if address in (self.ALARM_STAT0, self.ALARM_STAT1):
+                self.registers[address] = 0
+                self.status_reads += 1
+            return value
+        self.registers[address] = mosi
+        if self.DAC_DATA_FIRST <= address <= self.DAC_DATA_LAST:
+            self._dac_written.add(address & ~1)
+        return 0x00
+
+
+class MpsseSimulator:
+    """
+    An ftd2xx device in MPSSE mode, enough of it for FtdiSpi: byte and bit clocking, GPIO set and get, clock
+    settings, loopback and the bad command response. Writes are parsed as they arrive, a command split over
+    two writes waits for the rest. The chip select line, cs_mask on the low byte, frames the slave.
+
+    bus_time adds up the time the bytes would have taken on the wire at the programmed clock, the part of
+    a transaction no host change can remove.
+    """
+    BASE_CLOCK_HZ = 60E6
+
+    def __init__(self, slave: Union[None, SimulatedAmc7836] = None, cs_mask: int = 0x08):
+        self.slave = slave
+        self.cs_mask = cs_mask
+        self.low_value = 0xFF
+        self.low_direction = 0x00
+        self.high_value = 0xFF
+        self.high_direction = 0x00
+        self.divisor = 0
+        self.divide_by_five = True  # Power up state of the FT2232H
+        self.loopback = False
+        self.bus_time = 0.0  # s
+        self._pending = bytearray()
+        self._rx = bytearray()
+        self._lock = threading.Lock()
+
+    @property
+    def clock_hz(self) -> float:
+        base = self.BASE_CLOCK_HZ / 5 if self.divide_by_five else self.BASE_CLOCK_HZ
+        return base / ((1 + self.divisor) * 2)
+
+    @property
+    def selected(self) -> bool:
+        return not self.low_value & self.cs_mask
+
+    def _set_low(self, value: int, direction: int) -> None:
+        was_selected = self.selected
+        self.low_value, self.low_direction = value, direction
+        if self.slave is not None and self.selected != was_selected:
+            if self.selected:
+                self.slave.select()
+            else:
+                self.slave.deselect()
+
+    def _transfer(self, mosi: int, lsb_first: bool) -> int:
+        if self.loopback:
+            return mosi
+        if self.slave is None or not self.selected:
+            return 0xFF
+        # MISO has a pull-up when nothing drives it
+        if lsb_first:
+            return _reverse_bits(self.slave.transfer(_reverse_bits(mosi)))
+        return self.slave.transfer(mosi)
+
+    def _command_length(self, opcode: int) -> Union[None, int]:
+        # Bytes the command at the head of _pending needs, None until its length is known
+        if opcode < 0x80 and opcode & 0x30:
+            if opcode & 0x02:
+                return 3 if opcode & 0x10 else 2
+            if len(self._pending) < 3:
+                return None
+            count = (self._pending[1] | self._pending[2] << 8) + 1
+            return 3 + count if opcode & 0x10 else 3
+        return {0x80: 3, 0x82: 3, 0x86: 3, 0x8E: 2, 0x8F: 3}.get(opcode, 1)
+
+    def _execute(self, command: bytes) -> None:
+        opcode = command[0]
+        if opcode < 0x80 and opcode & 0x30:
+            write, read, lsb_first = opcode & 0x10, opcode & 0x20, bool(opcode & 0x08)
+            if opcode & 0x02:
+                # Bits are not passed to the slave, the AMC7836 only takes whole bytes
+                self.bus_time += (command[1] + 1) / self.clock_hz
+                if read:
+                    self._rx.append(command[2] if self.loopback and write else 0xFF)
+                return
+            count = (command[1] | command[2] << 8) + 1
+            data = command[3:] if write else bytes(count)
+            self.bus_time += 8 * count / self.clock_hz
+            miso = bytes(self._transfer(mosi, lsb_first) for mosi in data)
+            if read:
+                self._rx.extend(miso)
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_SET_GPIO_LOW_COMMAND:
+            self._set_low(command[1], command[2])
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_SET_GPIO_HIGH_COMMAND:
+            self.high_value, self.high_direction = command[1], command[2]
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_GET_GPIO_LOW_COMMAND:
+            self._rx.append((self.low_value & self.low_direction) | (~self.low_direction & 0xFF))
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_GET_GPIO_HIGH_COMMAND:
+            self._rx.append((self.high_value & self.high_direction) | (~self.high_direction & 0xFF))
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_CLOCK_DIVDER_COMMAND:
+            self.divisor = command[1] | command[2] << 8
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_ENABLE_CLOCK_DIVIDE_BY_FIVE_COMMAND:
+            self.divide_by_five = True
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_DISABLE_CLOCK_DIVIDE_BY_FIVE_COMMAND:
+            self.divide_by_five = False
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_ENABLE_LOOPBACK_COMMAND:
+            self.loopback = True
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_DISABLE_LOOPBACK_COMMAND:
+            self.loopback = False
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_CLOCK_N_BITS_NO_DATA_COMMAND:
+            self.bus_time += (command[1] + 1) / self.clock_hz
+        elif opcode == FTDI_MPSSE_COMMANDS.FT_MPSSE_CLOCK_N_BYTES_NO_DATA_COMMAND:
+            self.bus_time += 8 * ((command[1] | command[2] << 8) + 1) / self.clock_hz
+        elif opcode in (FTDI_MPSSE_COMMANDS.FT_MPSSE_FLUSH_COMMAND,
+                        FTDI_MPSSE_COMMANDS.FT_MPSSE_ENABLE_THREE_PHASE_CLOCKING_COMMAND,
+                        FTDI_MPSSE_COMMANDS.FT_MPSSE_DISABLE_THREE_PHASE_CLOCKING_COMMAND,
+                        FTDI_MPSSE_COMMANDS.FT_MPSSE_ENABLE_ADAPTIVE_CLOCKING_COMMAND,
+                        FTDI_MPSSE_COMMANDS.FT_MPSSE_DISABLE_ADAPTIVE_CLOCKING_COMMAND):
+            pass
+        else:
+            self._rx.extend([FTDI_MPSSE_COMMANDS.FT_MPSSE_FAILCODE, opcode])
+
+    # ftd2xx device calls used by FtdiBase and FtdiSpi
+    def write(self, data: bytes) -> int:
+        with self._lock:
+            self._pending.extend(data)
+            while len(self._pending) > 0:
+                length = self._command_length(self._pending[0])
+                if length is None or len(self._pending) < length:
+                    break
+                command = bytes(self._pending[:length])
+                del self._pending[:length]
+                self._execute(command)
+        return len(data)
+
+    def read(self, length: int) -> bytes:
+        with self._lock:
+            data = bytes(self._rx[:length])
+            del self._rx[:length]
+        return data
+
+    def getQueueStatus(self) -> int:
+        return len(self._rx)
+
+    def purge(self, mask: int = 0) -> None:
+        with self._lock:
+            if mask & PURGE_RX:
+                self._rx = bytearray()
+            if mask & PURGE_TX:
+                self._pending = bytearray()
+
+    def setBitMode(self, mask: int, enable: int) -> None:
+        pass
+
+    def setLatencyTimer(self, latency: int) -> None:
+        pass
+
+    def setFlowControl(self, flow_control: int, xon: int = 0, xoff: int = 0) -> None:
+        pass
+
+    def setTimeouts(self, read_timeout: int, write_timeout: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def simulated_amc7836(model: Union[None, DutModel] = None, reset_values: Union[None, dict] = None) -> tuple:
+    """
+    Open the real Amc7836 driver on simulated cable ports, the register model behind port A. Returns the
+    driver and the SimulatedAmc7836, whose registers show what the driver wrote.
+    """
+    chip = SimulatedAmc7836(model, reset_values)
+    amc7836 = Amc7836()
+    amc7836.io.mpsse.use_device(MpsseSimulator(chip), 'SIM0000A')
+    amc7836.io.mpsse_lev_shift.use_device(MpsseSimulator(), 'SIM0000B')
+    amc7836.open()
+    return amc7836, chip
+
+
+def replay_trace(filename: str, model: Union[None, DutModel] = None,
+                 reset_values: Union[None, dict] = None) -> ReplayReport:
+    """
+    Replay an Amc7836FtdiSpi recording, channel 0 into a simulated AMC7836 and channel 1 into a bare
+    MPSSE engine as on the level shifter port.
+    """
+    _, records = read_trace(filename)
+    devices = {0: MpsseSimulator(SimulatedAmc7836(model, reset_values)), 1: MpsseSimulator()}
+    return replay(records, devices)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python -m instrument_lib.sim.sim_mpsse <trace file>')
+        return
+    print(replay_trace(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
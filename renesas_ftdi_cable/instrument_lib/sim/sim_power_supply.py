@@ -0,0 +1,88 @@
+import time
+from typing import Union, List
+
+from instrument_lib.sim.dut_model import DutModel
+from instrument_lib.sim.scpi_server import ScpiServer
+
+
+class SimulatedPowerSupply(ScpiServer):
+    """
+    Keysight bench supply with per-channel setpoints. Output voltage slews towards the setpoint and the
+    output current is the DutModel rail current, clipped at the current limit.
+    Commands without a channel list address channel 1, as on the single output N5748A.
+    """
+
+    def __init__(self, name: str, idn: str, channel_count: int, model: DutModel,
+                 slew_rate: float = 50.0, **kwargs):
+        super().__init__(idn, **kwargs)
+        self.name = name
+        self.channel_count = channel_count
+        self.model = model
+        self.slew_rate = slew_rate  # V/s
+        self.reset()
+
+        for ch in range(1, channel_count + 1):
+            self.model.register_rail(name, ch, lambda ch=ch: self.output_voltage(ch))
+
+        self.commands.update({
+            'VOLT': lambda values, channels: self._set(channels, 'voltage', float(values[0])),
+            'CURR': lambda values, channels: self._set(channels, 'current', float(values[0])),
+            'OUTP': lambda values, channels: self._set(channels, 'output', values[0].upper() in ('1', 'ON')),
+            'OUTP:STAT': lambda values, channels: self._set(channels, 'output', values[0].upper() in ('1', 'ON')),
+            'VOLT?': lambda values, channels: self._get(channels, 'voltage'),
+            'CURR?': lambda values, channels: self._get(channels, 'current'),
+            'OUTP?': lambda values, channels: self._get(channels, 'output'),
+            'MEAS:VOLT?': lambda values, channels: self._join(self.output_voltage(ch) for ch in self._channels(channels)),
+            'MEAS:CURR?': lambda values, channels: self._join(self.output_current(ch) for ch in self._channels(channels)),
+        })
+
+    def reset(self) -> None:
+        self.state = {}
+        for ch in range(1, self.channel_count + 1):
+            self.state[ch] = {'voltage': 0.0, 'current': 0.0, 'output': False,
+                              'start_voltage': 0.0, 'change_time': time.perf_counter()}
+
+    def _channels(self, channels: Union[None, List[int]]) -> List[int]:
+        return [1] if channels is None else channels
+
+    def _join(self, values) -> str:
+        return ','.join(f"{value:+.6E}" for value in values)
+
+    def _set(self, channels: Union[None, List[int]], field: str, value) -> None:
+        for ch in self._channels(channels):
+            state = self.state[ch]
+            # Restart the slew from wherever the output is now
+            state['start_voltage'] = self.output_voltage(ch)
+            state['change_time'] = time.perf_counter()
+            state[field] = value
+
+    def _get(self, channels: Union[None, List[int]], field: str) -> str:
+        values = [self.state[ch][field] for ch in self._channels(channels)]
+        if field == 'output':
+            return ','.join(str(int(value)) for value in values)
+        return self._join(values)
+
+    def output_voltage(self, ch: int) -> float:
+        state = self.state[ch]
+        target = state['voltage'] if state['output'] else 0.0
+        step = self.slew_rate * (time.perf_counter() - state['change_time'])
+        if abs(target - state['start_voltage']) <= step:
+            return target
+        return state['start_voltage'] + step * (1 if target > state['start_voltage'] else -1)
+
+    def output_current(self, ch: int) -> float:
+        if not self.state[ch]['output']:
+            return 0.0
+        return min(self.model.rail_current(self.name, ch), self.state[ch]['current'])
+
+
+def simulated_e36234a(model: DutModel, **kwargs) -> SimulatedPowerSupply:
+    return SimulatedPowerSupply('e36234a', 'Keysight Technologies,E36234A,SIM00002,1.0.0', 2, model, **kwargs)
+
+
+def simulated_e36312a(model: DutModel, **kwargs) -> SimulatedPowerSupply:
+    return SimulatedPowerSupply('e36312a', 'Keysight Technologies,E36312A,SIM00003,1.0.0', 3, model, **kwargs)
+
+
+def simulated_n5748a(model: DutModel, **kwargs) -> SimulatedPowerSupply:
+    return SimulatedPowerSupply('n5748a', 'Agilent Technologies,N5748A,SIM00004,A.00.00', 1, model, **kwargs)
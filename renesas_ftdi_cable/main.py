@@ -1,15 +1,35 @@
-import math
 import csv
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Union
 
+import numpy
+
+from htol_lib.bias_cache import BiasCache
+from htol_lib.htol_store import HtolStore, StoreWriter
+from htol_lib.interlock import HardwareInterlock, InterlockChannel, InterlockWatchdog, TripReport
+from htol_lib.journal import RunJournal, RunState
+from htol_lib.orchestrator import DutConfig, Orchestrator
+from htol_lib.rollup import HtolRollup, RollupWriter
+from htol_lib.regulator import DrainCurrentRegulator, RegulatedStage, RegulatorStats
+from htol_lib.sequencer import Sequencer, SequenceStep, SequenceTrace
+from htol_lib.settling import SettlingDetector
+from htol_lib.sweep import IdVgSweep, SweepResult, linear_codes
+from htol_lib.bias_search import (BiasSearch, BiasSearchReport, BiasStage, MultiStageBiasReport,
+                                  MultiStageBiasSearch, SecantSearch, run_bias_search)
 from instrument_lib.dac.amc7836 import Amc7836
 from instrument_lib.dac.amc7836_init import Amc7836Init
-from instrument_lib.daq.keysight_daq970a import KeysightDaq970a
+from instrument_lib.dac.amc7836_ramp import Amc7836Ramp
+from instrument_lib.dac.register_history import RegisterChange, RegisterHistory, RegisterMonitor, read_image
+from instrument_lib.daq.keysight_daq970a import SCAN_READING_DTYPE, KeysightDaq970a
+from instrument_lib.daq.scan_result import ScanResult
+from instrument_lib.instrument_base import InstrumentBase
+from instrument_lib.measurement_logger import MeasurementLogger
 from instrument_lib.power_supply.keysight_e36234a import KeysightE36234a
 from instrument_lib.power_supply.keysight_e36312a import KeysightE36312a
 from instrument_lib.power_supply.keysight_n5748a import KeysightN5748a
+from instrument_lib.scpi_trace import ScpiTracer
 
 '''
 TODO: Get the device ID fro KeysightE36234a and KeysightE36312a
@@ -19,59 +39,102 @@ class DeviceUnderTest:
 
     def __init__(self):
         self._amc7836: Union[None, Amc7836] = None
+        self._dac_ramp: Union[None, Amc7836Ramp] = None
         self._daq970a: Union[None, KeysightDaq970a] = None
         self._keysight_e36234a: Union[None, KeysightE36234a] = None 
         self._keysight_e36312a: Union[None, KeysightE36312a] = None 
         self._keysight_n5748a: Union[None, KeysightN5748a] = None 
         self._delay_sec = 5
+        self._rail_tolerance_v = 0.05
+        self._drain_off_a = 0.001
+        self._settling = SettlingDetector(timeout=1.0)
+        # Decides when drain currents have settled after a gate DAC change
+        self._bias_search: BiasSearch = SecantSearch()
+        self._bias_cache = BiasCache('bias_cache.json')
+        self._chamber_temperature_c = 25.0
+        self._gate_slew_v_per_s = 1.0
+        self._dac_codes = {}  # Last code written to each DAC data register, keyed by low byte address
+        self._daq_lock = threading.RLock()
+        # Held by anything that talks to the DAQ or DAC while the regulator runs
+        self._scan_running = False
+        self._regulator: Union[None, DrainCurrentRegulator] = None
+        self._regulator_reading_times = {}
+        self._interlock: Union[None, HardwareInterlock] = None
+        self._watchdog: Union[None, InterlockWatchdog] = None
+        self._journal: Union[None, RunJournal] = None
+        # Write-ahead journal of the run, every state change is recorded before it is sent
+        self._register_monitor: Union[None, RegisterMonitor] = None
+        self._scpi_tracer: Union[None, ScpiTracer] = None
         self._daq_current_vdd2_channel = 111
         self._daq_current_vdd3_c_channel = 112
     
-    def power_up_keysight_e36234a(self) -> None:
-        self._keysight_e36234a = KeysightE36234a('Todo')
-
-        self._keysight_e36234a.set_output_voltage('1,2', 60)
-        # Channel 1 and 2: 6V
-
-        self._keysight_e36234a.set_output_current('1,2', 10)
-        # Set the output current for channels 1 and 2 to 10A
+    def use_journal(self, journal: RunJournal) -> None:
+        self._journal = journal
+
+    def use_bias_cache(self, bias_cache: BiasCache) -> None:
+        self._bias_cache = bias_cache
+
+    def _record(self, kind: str, **fields) -> None:
+        if self._journal is not None:
+            self._journal.record(kind, **fields)
+
+    def _supply(self, name: str):
+        # Open a supply on first use
+        if name == 'e36234a':
+            if self._keysight_e36234a is None:
+                self._keysight_e36234a = KeysightE36234a('Todo')
+                self._trace_instrument(self._keysight_e36234a, 'e36234a')
+            return self._keysight_e36234a
+        if name == 'e36312a':
+            if self._keysight_e36312a is None:
+                self._keysight_e36312a = KeysightE36312a('Todo')
+                self._trace_instrument(self._keysight_e36312a, 'e36312a')
+            return self._keysight_e36312a
+        if name == 'n5748a':
+            if self._keysight_n5748a is None:
+                self._keysight_n5748a = KeysightN5748a('USB0::0x0957::0x0807::US27C3730L')
+                self._trace_instrument(self._keysight_n5748a, 'n5748a')
+            return self._keysight_n5748a
+        raise Exception(f'main.py: Unknown supply {name}.')
+
+    def configure_supply(self, name: str, **settings) -> None:
+        # settings are the configure_outputs arguments
+        self._record('supply', name=name, settings=settings)
+        self._supply(name).configure_outputs(**settings)
 
-        self._keysight_e36234a.enable_output('1,2', True)
-        # Enable output
+    def power_up_keysight_e36234a(self) -> None:
+        self.configure_supply('e36234a', ch='1,2', voltage=60, current=10, enable=True)
+        # Channel 1 and 2: 60V, 10A, output enabled in one transfer
 
     def power_up_keysight_e36312a(self) -> None:
-        self._keysight_e36312a = KeysightE36312a('Todo')
-
-        self._keysight_e36312a.set_output_voltage(1, 5)
-        self._keysight_e36234a.set_output_current(2, 5)
-        # Channel 1: 6V, 5A
-
-        self._keysight_e36312a.set_output_voltage(2, 25)
-        self._keysight_e36234a.set_output_current(2, 1)
+        self.configure_supply('e36312a', ch='1,2,3', voltage=[5, 25, 25], current=[5, 1, 1], enable=True)
+        # Channel 1: 5V, 5A
         # Channel 2: 25V, 1A
-
-        self._keysight_e36312a.set_output_voltage(3, 25)
-        self._keysight_e36234a.set_output_current(3, 1)
         # Channel 3: 25V, 1A
-
-        self._keysight_e36234a.enable_output('1,2,3', True)
         # Enable output
     
     def power_up_keysight_n5748a(self) -> None:
-        self._keysight_n5748a = KeysightN5748a('USB0::0x0957::0x0807::US27C3730L')
-
-        self._keysight_n5748a.set_output_voltage(1, 80)
-        self._keysight_n5748a.set_output_current(2, 9.5)
-        # Channel 1: 80V, 9.5A
-
-        self._keysight_e36234a.enable_output(1, True)
-        # Enable output
+        self.configure_supply('n5748a', voltage=80, current=9.5, enable=True)
+        # 80V, 9.5A, output enabled
 
     
-    def configure_amc7836(self) -> None:
-        self._amc7836 = Amc7836Init.init()
+    def use_instruments(self, daq970a=None, e36234a=None, e36312a=None, n5748a=None) -> None:
+        # Use instruments opened elsewhere, e.g. broker proxies in a multi-DUT worker
+        if daq970a is not None:
+            self._daq970a = daq970a
+        if e36234a is not None:
+            self._keysight_e36234a = e36234a
+        if e36312a is not None:
+            self._keysight_e36312a = e36312a
+        if n5748a is not None:
+            self._keysight_n5748a = n5748a
+
+    def configure_amc7836(self, serial_number: str = None) -> None:
+        self._amc7836 = Amc7836Init.init(serial_number)
         # Initialize Amc7836 assuming it is plugged in with USB
 
+        self._dac_ramp = Amc7836Ramp(self._amc7836)
+
         interface_configuration = self._amc7836.read_register(self._amc7836.REGISTER_ADDRESSES['ITFC_CFG0'], 2)
         # Software reset
 
@@ -84,13 +147,13 @@ class DeviceUnderTest:
                 return
         # Checks if the returned values are the same as the expected values
         
-        self._amc7836.write_register(self._amc7836.REGISTER_ADDRESSES['ADC_PD2'], 0x02)
+        self.write_configuration(self._amc7836.REGISTER_ADDRESSES['ADC_PD2'], [0x02])
          # Enable PREF for DAC operation
 
-        self._amc7836.write_register(self._amc7836.REGISTER_ADDRESSES['DAC_RNG0'], [0x44, 0x44])
+        self.write_configuration(self._amc7836.REGISTER_ADDRESSES['DAC_RNG0'], [0x44, 0x44])
         # set DAC range for -10 ~ 0V
 
-        self._amc7836.write_register(self._amc7836.REGISTER_ADDRESSES['DAC_PD0'], [0xFF, 0xFF])
+        self.write_configuration(self._amc7836.REGISTER_ADDRESSES['DAC_PD0'], [0xFF, 0xFF])
         # enable DAC A,B,C,D
 
         dac_range = self._amc7836.read_register(self._amc7836.REGISTER_ADDRESSES['DAC_RNG0'], 2)
@@ -102,132 +165,536 @@ class DeviceUnderTest:
         print(f'DAC Range D 0b{((dac_range[1] >> 4) & 7)}')
         # print the DAC Range
 
-    def configure_daq970a(self) -> None:
+    def write_configuration(self, address: int, values: list[int]) -> None:
+        # AMC7836 configuration register write that a resumed run has to repeat
+        self._record('registers', address=address, values=values)
+        self._amc7836.write_register(address, values)
+
+    def configure_daq970a(self, reset: bool = True) -> None:
         self._daq970a = KeysightDaq970a('USB0::0x2A8D::0x5101::MY58016887::INSTR')
+        self._trace_instrument(self._daq970a, 'daq970a')
 
         idn = self._daq970a.get_id()
         print(f'DAQ ID:{idn}')
 
+        if not reset:
+            return
+        # A resumed run keeps the scan the DAQ is running
         self._daq970a.clear()
         self._daq970a.reset()
 
         time.sleep(1)
     
-    def power_up_sequence(self) -> None:
-        print('Turning on VDD1 +5V Pre Driver Drain Voltage')
-        self.power_up_keysight_e36312a()
-        print(f'Sleeping for {self._delay_sec} seconds...')
-        time.sleep(self._delay_sec)
-
-        print('Turning on VGG2, VGG3_C, VGG3_P -6.5V Gate Voltages')
-        dac_value = [0x99, 0x05, 0x99, 0x05, 0x99, 0x05]
-        self.set_dac_voltage(self._amc7836.REGISTER_ADDRESSES['DACA0_DATA_LO'], dac_value)
-        print(f'Sleeping for {self._delay_sec} seconds...')
-        time.sleep(self._delay_sec)
-
-        # input('Turn on VDD2, VDD3_C, VDD3_P +50V Drain Voltage')
-        # print(f'Sleeping for {self._delay_sec} seconds...')
-        # time.sleep(self._delay_sec)
+    def measure_rail_currents(self, supply_channels: dict) -> dict:
+        # supply_channels is supply name -> channels, the currents come back in the same order
+        return {name: [float(value) for value in self._supply(name).measure_currents(channels)]
+                for name, channels in supply_channels.items()}
+
+    def rail_within(self, supply, ch: int, voltage: float) -> bool:
+        return abs(float(supply.measure_voltages(ch)[0]) - voltage) <= self._rail_tolerance_v
+
+    def drain_currents_below(self, threshold: float) -> bool:
+        return all(abs(value) < threshold for value in self._daq970a.read_voltage(self.scan_channels(), 'fast'))
+
+    def wait_drain_currents_settled(self) -> None:
+        result = self._settling.wait(lambda: self._daq970a.read_voltage(self.scan_channels(), 'fast'),
+                                     tuple(self.scan_channels()), self._delay_sec)
+        print(f'Drain currents settled: {result.settled} after {result.elapsed:.2f} seconds')
+        # Wait for the drain currents to settle, at most self._delay_sec
+
+    def power_up_sequence(self) -> SequenceTrace:
+        sequencer = Sequencer('power up')
+
+        sequencer.add(SequenceStep('vdd1_on', self.power_up_keysight_e36312a, resource='e36312a'))
+        # Turn on VDD1 +5V Pre Driver Drain Voltage
+        sequencer.add(SequenceStep('vdd1_ready', condition=lambda: self.rail_within(self._keysight_e36312a, 1, 5),
+                                   depends_on=['vdd1_on'], resource='e36312a', timeout=self._delay_sec))
+
+        sequencer.add(SequenceStep('daq_fast_profile',
+                                   lambda: self._daq970a.apply_profile('fast', self.scan_channels()),
+                                   resource='daq970a'))
+        # Runs while VDD1 comes up
+
+        sequencer.add(SequenceStep('gates_on',
+                                   lambda: self.ramp_dac_codes({'DACA0_DATA_LO': 0x599, 'DACA1_DATA_LO': 0x599,
+                                                                'DACA2_DATA_LO': 0x599}, self._gate_slew_v_per_s),
+                                   depends_on=['vdd1_ready'], resource='amc7836'))
+        # Turn on VGG2, VGG3_C, VGG3_P -6.5V Gate Voltages
+        sequencer.add(SequenceStep('drain_settled', self.wait_drain_currents_settled,
+                                   depends_on=['gates_on', 'daq_fast_profile'], resource='daq970a'))
+
+        # sequencer.add(SequenceStep('vdd2_vdd3_on', self.power_up_keysight_n5748a,
+        #                            depends_on=['drain_settled'], resource='n5748a'))
+        # Turn on VDD2, VDD3_C, VDD3_P +50V Drain Voltage
+
+        trace = sequencer.run()
+        print(trace)
+        return trace
 
     def set_dac_voltage(self, address: int, value: list[int]) -> None:
         self._amc7836.write_register(address, value)
         self._amc7836.write_register(self._amc7836.REGISTER_ADDRESSES['REG_UPDATE'], 0x01)
     
-    def adjust_gate_voltage(self, dac_address_key: str, dac_init_value: int, daq_ch: int, target: float) -> None:
+    def set_dac_code(self, dac_address_key: str, code: int) -> None:
+        self.set_dac_codes({dac_address_key: code})
+
+    def _dac_burst_codes(self, addresses: dict) -> tuple:
+        """
+        Return the first address and the current code of every DAC data register from the lowest to the
+        highest of addresses. Registers never written from here are read back once.
+        """
+        first, last = min(addresses), max(addresses)
+        for address in range(first, last + 1, 2):
+            if address not in self._dac_codes:
+                low, high = self._amc7836.read_register(address, 2)
+                self._dac_codes[address] = low | (high << 8)
+        return first, [self._dac_codes[address] for address in range(first, last + 1, 2)]
+
+    def set_dac_codes(self, codes: dict) -> None:
+        """
+        Write the codes of several DAC channels, keyed by data register name, in one register burst and latch
+        them with a single REG_UPDATE. Channels between them keep their last code.
+        """
+        self.set_dac_addresses({self._amc7836.REGISTER_ADDRESSES[key]: code for key, code in codes.items()})
+
+    def set_dac_addresses(self, addresses: dict) -> None:
+        # set_dac_codes keyed by data register low byte address
+        self._record('dac_codes', codes={address: int(code) for address, code in addresses.items()})
+        self._dac_codes.update(addresses)
+        first, burst_codes = self._dac_burst_codes(addresses)
+
+        dac_value = []
+        for code in burst_codes:
+            dac_value.extend([code & 0xFF, code >> 8])
+        self.set_dac_voltage(first, dac_value)
+
+    def ramp_dac_codes(self, codes: dict, slew_rate: float) -> None:
+        """
+        Ramp several DAC channels, keyed by data register name, from their current codes at slew_rate V/s.
+        The ramp is precompiled and played back by the FTDI MPSSE engine.
+        """
+        addresses = {self._amc7836.REGISTER_ADDRESSES[key]: code for key, code in codes.items()}
+        first, start_codes = self._dac_burst_codes(addresses)
+        end_codes = [addresses.get(first + 2 * index, code) for index, code in enumerate(start_codes)]
+        self._record('dac_codes', codes={address: int(code) for address, code in addresses.items()})
+        # A crash during the ramp resumes at the end codes
+
+        ramp = self._dac_ramp.compile(first, start_codes, end_codes, slew_rate)
+        elapsed = self._dac_ramp.play(ramp)
+        for index, code in enumerate(end_codes):
+            self._dac_codes[first + 2 * index] = code
+        print(f'Ramped {len(end_codes)} DAC channels in {ramp.step_count} steps, {elapsed:.2f} seconds')
+
+    def set_chamber_temperature(self, temperature_c: float) -> None:
+        self._chamber_temperature_c = temperature_c
+
+    def cached_dac_code(self, dac_address_key: str, target: float, dac_init_value: int) -> int:
+        # Start from the code this DUT converged to before under the same condition when there is one
+        code = self._bias_cache.lookup(self._amc7836.dut_id, dac_address_key, target, self._chamber_temperature_c)
+        if code is None:
+            return dac_init_value
+        print(f'{dac_address_key}: starting from cached code {code}')
+        return code
+
+    def store_dac_code(self, dac_address_key: str, target: float, code: int, current: float) -> None:
+        # Cached under the DAC data register, the stage names of adjust_gate_voltages may change between runs
+        self._bias_cache.store(self._amc7836.dut_id, dac_address_key, target, self._chamber_temperature_c, code,
+                               current)
+
+    def adjust_gate_voltage(self, dac_address_key: str, dac_init_value: int, daq_ch: int, target: float,
+                            engine: Union[None, BiasSearch] = None) -> BiasSearchReport:
         """
         Adjust the gate voltage to reach a target drain current.
 
         Args:
         - dac_address_key (str): The key for the DAC address.
-        - dac_init_value (int): The initial DAC value.
+        - dac_init_value (int): The initial DAC value, used when the bias cache has no code for this condition.
         - daq_ch (int): The DAQ channel.
         - target (float): The target drain current.
+        - engine (BiasSearch): The search engine, the DUT default when None.
 
         Returns:
-        - None
+        - BiasSearchReport: The codes tried, drain currents measured and the time taken.
         """
 
-        dac_step = [64, 32, 16, 8, 4, 2]
-        # Define the DAC step values
-
-        dac_value = [dac_init_value & 0xFF, dac_init_value >> 8]
-        # Initialize the DAC value
-        
-        self.set_dac_voltage(self._amc7836.REGISTER_ADDRESSES[dac_address_key], dac_value)
-        # Set the initial DAC voltage
-        
-        time.sleep(0.1)
-        # Wait for 0.1 seconds
-        
-        drain_current = self._daq970a.measure_voltage(daq_ch)
-        print(f'Drain current: {drain_current:.5f}')
-        # Measure the start drain current
-        
-        dac_curr_value = dac_init_value
-        # Initialize the current DAC value
-        
-        for index, val in enumerate(dac_step):
-            dac_new_value = dac_curr_value + int(math.copysign(val, target - drain_current))
-            # Calculate the new DAC value
-
-            if dac_new_value < 3072:
-            # Limit the DAC voltage to less than -2.5V (3072)
-
-                dac_value = [dac_new_value & 0xFF, dac_new_value >> 8]
-                # Update the DAC value
-
-                self.set_dac_voltage(self._amc7836.REGISTER_ADDRESSES[dac_address_key], dac_value)
-                # Set the new DAC voltage
+        def set_code(code: int) -> None:
+            self.set_dac_code(dac_address_key, code)
 
-                
-                time.sleep(0.1)
-                # Wait for 0.1 seconds
+        def measure() -> float:
+            result = self._settling.wait(lambda: self._daq970a.read_voltage(daq_ch, 'fast'), daq_ch)
+            print(f'Drain current: {result.value:.5f} settled in {result.elapsed:.3f} seconds')
+            # Read until the drain current has settled
+            return result.value
 
-                drain_current = self._daq970a.measure_voltage(daq_ch)
-                print(f'Iteration: {index} Drain current: {drain_current:.5f}')
-                # Measure the drain current
+        start_code = self.cached_dac_code(dac_address_key, target, dac_init_value)
+        report = run_bias_search(self._bias_search if engine is None else engine,
+                                 target, start_code, set_code, measure)
+        print(report)
+        if report.converged:
+            self.store_dac_code(dac_address_key, target, report.code, report.current)
+        return report
 
-            dac_curr_value = dac_init_value
-            # Update the current DAC value
-
-
-    def configure_scan(self, interval_count: int, interval_length: int) -> None:
+    def adjust_gate_voltages(self, stages: list[BiasStage]) -> MultiStageBiasReport:
+        """
+        Bias several amplifier stages together. Each step updates every stage DAC in one burst and reads
+        every drain current channel in one DAQ scan.
+        """
+        channels = list(dict.fromkeys(stage.daq_ch for stage in stages))
+
+        def set_codes(codes: dict) -> None:
+            self.set_dac_codes({stage.dac_address_key: codes[stage.name] for stage in stages})
+
+        def measure(measured_stages: list[BiasStage]) -> list[float]:
+            result = self._settling.wait(lambda: self._daq970a.read_voltage(channels, 'fast'), tuple(channels))
+            # Read all channels until every drain current has settled
+            values = dict(zip(channels, result.value))
+            return [values[stage.daq_ch] for stage in measured_stages]
+
+        for stage in stages:
+            stage.start_code = self.cached_dac_code(stage.dac_address_key, stage.target, stage.start_code)
+
+        report = MultiStageBiasSearch(stages).run(set_codes, measure)
+        print(report)
+        for stage in stages:
+            current = report.currents[stage.name]
+            if current is not None and abs(current - stage.target) <= stage.engine.tolerance_for(stage.target):
+                self.store_dac_code(stage.dac_address_key, stage.target, report.codes[stage.name], current)
+        return report
+
+    def id_vg_sweep(self, schedule: dict, channels: list, bidirectional: bool = False,
+                    settle_time: float = 0.0, current_limit: float = 0.5) -> SweepResult:
+        """
+        Sweep gate DACs through schedule, codes per DAC data register name, reading the drain current
+        channels at every point. The gates return to their previous codes afterwards, also when the
+        current limit ends the sweep early. Not allowed while the logging scan runs, the sweep reads with
+        its own profile and scan list.
+        """
+        if self._scan_running:
+            raise Exception('main.py: Stop the logging scan before an Id-Vg sweep.')
+        addresses = [self._amc7836.REGISTER_ADDRESSES[key] for key in schedule]
+        first, burst_codes = self._dac_burst_codes({address: None for address in addresses})
+        previous = {key: burst_codes[(address - first) // 2] for key, address in zip(schedule, addresses)}
+
+        sweep = IdVgSweep(self.set_dac_codes, lambda ch: self._daq970a.read_voltage(ch, 'fast'), channels,
+                          settle_time, current_limit)
+        with self._daq_lock:
+            try:
+                result = sweep.run(schedule, bidirectional)
+            finally:
+                self.set_dac_codes(previous)
+
+        print(f'Id-Vg sweep: {result.point_count} points in {result.elapsed:.2f} seconds'
+              f'{", stopped at the current limit" if result.aborted else ""}')
+        return result
+
+    def _start_scan(self, interval_count: int, interval_length: int) -> None:
         # Clear the scan list
         self._daq970a.write("ROUT:SCAN (@)")
 
-        # Configure the channels for DC voltage measurement
-        self._daq970a.write("CONF:VOLT:DC AUTO,DEF,(@111,112)")
-
-        # Add channels to the scan list
-        self._daq970a.write("ROUT:SCAN (@111,112)")
-
-        self._daq970a.write("TRIG:COUNT " + str(interval_count))
+        # Configure the channels for DC voltage measurement with fixed ranges and add them to the scan list
+        self._daq970a.apply_profile('precise', self.scan_channels())
 
-        self._daq970a.write("TRIG:SOUR TIMER")
-
-        self._daq970a.write("TRIG:TIMER " + str(interval_length))
+        # Tag every reading with its channel, scan time and alarm state
+        self._daq970a.configure_reading_format()
 
         # Initiate the scan
-        self._daq970a.write("INIT")
+        self._daq970a.start_timer_scan(interval_count, interval_length)
+        self._scan_running = True
+        # The regulator now follows the scan readings instead of measuring
 
-        time.sleep((interval_length * interval_count) + 5)
+    def configure_scan(self, interval_count: int, interval_length: int) -> None:
+        with self._daq_lock:
+            self._start_scan(interval_count, interval_length)
 
-        results = self._daq970a.query("FETCH?")
-        print("Scan Results:", results)
+        time.sleep((interval_length * interval_count) + 5)
 
-        measurements = []
+        with self._daq_lock:
+            readings = self._daq970a.fetch_readings()
+            self._scan_running = False
+        print("Scan Results:", readings)
 
-        for result in results.strip().split(","):
-            measurements.append(float(result))
+        return readings
 
-        return measurements
+    def stream_scan(self, interval_count: int, interval_length: int, logger: MeasurementLogger,
+                    store_writer: StoreWriter = None, rollup_writer: RollupWriter = None) -> int:
+        """
+        Run the timer scan and hand every completed sweep to logger, and to store_writer and rollup_writer
+        when given, as it arrives, stamped with the instrument scan time. Readings are erased from DAQ memory
+        once taken, so neither the DAQ nor this process holds the whole run. Returns the number of sweeps
+        logged.
+        """
+        channels = self.scan_channels()
+        self._record('scan', settings={'interval_count': interval_count, 'interval_length': interval_length,
+                                       'channels': channels})
+        with self._daq_lock:
+            self._start_scan(interval_count, interval_length)
+            start_time = self.scan_start_time()
+        self._record('scan_start', start_time=start_time.isoformat())
+
+        return self._follow_scan(channels, start_time, interval_count, interval_length, logger, store_writer,
+                                 rollup_writer)
+
+    def _follow_scan(self, channels: list, start_time: datetime, interval_count: int, interval_length: int,
+                     logger: MeasurementLogger, store_writer: StoreWriter = None,
+                     rollup_writer: RollupWriter = None, sweeps_done: int = 0) -> int:
+        # Take the sweeps of a running scan until interval_count of them, sweeps_done included, are logged
+        start_time = numpy.datetime64(start_time, 'ns')
+        pending = numpy.zeros(0, dtype=SCAN_READING_DTYPE)
+        sweep_count = sweeps_done
+        aligned = sweeps_done == 0
+        deadline = time.monotonic() + (interval_length * (interval_count - sweeps_done)) + 5
+        last_reading = time.monotonic()
+        while sweep_count < interval_count:
+            time.sleep(min(interval_length, 1.0))
+            with self._daq_lock:
+                readings = self._daq970a.remove_readings()
+            now = time.monotonic()
+            if readings.size > 0:
+                last_reading = now
+            elif now > deadline and now - last_reading > interval_length + 5:
+                break
+            # Past the expected end only a scan that stopped delivering readings is given up
+            pending = numpy.concatenate([pending, readings])
+            if not aligned:
+                first = numpy.flatnonzero(pending['channel'] == channels[0])
+                pending = pending[first[0]:] if first.size > 0 else pending[:0]
+                aligned = first.size > 0
+            # A reattached scan may start in the middle of a sweep whose first readings went with the crash
+
+            complete = pending.size - pending.size % len(channels)
+            if complete == 0:
+                continue
+            result = ScanResult.from_readings(pending[:complete], channels, start_time)
+            pending = pending[complete:]
+            # A sweep read while still in progress waits for its last channels
+
+            result.log(logger)
+            if store_writer is not None:
+                store_writer.append(result.sweep_times, result.values.T)
+            if rollup_writer is not None:
+                rollup_writer.append(result.sweep_times, result.values.T)
+            sweep_count += result.sweep_count
+            self._record('scan_progress', sweeps=sweep_count)
+
+        with self._daq_lock:
+            self._scan_running = False
+        self._record('scan_end', sweeps=sweep_count)
+        return sweep_count - sweeps_done
+
+    def regulator_currents(self, channels: list) -> Union[None, list]:
+        """
+        Drain currents for the regulator, from the latest readings of the logging scan. None is returned
+        while no scan runs and until every channel has a reading newer than the one used last cycle.
+        """
+        if not self._scan_running:
+            return None
+        # Measuring here would apply another profile and scan list over the configured scan
+
+        readings = self._daq970a.last_readings(channels)
+        if len(readings) != len(channels):
+            return None
+        if any(self._regulator_reading_times.get(int(r['channel'])) == float(r['time']) for r in readings):
+            return None
+        self._regulator_reading_times.update({int(r['channel']): float(r['time']) for r in readings})
+        return [float(value) for value in readings['value']]
+
+    def start_regulation(self, stages: list[RegulatedStage], rate_hz: float = 1.0) -> None:
+        self._regulator_reading_times = {}
+        self._regulator = DrainCurrentRegulator(stages, self.regulator_currents, self.set_dac_codes, rate_hz,
+                                                self._daq_lock)
+        self._regulator.start()
+
+    def stop_regulation(self) -> Union[None, RegulatorStats]:
+        if self._regulator is None:
+            return None
+        stats = self._regulator.stop()
+        self._regulator = None
+        print(stats)
+        return stats
+
+    def resume(self, serial_number: str = None) -> RunState:
+        """
+        Bring the DUT back to the journaled state after a crash of the host: repeat the AMC7836 configuration,
+        write every journaled gate DAC code in one register burst latched by one REG_UPDATE and set the
+        supplies again in the order they were last set. The journal must be attached with use_journal.
+        """
+        state = self._journal.state
+        start = time.perf_counter()
+
+        self.configure_amc7836(serial_number)
+        for address, values in state.registers.items():
+            self.write_configuration(address, values)
+        # Configuration written after configure_amc7836, e.g. by a later step of the run
+
+        if len(state.dac_codes) > 0:
+            with self._daq_lock:
+                self.set_dac_addresses(dict(state.dac_codes))
+        # The gates go straight to their bias, before any drain supply is set again
+
+        for name, settings in list(state.supplies.items()):
+            self.configure_supply(name, **settings)
+        print(f'Resumed {len(state.dac_codes)} DAC codes and {len(state.supplies)} supplies in '
+              f'{time.perf_counter() - start:.2f} seconds')
+        return state
+
+    def reattach_scan(self, logger: MeasurementLogger, store_writer: StoreWriter = None,
+                      rollup_writer: RollupWriter = None) -> int:
+        """
+        Follow the journaled scan if the DAQ is still running it, recognised by its scan start time, otherwise
+        start a scan of the sweeps still missing. Returns the number of sweeps logged.
+        """
+        scan = self._journal.state.scan
+        remaining = scan['interval_count'] - scan['sweeps']
+        with self._daq_lock:
+            start_time = self.scan_start_time()
+        if scan['start_time'] is not None and start_time == datetime.fromisoformat(scan['start_time']):
+            with self._daq_lock:
+                self._scan_running = True
+            print(f"Reattached to the scan started {scan['start_time']}, {remaining} sweeps to go")
+            return self._follow_scan(scan['channels'], start_time, scan['interval_count'], scan['interval_length'],
+                                     logger, store_writer, rollup_writer, scan['sweeps'])
+
+        print(f'The DAQ is no longer scanning, starting a new scan of {remaining} sweeps')
+        return self.stream_scan(remaining, scan['interval_length'], logger, store_writer, rollup_writer)
+
+    def report_register_changes(self, changes: list[RegisterChange]) -> None:
+        # DAC data registers holding the code last written from here changed on purpose
+        for change in changes:
+            dac_address = change.address & ~1
+            if 0x50 <= dac_address < 0x70 and dac_address in self._dac_codes:
+                code = self._dac_codes[dac_address]
+                if change.new == (code & 0xFF if change.address == dac_address else code >> 8):
+                    continue
+            print(f'Register upset: {change}')
+
+    def start_register_history(self, filename: str = 'register_history.bin', interval: float = 60.0) -> None:
+        """
+        Snapshot the AMC7836 registers every interval seconds into a RegisterHistory and report changes nobody
+        asked for, e.g. bits flipped by ESD or radiation.
+        """
+        history = RegisterHistory(filename, names=self._amc7836.REGISTER_ADDRESSES)
+        self._register_monitor = RegisterMonitor(lambda: read_image(self._amc7836), history, interval,
+                                                 self._daq_lock, self.report_register_changes)
+        self._register_monitor.start()
+
+    def stop_register_history(self) -> Union[None, RegisterHistory]:
+        if self._register_monitor is None:
+            return None
+        self._register_monitor.stop()
+        history = self._register_monitor.history
+        history.close()
+        self._register_monitor = None
+        return history
+
+    def start_ftdi_trace(self) -> dict:
+        # Trace both channels of the cable, SPI on port A and the level shifter GPIO on port B
+        with self._daq_lock:
+            return {'spi': self._amc7836.io.mpsse.enable_trace(),
+                    'lev_shift': self._amc7836.io.mpsse_lev_shift.enable_trace()}
+
+    def stop_ftdi_trace(self, filename: str = None) -> dict:
+        """
+        Stop tracing, print what was recorded and save it to <filename>_<channel>.npz when filename is given.
+        """
+        with self._daq_lock:
+            tracers = {'spi': self._amc7836.io.mpsse.disable_trace(),
+                       'lev_shift': self._amc7836.io.mpsse_lev_shift.disable_trace()}
+        for channel, tracer in tracers.items():
+            if tracer is None:
+                continue
+            print(f'FTDI {channel}:\n{tracer.summary()}')
+            if filename is not None:
+                tracer.dump(f'{filename}_{channel}.npz')
+        return tracers
+
+    def _trace_instrument(self, instrument, name: str) -> None:
+        # Broker proxies of a multi-DUT worker are traced in the broker
+        if self._scpi_tracer is not None and isinstance(instrument, InstrumentBase):
+            instrument.enable_trace(self._scpi_tracer, name)
+
+    def start_scpi_trace(self) -> ScpiTracer:
+        # Time every SCPI call of the open instruments and of those opened later
+        self._scpi_tracer = ScpiTracer()
+        for name, instrument in [('daq970a', self._daq970a), ('e36234a', self._keysight_e36234a),
+                                 ('e36312a', self._keysight_e36312a), ('n5748a', self._keysight_n5748a)]:
+            self._trace_instrument(instrument, name)
+        return self._scpi_tracer
+
+    def stop_scpi_trace(self, filename: str = None) -> Union[None, ScpiTracer]:
+        """
+        Stop tracing, print where the instrument time went and write the calls to filename when given.
+        """
+        tracer, self._scpi_tracer = self._scpi_tracer, None
+        if tracer is None:
+            return None
+        for instrument in [self._daq970a, self._keysight_e36234a, self._keysight_e36312a, self._keysight_n5748a]:
+            if isinstance(instrument, InstrumentBase):
+                instrument.disable_trace()
+        print(tracer.summary())
+        if filename is not None:
+            tracer.dump(filename)
+        return tracer
+
+    def start_bus_recording(self, filename: str = 'mpsse_trace.bin') -> None:
+        # Every byte on both cable ports, replay with python -m instrument_lib.sim.sim_mpsse <filename>
+        with self._daq_lock:
+            self._amc7836.io.start_recording(filename)
+
+    def stop_bus_recording(self) -> None:
+        with self._daq_lock:
+            self._amc7836.io.stop_recording()
+
+    def clear_gate_dacs(self) -> None:
+        with self._daq_lock:
+            self._interlock.clear_dacs_now()
+
+    def arm_interlock(self, channels: list[InterlockChannel]) -> None:
+        """
+        Let the AMC7836 pinch off the gates when a drain current passes its limit and start the watchdog that
+        then turns off every supply. Call after the power up sequence, the thresholds apply at once.
+        """
+        self._interlock = HardwareInterlock(self._amc7836, channels,
+                                            ['DACA0_DATA_LO', 'DACA1_DATA_LO', 'DACA2_DATA_LO'])
+        with self._daq_lock:
+            self._interlock.program()
+
+        shutdown_actions = {}
+        if self._keysight_n5748a is not None:
+            shutdown_actions['n5748a'] = self.power_down_keysight_n5748a
+        if self._keysight_e36312a is not None:
+            shutdown_actions['e36312a'] = self.power_down_keysight_e36312a
+        if self._keysight_e36234a is not None:
+            shutdown_actions['e36234a'] = self.power_down_keysight_e36234a
+        # All run at once on a trip
+
+        self._watchdog = InterlockWatchdog(self._interlock.read_status, shutdown_actions, channels,
+                                           lock=self._daq_lock, on_trip=print,
+                                           clear_gates=self._interlock.clear_dacs_now)
+        # The status read ends the hardware clear, the watchdog clears the gates by software before anything
+        # else gets the cable
+        self._watchdog.arm()
+
+    def disarm_interlock(self) -> Union[None, TripReport]:
+        if self._watchdog is None:
+            return None
+        report = self._watchdog.disarm()
+        self._watchdog = None
+        if report is None:
+            with self._daq_lock:
+                self._interlock.release()
+        # After a trip the gates stay cleared until the DAC codes are known to be safe
+        return report
+
+    def scan_channels(self) -> list:
+        return [self._daq_current_vdd2_channel, self._daq_current_vdd3_c_channel]
     
     def scan_start_time(self):
-        datetime_str = self.query("SYSTem:TIME:SCAN?")
+        datetime_str = self._daq970a.retrieve_date_time()
         start_datetime = datetime.strptime(datetime_str, "%Y,%m,%d,%H,%M,%S.%f")
         return start_datetime
 
     def save_measurements_to_csv(self, measurements: list, timestamp: datetime, filename: str) -> None:
+        # Written at once to filename, stream_scan is the path that logs through MeasurementLogger
         with open(filename, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(["Timestamp", "CurrentVDD2", "CurrentVDD3_C"])
@@ -245,58 +712,77 @@ class DeviceUnderTest:
     '''
 
     def power_down_keysight_e36234a(self) -> None:
-        self._keysight_e36234a.set_output_voltage('1,2', 0)
-        # Channel 1 and 2: 0V
-
-        self._keysight_e36234a.set_output_current('1,2', 0)
-        # Set the output current for channels 1 and 2 to 0A
-
-        self._keysight_e36234a.enable_output('1,2', True)
+        self.configure_supply('e36234a', ch='1,2', voltage=0, current=0, enable=False)
+        # Channel 1 and 2: 0V, 0A, output disabled
     
     def power_down_keysight_e36312a(self) -> None:
+        self.configure_supply('e36312a', ch='1,2,3', voltage=0, current=0, enable=False)
+        # Channel 1, 2 and 3: 0V, 0A, output disabled
 
-        self._keysight_e36312a.set_output_voltage(1, 5)
-        self._keysight_e36234a.set_output_current(2, 5)
-        # Channel 1: 0V, 0A
+    def power_down_keysight_n5748a(self) -> None:
+        self.configure_supply('n5748a', voltage=0, current=0, enable=False)
+        # 0V, 0A, output disabled
 
-        self._keysight_e36312a.set_output_voltage(2, 25)
-        self._keysight_e36234a.set_output_current(2, 1)
-        # Channel 2: 0V, 0A
+    def power_down_sequence(self) -> SequenceTrace:
+        sequencer = Sequencer('power down')
 
-        self._keysight_e36312a.set_output_voltage(3, 25)
-        self._keysight_e36234a.set_output_current(3, 1)
-        # Channel 3: 0V, 0A
+        sequencer.add(SequenceStep('vdd1_off', self.power_down_keysight_e36312a, resource='e36312a'))
+        sequencer.add(SequenceStep('vdd1_discharged', condition=lambda: self.rail_within(self._keysight_e36312a, 1, 0),
+                                   depends_on=['vdd1_off'], resource='e36312a', timeout=self._delay_sec))
+        sequencer.add(SequenceStep('drain_currents_off', condition=lambda: self.drain_currents_below(self._drain_off_a),
+                                   depends_on=['vdd1_off'], resource='daq970a', timeout=self._delay_sec))
+        # Both are checked concurrently
 
-        self._keysight_e36234a.enable_output('1,2,3', True)
-        # Enable output
+        sequencer.add(SequenceStep('gates_off',
+                                   lambda: self.ramp_dac_codes({'DACA0_DATA_LO': 0, 'DACA1_DATA_LO': 0,
+                                                                'DACA2_DATA_LO': 0}, self._gate_slew_v_per_s),
+                                   depends_on=['vdd1_discharged', 'drain_currents_off'], resource='amc7836'))
+        # Pinch off VGG2, VGG3_C, VGG3_P only once the drains are down
 
-    def power_down_keysight_n5748a(self) -> None:
-        self._keysight_n5748a.set_output_voltage(1, 0)
-        # Channel 1: 0V, 0A
+        trace = sequencer.run()
+        print(trace)
+        return trace
 
-        self._keysight_n5748a.set_output_current(2, 0)
-        # Channel 2: 0V, 0A
+    def close_daq(self):
+        self._daq970a.close()
 
-        self._keysight_e36234a.enable_output(1, True)
-        # Enable output
+HTOL_STAGES = [('VGG2', 'DACA0_DATA_LO', '_daq_current_vdd2_channel'),
+               ('VGG3_C', 'DACA1_DATA_LO', '_daq_current_vdd3_c_channel')]
+# Stages regulated through the HTOL scan: name, gate DAC data register, drain current DAQ channel attribute
 
-    def power_down_sequence(self) -> None:
-        print('Powering down VDD1 to 0V')
-        self.power_down_keysight_e36312a()
-        print(f'Sleeping for {self._delay_sec} seconds...')
-        time.sleep(self._delay_sec)
 
-        print('Powering down VGG2, VGG3_C, VGG3_P')
-        dac_value = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        self.set_dac_voltage(self._amc7836.REGISTER_ADDRESSES['DACA0_DATA_LO'], dac_value)
-        print(f'Sleeping for {self._delay_sec} seconds...')
-        time.sleep(self._delay_sec)
+def protect_and_regulate(test: DeviceUnderTest, codes: dict) -> None:
+    test.arm_interlock([InterlockChannel('VDD2', 16, 0.15), InterlockChannel('VDD3_C', 17, 0.15)])
+    # Trip at 150mA, the VDD2 and VDD3_C current sense outputs go to LV_ADC16 and LV_ADC17
+
+    test.start_regulation([RegulatedStage(name, key, getattr(test, channel), 0.1, codes[name])
+                           for name, key, channel in HTOL_STAGES])
+    # Hold the drain currents through the scan, the stage channels are in the scan list so the regulator
+    # follows the scan readings
+
+    test.start_register_history()
+    # One register snapshot a minute, ask the history when a register changed after the run
+
+
+def finish_htol_scan(test: DeviceUnderTest, journal: RunJournal, logger: MeasurementLogger,
+                     sweep_count: int) -> None:
+    test.stop_register_history()
+    test.stop_regulation()
+    trip = test.disarm_interlock()
+    if trip is not None:
+        print('Scan ended by an interlock trip')
+    journal.finish_run()
+    journal.close()
+
+    print(f"{sweep_count} sweeps saved to {', '.join(logger.files)}")
 
-    def close_daq(self):
-        self._daq970a.close()
 
 def interval_based_scan():
     test = DeviceUnderTest()
+    journal = RunJournal('htol_journal.jsonl')
+    journal.start_run()
+    test.use_journal(journal)
+    # resume_interval_based_scan picks the run up from here after a crash
 
     print(f'Configuring DAQ970A...')
     test.configure_daq970a()
@@ -309,26 +795,96 @@ def interval_based_scan():
     test.power_up_sequence()
 
     print(f'Start VGG2 Bias Search for 20mA"')
-    test.adjust_gate_voltage('DACA0_DATA_LO', 2990, 104, 0.02)
-    print(f'Start VGG2 Bias Search for 100mA"')
-    test.adjust_gate_voltage('DACA0_DATA_LO', 2990, 104, 0.1)
-    # IMPORTANT: I am only adjusting gate voltage once for this example, for practical use call the function inside of a for loop
+    report = test.adjust_gate_voltage('DACA0_DATA_LO', 2990, 104, 0.02)
+    print(f'Start VGG2 and VGG3_C Bias Search for 100mA"')
+    stages = [
+        BiasStage('VGG2', 'DACA0_DATA_LO', test._daq_current_vdd2_channel, 0.1, report.code),
+        BiasStage('VGG3_C', 'DACA1_DATA_LO', test._daq_current_vdd3_c_channel, 0.1, 2990),
+    ]
+    bias = test.adjust_gate_voltages(stages)
+    # VGG2 starts from the code found by the first search, add a BiasStage for every stage to bias together
+
+    protect_and_regulate(test, bias.codes)
 
     interval_count = 30  
     interval_length = 10  
 
     print(f'Configuring DAQ970A to perform 30 scans at 10-second intervals')
-    data = test.configure_scan(interval_count, interval_length)
-    start_time = test.scan_start_time()
+    store = HtolStore('htol_store', ["CurrentVDD2", "CurrentVDD3_C"])
+    # Drain current history of the whole run, query it with store.query(start, end) while the scan runs and
+    # its 10 s to 1 day statistics with HtolRollup(store).query(start, end)
+    with MeasurementLogger('measurements', ["CurrentVDD2", "CurrentVDD3_C"]) as logger, \
+            store.writer() as store_writer, HtolRollup(store).writer() as rollup_writer:
+        sweep_count = test.stream_scan(interval_count, interval_length, logger, store_writer, rollup_writer)
+    # One row per sweep, both channels of the sweep together, stamped with the instrument scan time.
+    # Rows reach the file as the scan runs, a crash loses at most the last fsync interval
+    finish_htol_scan(test, journal, logger, sweep_count)
+
+
+def resume_interval_based_scan(serial_number: str = None):
+    # Pick up an interval_based_scan run after a crash of the host, from its journal
+    journal = RunJournal('htol_journal.jsonl')
+    if not journal.state.started or journal.state.finished:
+        print('No unfinished run in the journal')
+        journal.close()
+        return
 
-    parsed_measurements = []
+    test = DeviceUnderTest()
+    test.use_journal(journal)
+    test.configure_daq970a(reset=False)
+    state = test.resume(serial_number)
+    # Gates and supplies are back at bias before anything else is done
+
+    if not state.scan_in_progress:
+        journal.close()
+        print('The journaled run has no scan to reattach, the DUT is left at the journaled bias')
+        return
+
+    protect_and_regulate(test, {name: state.dac_codes[test._amc7836.REGISTER_ADDRESSES[key]]
+                                for name, key, _ in HTOL_STAGES})
+
+    store = HtolStore('htol_store', ["CurrentVDD2", "CurrentVDD3_C"])
+    with MeasurementLogger('measurements', ["CurrentVDD2", "CurrentVDD3_C"]) as logger, \
+            store.writer() as store_writer, HtolRollup(store).writer() as rollup_writer:
+        sweep_count = test.reattach_scan(logger, store_writer, rollup_writer)
+    # The logger starts new files, the store carries on after the last sweep it holds
+    finish_htol_scan(test, journal, logger, sweep_count)
+
+
+def dut_worker(config: DutConfig, instruments: dict) -> dict:
+    # Runs in its own process for every DUT of chamber_bias, the shared instruments are broker proxies
+    test = DeviceUnderTest()
+    test.use_instruments(**instruments)
+    test.use_bias_cache(BiasCache(f'bias_cache_{config.ftdi_serial}.json'))
+    # One cache file per cable so the worker processes never write the same file
+
+    test.configure_amc7836(config.ftdi_serial)
+    report = test.adjust_gate_voltages([BiasStage(**stage) for stage in config.stages])
+    return {'codes': report.codes, 'currents': report.currents, 'converged': report.converged,
+            'rail_currents': test.measure_rail_currents(config.supply_channels)}
+
+
+def chamber_bias(mapping: dict) -> dict:
+    """
+    Bias every DUT in the chamber at once. mapping is FTDI cable serial -> DutConfig arguments, e.g.
+    {'FT5XK2Q1': {'name': 'DUT1', 'stages': [{'name': 'VGG2', 'dac_address_key': 'DACA0_DATA_LO',
+    'daq_ch': 111, 'target': 0.1, 'start_code': 2990}], 'supply_channels': {'e36312a': [2, 3]}}}
+    """
+    chamber = DeviceUnderTest()
+    chamber.configure_daq970a()
+
+    configs = Orchestrator.discover(mapping)
+    instruments = {'daq970a': chamber._daq970a}
+    for config in configs:
+        for name in config.supply_channels:
+            instruments[name] = chamber._supply(name)
+    # The supplies feeding several DUTs stay in this process, the workers reach them through the broker
+
+    orchestrator = Orchestrator(configs, instruments, dut_worker)
+    results = orchestrator.run()
+    chamber.close_daq()
+    return results
 
-    for i in range(interval_count):
-        timestamp = start_time + timedelta( seconds = interval_length * i)
-        parsed_measurements.append((timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), data[i]))
-    
-    test.save_measurements_to_csv(parsed_measurements, timestamp, 'measurements.csv')
-    
 
 if __name__ == '__main__':
     interval_based_scan()
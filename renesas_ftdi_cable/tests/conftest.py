@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The packages import as instrument_lib and htol_lib from the renesas_ftdi_cable directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The simulators are raw TCP sockets, the pure Python VISA backend is enough to open them
+os.environ.setdefault('PYVISA_LIBRARY', '@py')
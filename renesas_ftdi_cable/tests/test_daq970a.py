@@ -0,0 +1,49 @@
+import pytest
+
+from instrument_lib.daq.keysight_daq970a import KeysightDaq970a
+from instrument_lib.sim.dut_model import DutModel
+from instrument_lib.sim.sim_daq970a import SimulatedDaq970a
+
+
+@pytest.fixture
+def daq():
+    model = DutModel(noise_std=0.0, seed=1)
+    server = SimulatedDaq970a(model, time_scale=100.0)
+    server.start()
+    instrument = KeysightDaq970a(server.resource_name)
+    yield model, server, instrument
+    instrument.close()
+    server.stop()
+
+
+def test_read_voltage_after_formatted_scan(daq):
+    model, server, instrument = daq
+    stage = model.stages[0]
+    model.set_dac_code(stage.dac_address, 2880)
+    channels = list(stage.daq_channels)
+
+    instrument.apply_profile('precise', channels)
+    instrument.configure_reading_format()
+    instrument.start_timer_scan(3, 1.0)
+    instrument.query("FETC?")
+
+    values = instrument.read_voltage(channels, 'fast')
+    # One plain value per channel, not the time, channel and alarm fields of three sweeps
+    assert len(values) == len(channels)
+    for ch, value in zip(channels, values):
+        assert value == pytest.approx(model.daq_voltage(ch), abs=1E-6)
+    assert server.trigger_source == 'IMM'
+    assert server.trigger_count == 1
+
+
+def test_read_voltage_applies_profile_again_after_scan(daq):
+    model, server, instrument = daq
+    ch = model.stages[0].daq_channels[0]
+    instrument.read_voltage(ch, 'fast')
+    instrument.start_timer_scan(2, 1.0)
+    instrument.query("FETC?")
+
+    instrument.read_voltage(ch, 'fast')
+    # The same profile as before the scan, still the triggers have to be set back
+    assert server.trigger_count == 1
+    assert server.trigger_source == 'IMM'
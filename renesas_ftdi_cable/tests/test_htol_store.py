@@ -0,0 +1,101 @@
+import os
+
+import numpy
+import pytest
+
+from htol_lib.htol_store import ACTIVE_FILE, COMPACTED_DIR, HtolStore
+
+COLUMNS = ['CurrentVDD2', 'CurrentVDD3_C']
+START = numpy.datetime64('2026-01-01T00:00:00', 'ns')
+
+
+def rows(first: int, count: int) -> tuple:
+    timestamps = START + numpy.arange(first, first + count) * numpy.timedelta64(1, 's')
+    values = numpy.column_stack([numpy.arange(first, first + count), -numpy.arange(first, first + count)])
+    return timestamps, values.astype(float)
+
+
+def write_segments(store: HtolStore, counts: list) -> int:
+    first = 0
+    for count in counts:
+        with store.writer() as writer:
+            writer.append(*rows(first, count))
+        first += count
+    return first
+
+
+def crash(writer) -> None:
+    # Drop the files and the lock as a killed process would, the ACTIVE marker stays
+    for file in [writer._timestamps, writer._index, writer._active] + list(writer._values.values()):
+        file.close()
+
+
+def test_query_round_trip(tmp_path):
+    store = HtolStore(str(tmp_path / 'store'), COLUMNS, index_stride=16)
+    total = write_segments(store, [100, 50])
+
+    window = store.query(START + numpy.timedelta64(90, 's'), START + numpy.timedelta64(110, 's'))
+    assert window.rows == 20
+    assert not window.zero_copy
+    assert list(window.column('CurrentVDD2')) == list(range(90, 110))
+    assert window.timestamps[0] == START + numpy.timedelta64(90, 's')
+    assert HtolStore(str(tmp_path / 'store')).rows() == total
+
+
+def test_compact_merges_segments(tmp_path):
+    store = HtolStore(str(tmp_path / 'store'), COLUMNS, index_stride=16)
+    total = write_segments(store, [100, 50, 30])
+
+    assert store.compact(chunk_rows=32) == 0
+    assert len(store.segments()) == 1
+    window = store.query()
+    assert window.zero_copy
+    assert window.rows == total
+    assert list(window.column('CurrentVDD3_C')) == list(-numpy.arange(total))
+
+
+def test_compaction_interrupted_after_merge_is_finished_on_open(tmp_path, monkeypatch):
+    root = str(tmp_path / 'store')
+    store = HtolStore(root, COLUMNS, index_stride=16)
+    total = write_segments(store, [100, 50])
+
+    def killed():
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(store, '_finish_compaction', killed)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact()
+    assert os.path.exists(os.path.join(root, 'segments', COMPACTED_DIR))
+
+    reopened = HtolStore(root)
+    assert not os.path.exists(os.path.join(root, 'segments', COMPACTED_DIR))
+    assert len(reopened.segments()) == 1
+    assert list(reopened.query().column('CurrentVDD2')) == list(range(total))
+
+
+def test_stale_active_marker_is_cleared_on_open(tmp_path):
+    root = str(tmp_path / 'store')
+    store = HtolStore(root, COLUMNS, index_stride=16)
+    write_segments(store, [100])
+    writer = store.writer()
+    writer.append(*rows(100, 10))
+    crash(writer)
+    assert store.segments()[-1].active
+
+    reopened = HtolStore(root)
+    assert not reopened.segments()[-1].active
+    reopened.compact()
+    assert reopened.rows() == 110
+
+
+def test_live_writer_keeps_its_segment(tmp_path):
+    root = str(tmp_path / 'store')
+    store = HtolStore(root, COLUMNS, index_stride=16)
+    write_segments(store, [100, 20])
+    with store.writer() as writer:
+        writer.append(*rows(120, 10))
+        reopened = HtolStore(root)
+        assert os.path.exists(os.path.join(writer.path, ACTIVE_FILE))
+        reopened.compact()
+        assert [segment.active for segment in reopened.segments()] == [False, True]
+    assert reopened.rows() == 130
@@ -0,0 +1,74 @@
+import threading
+
+from htol_lib.interlock import HardwareInterlock, InterlockChannel, InterlockWatchdog
+from instrument_lib.sim.sim_mpsse import simulated_amc7836
+
+
+def make_interlock():
+    amc7836, chip = simulated_amc7836()
+    channels = [InterlockChannel('driver', 16, 0.5), InterlockChannel('carrier', 17, 1.0)]
+    interlock = HardwareInterlock(amc7836, channels, ['DACA0_DATA_LO', 'DACA1_DATA_LO'])
+    return amc7836, chip, interlock
+
+
+def register(amc7836, chip, key: str) -> int:
+    return chip.registers[amc7836.REGISTER_ADDRESSES[key]]
+
+
+def test_program_arms_every_alarm_register():
+    amc7836, chip, interlock = make_interlock()
+    interlock.program()
+
+    code = InterlockChannel('driver', 16, 0.5).upper_code
+    assert register(amc7836, chip, 'ADC16_UP_THR_LO') == code & 0xFF
+    assert register(amc7836, chip, 'ADC16_UP_THR_HI') == code >> 8
+    assert register(amc7836, chip, 'DAC_CLR_EN0') == 0x03
+    assert register(amc7836, chip, 'DAC_CLR_SRC0') == 0x03
+    assert register(amc7836, chip, 'ALARMOUT_SRC0') == 0x03
+    assert register(amc7836, chip, 'ADC_MUX2') & 0x03 == 0x03
+    assert register(amc7836, chip, 'ADC_PD2') & 0x01
+    assert register(amc7836, chip, 'ADC_CFG') == HardwareInterlock.ADC_CFG_AUTO
+
+
+def test_program_keeps_other_bits_of_updated_registers():
+    amc7836, chip, interlock = make_interlock()
+    chip.registers[amc7836.REGISTER_ADDRESSES['GPIO_CFG']] = 0x40
+    interlock.program()
+    assert register(amc7836, chip, 'GPIO_CFG') == 0x42
+
+
+def test_release_and_software_clear():
+    amc7836, chip, interlock = make_interlock()
+    interlock.program()
+    interlock.clear_dacs_now()
+    assert register(amc7836, chip, 'DAC_CLR0') == 0x03
+    interlock.release()
+    assert register(amc7836, chip, 'DAC_CLR0') == 0x00
+    assert register(amc7836, chip, 'DAC_CLR_SRC0') == 0x00
+    assert not interlock.read_status().tripped
+
+
+def test_gates_stay_cleared_after_the_trip_poll():
+    amc7836, chip, interlock = make_interlock()
+    interlock.program()
+    lock = threading.RLock()
+    cleared_at_shutdown = []
+
+    def power_down():
+        cleared_at_shutdown.append(chip.cleared_dacs)
+
+    watchdog = InterlockWatchdog(interlock.read_status, {'n5748a': power_down}, interlock.channels,
+                                 poll_interval=0.001, lock=lock, clear_gates=interlock.clear_dacs_now)
+    watchdog.arm()
+    with lock:
+        chip.alarm(stat0=0x01)
+        assert chip.cleared_dacs == 0x03
+    assert watchdog.tripped.wait(5)
+    report = watchdog.disarm()
+
+    # The poll read the alarm away, the software clear holds the gates from then on
+    assert report.alarms == ['driver']
+    assert chip.registers[chip.ALARM_STAT0] == 0
+    assert chip.cleared_dacs == 0x03
+    assert cleared_at_shutdown == [0x03]
+    assert report.succeeded
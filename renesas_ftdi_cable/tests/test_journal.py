@@ -0,0 +1,47 @@
+from htol_lib.journal import RunJournal
+
+
+def write_run(filename: str, **kwargs) -> RunJournal:
+    journal = RunJournal(filename, fsync=False, **kwargs)
+    journal.start_run()
+    journal.record('registers', address=0x14, values=[0x02])
+    journal.record('dac_codes', codes={0x50: 2880, 0x52: 2990})
+    journal.record('supply', name='e36312a', settings={'ch': '1,2,3', 'voltage': [5, 25, 25]})
+    journal.record('scan', settings={'interval_count': 30, 'interval_length': 10})
+    journal.record('scan_progress', sweeps=12)
+    return journal
+
+
+def test_replay_ignores_torn_last_line(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    write_run(filename).close()
+    with open(filename, mode='a') as file:
+        file.write('{"seq": 8, "time": "2026-01-01T00:00:00.000", "kind": "dac_codes", "codes": {"80": 30')
+
+    journal = RunJournal(filename, fsync=False)
+    state = journal.state
+    assert state.dac_codes == {0x50: 2880, 0x52: 2990}
+    assert state.scan_in_progress
+    assert state.scan['sweeps'] == 12
+
+    # The torn line is cut, so the next record starts on a line of its own
+    journal.record('dac_codes', codes={0x50: 3000})
+    journal.close()
+    assert RunJournal(filename, fsync=False).replay().dac_codes == {0x50: 3000, 0x52: 2990}
+
+
+def test_replay_after_snapshot(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    journal = write_run(filename, max_records=3)
+    journal.record('scan_end')
+    journal.close()
+    sequence = journal.state.last_sequence
+
+    with open(filename) as file:
+        assert len(file.readlines()) < 7
+    state = RunJournal(filename, fsync=False).state
+    assert state.started
+    assert state.registers == {0x14: [0x02]}
+    assert state.supplies == {'e36312a': {'ch': '1,2,3', 'voltage': [5, 25, 25]}}
+    assert not state.scan_in_progress
+    assert state.last_sequence == sequence
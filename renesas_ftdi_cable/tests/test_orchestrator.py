@@ -0,0 +1,75 @@
+import os
+
+import numpy
+import pytest
+
+from htol_lib.orchestrator import DutConfig, Orchestrator
+
+
+class FakeDaq:
+
+    def read_voltage(self, ch, profile='balanced'):
+        return [float(channel) / 1000 for channel in ch] if isinstance(ch, list) else float(ch) / 1000
+
+
+class FakeSupply:
+
+    def measure_currents(self, ch):
+        return numpy.array([channel / 10 for channel in ch])
+
+
+def supply_worker(config, instruments):
+    return {name: list(instruments[name].measure_currents(channels))
+            for name, channels in config.supply_channels.items()}
+
+
+def measuring_worker(config, instruments):
+    return instruments['daq970a'].read_voltage(config.daq_channels, 'fast')
+
+
+def exiting_worker(config, instruments):
+    # As Amc7836Init.init does when the cable does not answer
+    exit()
+
+
+def dying_worker(config, instruments):
+    if config.name == 'DUT2':
+        os._exit(3)
+    return measuring_worker(config, instruments)
+
+
+def configs():
+    return [DutConfig('DUT1', 'FT000001', [{'daq_ch': 111}, {'daq_ch': 112}]),
+            DutConfig('DUT2', 'FT000002', [{'daq_ch': 113}])]
+
+
+def test_workers_share_the_daq():
+    results = Orchestrator(configs(), {'daq970a': FakeDaq()}, measuring_worker).run(timeout=30)
+    assert results == {'DUT1': [0.111, 0.112], 'DUT2': [0.113]}
+
+
+def test_worker_calling_exit_is_a_failure():
+    results = Orchestrator(configs(), {'daq970a': FakeDaq()}, exiting_worker).run(timeout=30)
+    assert all(isinstance(result, Exception) for result in results.values())
+    assert 'SystemExit' in str(results['DUT1'])
+
+
+def test_dead_worker_is_a_failure():
+    results = Orchestrator(configs(), {'daq970a': FakeDaq()}, dying_worker).run(timeout=30)
+    assert results['DUT1'] == [0.111, 0.112]
+    assert isinstance(results['DUT2'], Exception)
+    assert 'code 3' in str(results['DUT2'])
+
+
+def test_workers_reach_their_supply_channels():
+    configs = [DutConfig('DUT1', 'FT000001', [{'daq_ch': 111}], {'e36312a': [2, 3]}),
+               DutConfig('DUT2', 'FT000002', [{'daq_ch': 113}], {'e36234a': [1]})]
+    instruments = {'daq970a': FakeDaq(), 'e36312a': FakeSupply(), 'e36234a': FakeSupply()}
+    results = Orchestrator(configs, instruments, supply_worker).run(timeout=30)
+    assert results == {'DUT1': {'e36312a': [0.2, 0.3]}, 'DUT2': {'e36234a': [0.1]}}
+
+
+def test_supply_must_be_shared():
+    configs = [DutConfig('DUT1', 'FT000001', [{'daq_ch': 111}], {'n5748a': [1]})]
+    with pytest.raises(Exception, match='n5748a'):
+        Orchestrator(configs, {'daq970a': FakeDaq()}, supply_worker)
@@ -0,0 +1,62 @@
+import pytest
+
+from instrument_lib.power_supply.keysight_e36312a import KeysightE36312a
+from instrument_lib.sim.dut_model import DutModel
+from instrument_lib.sim.sim_power_supply import simulated_e36312a
+
+
+@pytest.fixture
+def supply():
+    server = simulated_e36312a(DutModel(seed=1))
+    server.start()
+    instrument = KeysightE36312a(server.resource_name)
+    yield server, instrument
+    instrument.close()
+    server.stop()
+
+
+def test_unchanged_settings_are_not_sent(supply):
+    server, instrument = supply
+    instrument.configure_outputs('1,2', voltage=5.0, current=1.0)
+    server.state[1]['voltage'] = 3.0
+    instrument.configure_outputs('1,2', voltage=5.0, current=1.0)
+    # The shadow already holds 5 V, so the change behind its back is not overwritten
+    assert server.state[1]['voltage'] == 3.0
+
+
+def test_failed_write_is_sent_again(supply, monkeypatch):
+    server, instrument = supply
+
+    def fail(commands, wait=True):
+        raise Exception('write failed')
+
+    monkeypatch.setattr(instrument, 'write_batch', fail)
+    with pytest.raises(Exception):
+        instrument.configure_outputs(1, voltage=12.0)
+    assert instrument.get_state(1)['voltage'] is None
+
+    monkeypatch.undo()
+    instrument.configure_outputs(1, voltage=12.0)
+    assert server.state[1]['voltage'] == 12.0
+    assert instrument.get_state(1)['voltage'] == 12.0
+
+
+def test_failed_single_write_is_sent_again(supply, monkeypatch):
+    server, instrument = supply
+    write = instrument.write
+    calls = []
+
+    def fail_once(command):
+        calls.append(command)
+        if len(calls) == 1:
+            raise Exception('write failed')
+        write(command)
+
+    monkeypatch.setattr(instrument, 'write', fail_once)
+    with pytest.raises(Exception):
+        instrument.enable_output(2, True)
+    instrument.enable_output(2, True)
+    instrument.query("*OPC?")
+    # The write has no response, wait until the simulator has handled it
+    assert server.state[2]['output'] is True
+    assert len(calls) == 2
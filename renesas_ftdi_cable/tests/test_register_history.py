@@ -0,0 +1,15 @@
+from instrument_lib.dac.register_history import IMAGE_SIZE, read_image
+from instrument_lib.sim.sim_mpsse import simulated_amc7836
+
+
+def test_read_image_leaves_latched_alarms():
+    amc7836, chip = simulated_amc7836(reset_values={0x40: 0x12, 0x73: 0x34, 0xC0: 0x56})
+    chip.alarm(stat0=0x01)
+
+    image = read_image(amc7836)
+    assert image.size == IMAGE_SIZE
+    assert (image[0x40], image[0x73], image[0xC0]) == (0x12, 0x34, 0x56)
+    assert list(image[0x70:0x73]) == [0, 0, 0]
+    # The alarm is still there for the watchdog
+    assert chip.status_reads == 0
+    assert chip.registers[chip.ALARM_STAT0] == 0x01
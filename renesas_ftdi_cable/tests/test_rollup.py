@@ -0,0 +1,51 @@
+import numpy
+import pytest
+
+from htol_lib.htol_store import HtolStore
+from htol_lib.rollup import HtolRollup
+
+COLUMNS = ['CurrentVDD2', 'CurrentVDD3_C']
+START = numpy.datetime64('2026-01-01T00:00:00', 'ns')
+
+
+def feed(store: HtolStore, rollup: HtolRollup, first: int, count: int) -> tuple:
+    timestamps = START + numpy.arange(first, first + count) * numpy.timedelta64(1, 's')
+    values = numpy.column_stack([numpy.sin(numpy.arange(first, first + count)), numpy.arange(first, first + count)])
+    with store.writer() as store_writer, rollup.writer() as rollup_writer:
+        for low in range(0, count, 7):
+            store_writer.append(timestamps[low:low + 7], values[low:low + 7])
+            rollup_writer.append(timestamps[low:low + 7], values[low:low + 7])
+    return timestamps, values
+
+
+def test_every_tier_covers_every_row(tmp_path):
+    store = HtolStore(str(tmp_path / 'store'), COLUMNS)
+    rollup = HtolRollup(store, [10, 60])
+    _, values = feed(store, rollup, 0, 125)
+
+    for resolution in [10, 60]:
+        window = rollup.query(resolution=resolution)
+        # The last bucket is still open, it comes from the raw rows
+        assert window.rows == -(-125 // resolution)
+        summary = window.summary()
+        assert summary['CurrentVDD2']['count'] == 125
+        assert summary['CurrentVDD2']['mean'] == pytest.approx(values[:, 0].mean())
+        assert summary['CurrentVDD3_C']['std'] == pytest.approx(values[:, 1].std(ddof=1))
+        assert summary['CurrentVDD3_C']['max'] == 124
+
+
+def test_query_after_reopening(tmp_path):
+    root = str(tmp_path / 'store')
+    store = HtolStore(root, COLUMNS)
+    feed(store, HtolRollup(store, [10, 60]), 0, 125)
+    feed(store, HtolRollup(store, [10, 60]), 125, 40)
+
+    rollup = HtolRollup(HtolStore(root), [10, 60])
+    window = rollup.query(resolution=10)
+    assert window.rows == 17
+    assert list(window.count) == [10.0] * 16 + [5.0]
+    assert window.column('CurrentVDD3_C', 'max')[-1] == 164
+
+    part = rollup.query(START + numpy.timedelta64(155, 's'), START + numpy.timedelta64(175, 's'), resolution=10)
+    assert list(part.timestamps) == [START + numpy.timedelta64(160, 's')]
+    assert list(part.count) == [5.0]
@@ -0,0 +1,23 @@
+import pytest
+
+from htol_lib.bias_search import BiasSearch
+from htol_lib.sweep import IdVgSweep, linear_codes
+
+
+def test_sweep_reads_every_point_both_ways():
+    written = []
+    sweep = IdVgSweep(written.append, lambda channels: [0.001 * len(written)] * len(channels), [111, 112])
+    result = sweep.run({'DACA0_DATA_LO': linear_codes(2800, 2900, 5)}, bidirectional=True)
+
+    assert result.point_count == 9
+    assert [codes['DACA0_DATA_LO'] for codes in written] == [2800, 2825, 2850, 2875, 2900, 2875, 2850, 2825, 2800]
+    codes, difference = result.hysteresis(111)
+    assert list(codes) == [2800, 2825, 2850, 2875]
+
+
+def test_schedule_above_the_gate_limit_is_refused():
+    written = []
+    sweep = IdVgSweep(written.append, lambda channels: [0.0] * len(channels), [111])
+    with pytest.raises(Exception):
+        sweep.run({'DACA0_DATA_LO': linear_codes(3000, BiasSearch.CODE_LIMIT, 4)})
+    assert written == []